@@ -2,6 +2,7 @@ from typing import List, Iterable, Dict
 from enum import Enum
 import itertools
 import struct
+from rombuffer import RomData, packInto
 
 
 class PrintOpts:
@@ -25,9 +26,22 @@ class ChipT:
     flags: I documented some of these, but some of them do not seem to be fully consistent
     """
 
+    __slots__ = (
+        "hp",
+        "pri",
+        "ap",
+        "mb",
+        "flags",
+        "rarity",
+        "chipCategory",
+        "hitChance",
+        "dodgeChance",
+        "artIndex",
+        "palleteIndex",
+    )
     myStruct = struct.Struct("<5H6B")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (
             self.hp,
             self.pri,
@@ -43,7 +57,8 @@ class ChipT:
         ) = ChipT.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        ChipT.myStruct.pack_into(
+        packInto(
+            ChipT.myStruct,
             data,
             offset,
             self.hp,
@@ -105,9 +120,21 @@ class EncounterT:
     thresh: thresholds at which the AI will slot in
     """
 
+    __slots__ = (
+        "chips",
+        "idx",
+        "u1",
+        "u2",
+        "u3",
+        "op",
+        "navi",
+        "altNavi",
+        "slotBotThresh",
+        "slotTopThresh",
+    )
     myStruct = struct.Struct("<20B")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         self.chips = [0] * 11
         (
             self.idx,
@@ -123,7 +150,8 @@ class EncounterT:
         ) = EncounterT.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        EncounterT.myStruct.pack_into(
+        packInto(
+            EncounterT.myStruct,
             data,
             offset,
             self.idx,
@@ -159,14 +187,16 @@ class StartingChipsT:
     The list of chips in your starting folder
     """
 
+    __slots__ = ("chips",)
     myStruct = struct.Struct("<7B")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         self.chips = [0] * 7
         (*self.chips,) = StartingChipsT.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        StartingChipsT.myStruct.pack_into(
+        packInto(
+            StartingChipsT.myStruct,
             data,
             offset,
             *self.chips,
@@ -252,7 +282,7 @@ class MMChar:
         return (char >> 8) == 0x80
 
 
-def parsePtr(data: bytearray, offset: int) -> int:
+def parsePtr(data: RomData, offset: int) -> int:
     romLoadOffset = 0x08000000
     (namePtr,) = struct.unpack_from("<I", data, offset)
     namePtr -= romLoadOffset
@@ -267,9 +297,11 @@ class StringT:
     out
     """
 
+    __slots__ = ("chars", "lengths", "format", "indirect")
+
     def __init__(
         self,
-        data: bytearray,
+        data: RomData,
         offset: int,
         *,
         strCount: int = 1,
@@ -289,7 +321,7 @@ class StringT:
                 strCount -= 1
             namePtr += 2
 
-    def getNamePtr(self, data: bytearray, offset: int):
+    def getNamePtr(self, data: RomData, offset: int):
         basePtr = parsePtr(data, offset) if self.indirect else offset
         return parsePtr(data, basePtr)
 
@@ -334,7 +366,7 @@ class StringT:
             c | (self.format if not MMChar.isTerminator(c) else 0) for c in self.chars
         ]
         totLen = sum(len + 1 for len in self.lengths)
-        struct.pack_into(f"<{len(chars)}H", data, namePtr, *chars)
+        packInto(struct.Struct(f"<{len(chars)}H"), data, namePtr, *chars)
 
     def __str__(self):
         parts = []
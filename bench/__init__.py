@@ -0,0 +1,4 @@
+"""
+Benchmarks for the randomizer and tools; each module is run from the root
+of the repository as e.g `python -m bench.dispatch`
+"""
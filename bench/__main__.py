@@ -0,0 +1,374 @@
+#!/usr/bin/python
+
+import argparse
+import configparser
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from argparse import Namespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import cache
+import inspection
+import megadata
+import rando
+import rando_bcc
+import rando_bn2
+import search
+import synthrom
+from megadata import DataType, Game
+from rombuffer import RomBuffer
+
+"""
+Benchmark suite for the randomizer and tools: times rando.randomize end to
+end for each game over a fixed set of seeds, each randomization stage on
+its own, populateBN2Meta, search.search in each mode and the inspection.py
+dumps. Results are written as JSON and compared against a stored baseline:
+    python -m bench --bn2 bn2.gba --bcc bcc.gba --save
+    python -m bench --bn2 bn2.gba --bcc bcc.gba
+Games without a ROM are skipped; with no ROMs at all (or --synthetic), ROMs
+from synthrom are used, so the suite can run where the real ones can't.
+bench/baseline.json is recorded that way, and a plain python -m bench fails
+if any case regressed against it. Each case's time is compared relative to
+a fixed calibration workload timed just before it, so that baselines
+recorded on another machine (or while it was busier) still apply
+"""
+
+defaultBaseline = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# (name, pattern, search args) of each search mode benched
+searchCases: List[Tuple[str, List[int], Dict[str, Any]]] = [
+    ("plain", [0, 1], {}),
+    ("stride", [37, 12], {"stride": 3}),
+    ("dataSize", [0], {"dataSize": 2}),
+    ("delta", [1, 1], {"delta": True}),
+    ("deltaRooted", [300, 5], {"delta": True, "rooted": True, "stride": 2}),
+    ("deltaMiddleStart", [400, 2], {"delta": True, "middleStart": True}),
+    ("variable", [1, 2, 1, 3], {"variable": True}),
+]
+
+Case = Tuple[str, Callable[[], Any], Callable[[Any], Any]]
+
+
+def searchArgs(**kwargs) -> Namespace:
+    args = Namespace(
+        stride=1,
+        delta=False,
+        rooted=False,
+        middleStart=False,
+        variable=False,
+        dataSize=1,
+    )
+    for key, val in kwargs.items():
+        setattr(args, key, val)
+    return args
+
+
+def loadConfig(game: Game) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read("rando_bcc.conf" if game == Game.BCC else "rando_bn2.conf")
+    return config
+
+
+def randomizeCases(game: Game, rom: bytes, seeds: List[int]) -> List[Case]:
+    """
+    End to end randomization and each of its stages; every stage runs on a
+    fresh copy of the ROM prepared as rando.randomize would, untimed
+    """
+    config = loadConfig(game)
+
+    def randomizeAll(_):
+        for seed in seeds:
+            rando.randomize(RomBuffer(rom, skipUnchanged=True), config, seed)
+
+    cases: List[Case] = [(f"randomize/{game.name}", lambda: None, randomizeAll)]
+
+    stages: List[Tuple[str, Callable[[bytearray, configparser.ConfigParser], None]]]
+    if game == Game.BCC:
+        stages = [
+            ("randomizeChips", rando_bcc.randomizeChips),
+            ("randomizeEncounters", rando_bcc.randomizeEncounters),
+            ("randomizeNames", rando_bcc.randomizeNames),
+        ]
+    else:
+        encounterIndex = megadata.EncounterIndex.build(rom)
+        stages = [
+            ("randomizeChips", rando_bn2.randomizeChips),
+            (
+                "randomizeEncounters",
+                lambda data, config: rando_bn2.randomizeEncounters(
+                    data, config, encounterIndex
+                ),
+            ),
+            ("randomizeShops", rando_bn2.randomizeShops),
+            ("randomizeFolders", rando_bn2.randomizeFolders),
+            ("randomizeDropTables", rando_bn2.randomizeDropTables),
+            ("randomizeGMD", rando_bn2.randomizeGMD),
+        ]
+
+    def setup() -> List[RomBuffer]:
+        copies = [RomBuffer(rom, skipUnchanged=True) for _ in seeds]
+        if game == Game.BN2:
+            megadata.populateBN2Meta(rom)
+        return copies
+
+    for name, stage in stages:
+
+        def run(copies, stage=stage):
+            for seed, data in zip(seeds, copies):
+                random.seed(seed)
+                stage(data, config)
+
+        cases.append((f"stage/{game.name}/{name}", setup, run))
+
+    if game == Game.BN2:
+        cases.append(
+            ("populateBN2Meta", lambda: None, lambda _: megadata.populateBN2Meta(rom))
+        )
+        cases.append(
+            (
+                "encounterIndex",
+                lambda: None,
+                lambda _: megadata.EncounterIndex.build(rom),
+            )
+        )
+    return cases
+
+
+def searchCasesFor(rom: bytes, searchBytes: int) -> List[Case]:
+    # The reference search is slow enough that only a prefix of the ROM is used
+    data = rom[:searchBytes]
+    cases: List[Case] = []
+    for name, pattern, kwargs in searchCases:
+
+        def run(_, pattern=pattern, args=searchArgs(**kwargs)):
+            search.search(pattern, data, args)
+
+        cases.append((f"search/{name}", lambda: None, run))
+    return cases
+
+
+def inspectionCases(game: Game, rom: bytes) -> List[Case]:
+    cases: List[Case] = []
+    for type in DataType:
+        # Types with neither a parser nor a string layout can't be dumped
+        if type.getGame() != game or (
+            type.getInfo().parser is None and not type.isVarLengthString()
+        ):
+            continue
+
+        def run(_, type=type):
+            inspection.dump(rom, type)
+
+        cases.append((f"inspection/{type.name}", lambda: None, run))
+    return cases
+
+
+def calibrate(repeat: int = 3) -> float:
+    """
+    The time of a fixed pure Python workload, a measure of the speed of
+    the machine
+    """
+    times: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        table: Dict[int, int] = {}
+        for i in range(100000):
+            table[i & 0xFFF] = table.get(i & 0xFFF, 0) + (i * 7 >> 3)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def timeCase(setup: Callable[[], Any], run: Callable[[Any], Any], repeat: int):
+    calibration = calibrate()
+    times: List[float] = []
+    for _ in range(repeat):
+        state = setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "runs": len(times),
+        "calibration": calibration,
+    }
+
+
+def scaledBaseline(result: Dict[str, float], base: Dict[str, float]) -> float:
+    # The baseline's time, scaled by the ratio of the calibration times
+    calibration = result["calibration"]
+    return base["min"] * calibration / base.get("calibration", calibration)
+
+
+def isRegression(
+    result: Dict[str, float],
+    base: Dict[str, float],
+    threshold: float,
+    minDelta: float,
+) -> bool:
+    """
+    Whether result is slower than the baseline by more than threshold times
+    and by more than minDelta seconds
+    """
+    baseMin = scaledBaseline(result, base)
+    return result["min"] > baseMin * threshold and result["min"] - baseMin > minDelta
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+    minDelta: float,
+) -> List[str]:
+    """
+    Print each result against the baseline, returning the regressed cases
+    """
+    regressions: List[str] = []
+    print(f"{'case':<40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<40} {'-':>10} {result['min']:>10.4f}")
+            continue
+        baseMin = scaledBaseline(result, base)
+        ratio = result["min"] / baseMin if baseMin > 0 else 1.0
+        flag = ""
+        if isRegression(result, base, threshold, minDelta):
+            flag = " REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:<40} {baseMin:>10.4f} {result['min']:>10.4f} "
+            f"{ratio:>6.2f}x{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "bench", description="Benchmark the randomizer and tools"
+    )
+    parser.add_argument("--bcc", metavar="rom", type=str, default="")
+    parser.add_argument("--bn2", metavar="rom", type=str, default="")
+    parser.add_argument(
+        "--synthetic", action="store_true", help="Use generated ROMs for both games"
+    )
+    parser.add_argument("--scale", type=int, default=1, help="Synthetic ROM scale")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--repeat", "-r", type=int, default=3)
+    parser.add_argument(
+        "--searchBytes", type=int, default=0x10000, help="ROM prefix to search"
+    )
+    parser.add_argument(
+        "--filter", "-k", type=str, default="", help="Only run matching cases"
+    )
+    parser.add_argument("--output", "-o", type=str, default="")
+    parser.add_argument("--baseline", type=str, default=defaultBaseline)
+    parser.add_argument(
+        "--save", action="store_true", help="Store the results as the baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="Ratio to the baseline reported as a regression",
+    )
+    parser.add_argument(
+        "--minDelta",
+        type=float,
+        default=0.02,
+        help="Seconds slower than the baseline a regression must also be",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="Times a case which looks regressed is timed again",
+    )
+    parser.add_argument(
+        "--noFail", action="store_true", help="Don't fail on regressions"
+    )
+    args = parser.parse_args()
+
+    roms: Dict[Game, bytes] = {}
+    for game, path in ((Game.BCC, args.bcc), (Game.BN2, args.bn2)):
+        if path:
+            roms[game] = open(path, "rb").read()
+            assert rando.identifyGame(roms[game]) == game
+    if args.synthetic or not roms:
+        roms = {game: bytes(synthrom.makeRom(game, 0, args.scale)) for game in Game}
+
+    # Cached data would make the first repeat differ from the others
+    os.environ["MMBCCR_CACHE_DIR"] = ""
+
+    cases: List[Case] = []
+    for game, rom in roms.items():
+        cases += randomizeCases(game, rom, args.seeds)
+        cases += inspectionCases(game, rom)
+    searchRom = roms[Game.BN2] if Game.BN2 in roms else roms[Game.BCC]
+    cases += searchCasesFor(searchRom, args.searchBytes)
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, setup, run in cases:
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = timeCase(setup, run, args.repeat)
+        print(f"{name}: {results[name]['min']:.4f}s", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "roms": {game.name: cache.romHash(rom) for game, rom in roms.items()},
+        "seeds": args.seeds,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as outFile:
+            json.dump(report, outFile, indent=2)
+    if args.save:
+        with open(args.baseline, "w") as outFile:
+            json.dump(report, outFile, indent=2)
+        return
+
+    baseline: Optional[Dict[str, Any]] = None
+    if os.path.exists(args.baseline):
+        baseline = json.load(open(args.baseline))
+    if baseline is None:
+        print(json.dumps(report, indent=2))
+        return
+    sameRoms = baseline.get("roms") == report["roms"]
+    if not sameRoms:
+        print("warning: baseline was recorded with different ROMs", file=sys.stderr)
+    # Cases which look slower are timed again, in case the machine was
+    # busy rather than the code slower; the faster run counts
+    timers = {name: (setup, run) for name, setup, run in cases}
+    for _ in range(args.retries):
+        slow = [
+            name
+            for name, result in results.items()
+            if name in baseline["results"]
+            and isRegression(
+                result, baseline["results"][name], args.threshold, args.minDelta
+            )
+        ]
+        for name in slow:
+            retry = timeCase(*timers[name], args.repeat)
+            print(f"{name}: {retry['min']:.4f}s (retry)", file=sys.stderr)
+            old = results[name]
+            if retry["min"] / retry["calibration"] < old["min"] / old["calibration"]:
+                results[name] = retry
+    regressions = compare(results, baseline["results"], args.threshold, args.minDelta)
+    # Times of other ROMs can't be compared, so they only inform
+    if regressions and sameRoms and not args.noFail:
+        print(f"{len(regressions)} regressions", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
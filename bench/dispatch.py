@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+import argparse
+import timeit
+from megadata import DataType
+
+"""
+Microbenchmark of DataType metadata dispatch, comparing lookups in the
+DataTypeInfo registry against the if/elif chain DataType.getOffset used to be
+"""
+
+
+def _legacyGetOffset(type: DataType) -> int:
+    # Verbatim copy of the chain the registry replaced
+    if type == DataType.Encounter:
+        return 0x229900
+    elif type == DataType.Chip:
+        return 0x22741C
+    elif type == DataType.Sprite:
+        return 0x32CB78
+    elif type == DataType.ChipName:
+        return 0x22BB90
+    elif type == DataType.OpName:
+        return 0x22D69C
+    elif type == DataType.ChipDesc:
+        return 0x22C35C
+    elif type == DataType.EffectDesc:
+        return 0x22BF78
+    elif type == DataType.StartingChips:
+        return 0x2273C1
+    elif type == DataType.Chip_BN2:
+        return 0x00E470
+    elif type == DataType.ChipName_BN2:
+        return 0x728779
+    elif type == DataType.VirusName_BN2:
+        return 0x73328C
+    elif type == DataType.ItemName_BN2:
+        return 0x7339B4
+    elif type == DataType.Virus_BN2:
+        return 0x01515C
+    elif type == DataType.EncounterEVT_BN2:
+        return 0x01571C
+    elif type == DataType.EncounterRegion_BN2:
+        return 0x0168C0
+    elif type == DataType.ShopInventory_BN2:
+        return 0x030184
+    elif type == DataType.ChipFolder_BN2:
+        return 0x009974
+    elif type == DataType.DropTable_BN2:
+        return 0x012624
+    elif type == DataType.GMD_BN2:
+        return 0
+    raise KeyError("bad value")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "dispatch", description="Time DataType metadata lookups"
+    )
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    types = list(DataType)
+    assert all(_legacyGetOffset(type) == type.getOffset() for type in types)
+    cases = {
+        "legacy getOffset": lambda: [_legacyGetOffset(type) for type in types],
+        "registry getOffset": lambda: [type.getOffset() for type in types],
+        "registry getSize": lambda: [DataType.DropTable_BN2.getSize() for _ in types],
+        "registry getArrayLength": lambda: [type.getArrayLength() for type in types],
+    }
+    for name, fn in cases.items():
+        secs = timeit.timeit(fn, number=args.number)
+        perCall = secs / (args.number * len(types)) * 1e9
+        print(f"{name}: {perCall:.1f} ns/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+
+import argparse
+import configparser
+import contextlib
+import gc
+import io
+import random
+import sys
+import tracemalloc
+from typing import Any, Dict, Iterator, List
+from unittest import mock
+from megadata import DataType, Game
+from rombuffer import RomBuffer
+import bn2data
+import bccdata
+import rando
+import synthrom
+
+"""
+Memory and allocation benchmark for the record classes. The randomize case
+runs rando.randomize on a ROM of each game (synthetic unless given) and
+reports the tracemalloc peak of the run and the record objects constructed
+per run; the parse case parses every object of the fixed-stride tables and
+reports the tracemalloc peak and the number of record objects alive. Pass
+--maxPeak to fail when the peak of any run regresses
+"""
+
+fixedTypes = [
+    DataType.Chip_BN2,
+    DataType.Virus_BN2,
+    DataType.ShopInventory_BN2,
+    DataType.ChipFolder_BN2,
+    DataType.DropTable_BN2,
+    DataType.Encounter,
+    DataType.Chip,
+    DataType.StartingChips,
+]
+
+recordClasses = [
+    bn2data.ChipT_BN2,
+    bn2data.VirusT_BN2,
+    bn2data.EncounterEntity,
+    bn2data.EncounterDesc,
+    bn2data.EncounterT_BN2,
+    bn2data.ShopElem,
+    bn2data.ShopInventory,
+    bn2data.ChipItem,
+    bn2data.ChipFolder,
+    bn2data.DropItem,
+    bn2data.DropTable,
+    bccdata.ChipT,
+    bccdata.EncounterT,
+    bccdata.StartingChipsT,
+]
+
+
+def parseAll(data: bytearray, repeat: int) -> List[Any]:
+    objs: List[Any] = []
+    for _ in range(repeat):
+        for type in fixedTypes:
+            objs.extend(type.parse(data, i) for i in range(type.getArrayLength()))
+    return objs
+
+
+def countRecords() -> Dict[str, int]:
+    counts = {cls.__name__: 0 for cls in recordClasses}
+    classes = tuple(recordClasses)
+    for obj in gc.get_objects():
+        if isinstance(obj, classes):
+            counts[type(obj).__name__] += 1
+    return counts
+
+
+@contextlib.contextmanager
+def countingInits(counts: Dict[str, int]) -> Iterator[None]:
+    """
+    Count the construction of every record object while active
+    """
+    with contextlib.ExitStack() as stack:
+        for cls in recordClasses:
+            init = cls.__dict__["__init__"]
+
+            def counted(self, *args, init=init, name=cls.__name__):
+                counts[name] += 1
+                init(self, *args)
+
+            stack.enter_context(mock.patch.object(cls, "__init__", counted))
+        yield
+
+
+def randomizeOnce(rom: bytes, config: configparser.ConfigParser, seed: int):
+    # randomize reports its progress on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        rando.randomize(RomBuffer(rom, skipUnchanged=True), config, seed)
+
+
+def measureRandomize(roms: Dict[Game, bytes], seed: int) -> int:
+    """
+    Print the peak and allocations of a randomization of each ROM, returning
+    the largest peak
+    """
+    maxPeak = 0
+    for game, rom in roms.items():
+        config = configparser.ConfigParser()
+        config.read("rando_bcc.conf" if game == Game.BCC else "rando_bn2.conf")
+        # The first run fills the per-ROM caches (encounter index, name maps)
+        # which later runs share
+        randomizeOnce(rom, config, seed)
+        gc.collect()
+        tracemalloc.start()
+        randomizeOnce(rom, config, seed)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        counts = {cls.__name__: 0 for cls in recordClasses}
+        with countingInits(counts):
+            randomizeOnce(rom, config, seed)
+        total = sum(counts.values())
+        print(
+            f"{game.name} randomize: peak {peak} ({peak - len(rom)} besides the "
+            f"ROM copy), records constructed: {total}"
+        )
+        for name, count in counts.items():
+            if count:
+                print(f"  {name}: {count}")
+        maxPeak = max(maxPeak, peak)
+    return maxPeak
+
+
+def measureParse(data: bytearray, repeat: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    objs = parseAll(data, repeat)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    counts = countRecords()
+    total = sum(counts.values())
+    print(f"records alive: {total} ({total // repeat} per run)")
+    for name, count in counts.items():
+        print(f"  {name}: {count // repeat}")
+    print(f"tracemalloc current: {current} peak: {peak}")
+    print(f"bytes per record: {current / total:.1f}")
+    del objs
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "memory", description="Measure memory used by parsed record objects"
+    )
+    parser.add_argument(
+        "case", choices=("randomize", "parse"), nargs="?", default="randomize"
+    )
+    parser.add_argument("--rom", type=str, default="")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--maxPeak", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.case == "parse":
+        if args.rom:
+            data = bytearray(open(args.rom, "rb").read())
+        else:
+            rng = random.Random(0)
+            data = bytearray(rng.getrandbits(8) for _ in range(0x240000))
+        peak = measureParse(data, args.repeat)
+    else:
+        if args.rom:
+            rom = open(args.rom, "rb").read()
+            roms = {rando.identifyGame(rom): rom}
+        else:
+            roms = {game: bytes(synthrom.makeRom(game, seed=1)) for game in Game}
+        peak = measureRandomize(roms, args.seed)
+    if args.maxPeak and peak > args.maxPeak:
+        print(f"peak {peak} exceeds {args.maxPeak}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Iterable, Union
+import itertools
+import re
 import struct
 from enum import Enum
+from rombuffer import RomData, packInto
+
+
+class _EncodeTable(dict):
+    # str.translate table which fills itself in from BN2Char.convTo
+    def __missing__(self, key: int) -> str:
+        value = self[key] = chr(BN2Char.convTo(chr(key)))
+        return value
 
 
 class BN2Char:
@@ -27,6 +37,12 @@ class BN2Char:
 
     inverseMap = {v: k for k, v in specialMap.items()}
 
+    # For bulk conversion, terminators are found with a regex and each string
+    # converted whole with str.translate, decoding bytes as latin-1
+    terminatorRe = re.compile(b"[\xe7-\xff]")
+    decodeTable: List[str] = []
+    encodeTable: Dict[int, str] = _EncodeTable()
+
     @classmethod
     def isEncodedDigit(cls, char: int) -> bool:
         return char > 0 and char <= 10
@@ -59,12 +75,48 @@ class BN2Char:
             return 0x5D
 
     @classmethod
-    def toString(cls, data: bytearray, offset: int) -> Tuple[str, int]:
-        out = ""
-        while not cls.isTerminator(data[offset]):
-            out += cls.convFrom(data[offset])
-            offset += 1
-        return out, offset + 1
+    def toString(cls, data: RomData, offset: int) -> Tuple[str, int]:
+        end = cls.terminatorRe.search(data, offset)
+        assert end is not None
+        return cls._decode(data[offset : end.start()]), end.start() + 1
+
+    @classmethod
+    def _decode(cls, raw: Union[bytes, bytearray]) -> str:
+        if not cls.decodeTable:
+            cls.decodeTable = [cls.convFrom(char) for char in range(256)]
+        return raw.decode("latin-1").translate(cls.decodeTable)
+
+    @classmethod
+    def decodeAll(
+        cls, data: RomData, offset: int, count: int
+    ) -> Tuple[List[str], int]:
+        """
+        Decode count consecutive strings starting at offset in one pass,
+        returning the strings and the offset after the last one
+        """
+        out: List[str] = []
+        for end in itertools.islice(cls.terminatorRe.finditer(data, offset), count):
+            out.append(cls._decode(data[offset : end.start()]))
+            offset = end.start() + 1
+        if len(out) != count:
+            raise IndexError(f"Only found {len(out)} of {count} strings")
+        return out, offset
+
+    @classmethod
+    def encode(cls, text: str) -> bytes:
+        """
+        Encode a string, without a terminator
+        """
+        return text.translate(cls.encodeTable).encode("latin-1")
+
+    @classmethod
+    def encodeAll(cls, texts: Iterable[str]) -> bytes:
+        """
+        Encode strings as they are stored in the ROM, each followed by
+        a terminator
+        """
+        term = bytes([cls.terminator(0)])
+        return b"".join(cls.encode(text) + term for text in texts)
 
     @classmethod
     def terminator(cls, len: int) -> int:
@@ -94,37 +146,34 @@ def encodeCode(code: str) -> int:
 
 
 class ChipT_BN2:
+    __slots__ = (
+        "codes",
+        "unk1",
+        "unk2",
+        "effect",
+        "mb",
+        "flags",
+        "ap",
+        "idx",
+        "thumbnailPtr",
+        "imgPtr",
+        "colorPtr",
+    )
     myStruct = struct.Struct("<6BH4B2H4B3I")
 
-    def __init__(self, data: bytearray, offset: int):
-        self.codes = [0] * 6
-        self.unk1 = [0] * 2
-        self.unk2 = [0] * 4
-        (
-            self.codes[0],
-            self.codes[1],
-            self.codes[2],
-            self.codes[3],
-            self.codes[4],
-            self.codes[5],
-            self.effect,
-            self.unk1[0],
-            self.unk1[1],
-            self.mb,
-            self.flags,
-            self.ap,
-            self.idx,
-            self.unk2[0],
-            self.unk2[1],
-            self.unk2[2],
-            self.unk2[3],
-            self.thumbnailPtr,
-            self.imgPtr,
-            self.colorPtr,
-        ) = ChipT_BN2.myStruct.unpack_from(data, offset)
+    def __init__(self, data: RomData, offset: int):
+        vals = ChipT_BN2.myStruct.unpack_from(data, offset)
+        # codes are mutable, the unknown fields are stored as compact tuples
+        self.codes = list(vals[0:6])
+        self.effect = vals[6]
+        self.unk1 = vals[7:9]
+        self.mb, self.flags, self.ap, self.idx = vals[9:13]
+        self.unk2 = vals[13:17]
+        self.thumbnailPtr, self.imgPtr, self.colorPtr = vals[17:20]
 
     def serialize(self, data: bytearray, offset: int):
-        ChipT_BN2.myStruct.pack_into(
+        packInto(
+            ChipT_BN2.myStruct,
             data,
             offset,
             self.codes[0],
@@ -148,7 +197,7 @@ class ChipT_BN2:
 
     def __str__(self):
         return (
-            f"unk1: {self.unk1}, unk2: {self.unk2}, mb: {self.mb}, flags: {self.flags}, ap: {self.ap}, "
+            f"unk1: {list(self.unk1)}, unk2: {list(self.unk2)}, mb: {self.mb}, flags: {self.flags}, ap: {self.ap}, "
             f"idx: {self.idx} "
             f"effect: {hex(self.effect)} codes: {[codeStr(cd) for cd in self.codes]} "
             f"img: {hex(self.imgPtr)} col: {hex(self.colorPtr)} thumb: {hex(self.thumbnailPtr)}"
@@ -156,16 +205,17 @@ class ChipT_BN2:
 
 
 class VirusT_BN2:
+    __slots__ = ("hp", "unk", "descBytes", "level")
     myStruct = struct.Struct("<HBIB")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (self.hp, self.unk, self.descBytes, self.level) = self.myStruct.unpack_from(
             data, offset
         )
 
     def serialize(self, data: bytearray, offset: int):
-        self.myStruct.pack_into(
-            data, offset, self.hp, self.unk, self.descBytes, self.level
+        packInto(
+            self.myStruct, data, offset, self.hp, self.unk, self.descBytes, self.level
         )
 
     def __str__(self):
@@ -384,13 +434,14 @@ class NameMaps(object):
 
 
 class EncounterEntity(object):
+    __slots__ = ("idx", "x", "y", "role")
     myStruct = struct.Struct("<4B")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (self.idx, self.x, self.y, self.role) = self.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        self.myStruct.pack_into(data, offset, self.idx, self.x, self.y, self.role)
+        packInto(self.myStruct, data, offset, self.idx, self.x, self.y, self.role)
 
     def isTerminator(self) -> bool:
         return self.idx == 0xFF
@@ -403,13 +454,14 @@ class EncounterEntity(object):
 
 
 class EncounterDesc(object):
+    __slots__ = ("stage", "entities")
     myStruct = struct.Struct("<2I")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (self.stage, self.entities) = self.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        self.myStruct.pack_into(data, offset, self.stage, self.entities)
+        packInto(self.myStruct, data, offset, self.stage, self.entities)
 
     def __str__(self):
         return f"Stage: {hex(self.stage)} Entities: {hex(self.entities)}"
@@ -427,7 +479,9 @@ class EncounterT_BN2:
     given
     """
 
-    def __init__(self, data: bytearray, offset: int):
+    __slots__ = ("descs", "entities")
+
+    def __init__(self, data: RomData, offset: int):
         self.descs: List[EncounterDesc] = []
         self.entities: List[EncounterEntity] = []
 
@@ -476,9 +530,10 @@ class EncounterT_BN2:
 
 
 class ShopElem(object):
+    __slots__ = ("type", "qty", "ff1", "ff2", "ind", "code", "cost", "zero")
     myStruct = struct.Struct("<4B4H")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (
             self.type,
             self.qty,
@@ -491,7 +546,8 @@ class ShopElem(object):
         ) = self.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        self.myStruct.pack_into(
+        packInto(
+            self.myStruct,
             data,
             offset,
             self.type,
@@ -523,7 +579,9 @@ class ShopElem(object):
 
 
 class ShopInventory(object):
-    def __init__(self, data: bytearray, offset: int):
+    __slots__ = ("elems", "emptyCount")
+
+    def __init__(self, data: RomData, offset: int):
         self.elems: List[ShopElem] = []
         self.emptyCount = 0
         for _ in range(8):
@@ -539,18 +597,25 @@ class ShopInventory(object):
     def isSubChipShop(self):
         return all(not elem.isChip() for elem in self.elems)
 
+    @staticmethod
+    def isSubChipShopAt(data: RomData, offset: int) -> bool:
+        # isSubChipShop from the type bytes alone, without parsing the shop
+        size = ShopElem.myStruct.size
+        return all(data[offset + size * i] != 0x02 for i in range(8))
+
     def __str__(self) -> str:
         return "\n".join(map(str, self.elems))
 
 
 class ChipItem(object):
+    __slots__ = ("chip", "code")
     myStruct = struct.Struct("<HH")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (self.chip, self.code) = self.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        self.myStruct.pack_into(data, offset, self.chip, self.code)
+        packInto(self.myStruct, data, offset, self.chip, self.code)
 
     @classmethod
     def getSize(cls) -> int:
@@ -562,7 +627,9 @@ class ChipItem(object):
 
 
 class ChipFolder(object):
-    def __init__(self, data: bytearray, offset: int):
+    __slots__ = ("elems",)
+
+    def __init__(self, data: RomData, offset: int):
         self.elems: List[ChipItem] = []
         for _ in range(30):
             self.elems.append(ChipItem(data, offset))
@@ -578,13 +645,14 @@ class ChipFolder(object):
 
 
 class DropItem(object):
+    __slots__ = ("b1", "b2")
     myStruct = struct.Struct("<BB")
 
-    def __init__(self, data: bytearray, offset: int):
+    def __init__(self, data: RomData, offset: int):
         (self.b1, self.b2) = self.myStruct.unpack_from(data, offset)
 
     def serialize(self, data: bytearray, offset: int):
-        self.myStruct.pack_into(data, offset, self.b1, self.b2)
+        packInto(self.myStruct, data, offset, self.b1, self.b2)
 
     @classmethod
     def getSize(cls) -> int:
@@ -631,7 +699,9 @@ class DropItem(object):
 
 
 class DropTable(object):
-    def __init__(self, data: bytearray, offset: int):
+    __slots__ = ("elems",)
+
+    def __init__(self, data: RomData, offset: int):
         self.elems: List[DropItem] = []
         for _ in range(30):
             self.elems.append(DropItem(data, offset))
@@ -647,6 +717,7 @@ class DropTable(object):
 
 
 class OffInfo(object):
+    __slots__ = ("pre", "innerByte", "noCode", "noChip")
     myStruct = struct.Struct("<BBB")
 
     def __init__(self, pre=0, *, innerByte=False, noCode=False, noChip=False):
@@ -663,7 +734,7 @@ class OffInfo(object):
         # The chip index byte, or the LSB of the zenny amount is missing
         self.noChip = noChip
 
-    def toString(self, data: bytearray, offset: int, *, isZenny=False) -> str:
+    def toString(self, data: RomData, offset: int, *, isZenny=False) -> str:
         if isZenny:
             if self.noCode:
                 return "?? Z"
@@ -676,7 +747,7 @@ class OffInfo(object):
                 f"{codeStr(code) if not self.noCode else '_'}"
             )
 
-    def getChipAndCode(self, data: bytearray, offset: int) -> Tuple[int, int]:
+    def getChipAndCode(self, data: RomData, offset: int) -> Tuple[int, int]:
         b1, b2, b3 = self.myStruct.unpack_from(data, offset + self.pre)
         if self.innerByte:
             b2 = b3
@@ -684,7 +755,7 @@ class OffInfo(object):
             b2 = b1
         return b1, b2
 
-    def getZennyValue(self, data: bytearray, offset: int) -> int:
+    def getZennyValue(self, data: RomData, offset: int) -> int:
         b1, b2 = self.getChipAndCode(data, offset)
         return b1 | (b2 << 8)
 
@@ -712,12 +783,14 @@ class OffInfo(object):
 
 
 class GMDInfo(object):
+    __slots__ = ("offset", "chips", "zennies")
+
     def __init__(self, offset, chips=[], zennies=[]):
         self.offset = offset
         self.chips = chips
         self.zennies = zennies
 
-    def toString(self, data: bytearray) -> str:
+    def toString(self, data: RomData) -> str:
         offs = self.offset
         ret = ""
         for chip in self.chips:
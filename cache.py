@@ -0,0 +1,157 @@
+import hashlib
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from rombuffer import RomData
+
+"""
+Helpers for data derived from a ROM which is cached on disk between runs,
+keyed by the hash of the ROM contents. The cache lives in $MMBCCR_CACHE_DIR,
+or ~/.cache/mmbccr by default; setting MMBCCR_CACHE_DIR to an empty string
+disables caching. DiskLRU is a size capped cache of files for data that
+isn't derived from the ROM alone
+"""
+
+
+# The last read only buffer hashed and its digest, as the same ROM (such as
+# the mapped file of a search, for every stride of a sweep) tends to be
+# looked up repeatedly
+_lastHashed: Tuple[Any, str] = (None, "")
+
+
+def romHash(data: RomData) -> str:
+    global _lastHashed
+    lastData, lastDigest = _lastHashed
+    if data is lastData:
+        return lastDigest
+    digest = hashlib.sha1(data).hexdigest()
+    if memoryview(data).readonly:
+        _lastHashed = (data, digest)
+    return digest
+
+
+def cacheDir() -> Optional[str]:
+    path = os.environ.get("MMBCCR_CACHE_DIR")
+    if path is None:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "mmbccr")
+    if not path:
+        return None
+    return path
+
+
+def cachePath(kind: str, key: str, ext: str) -> Optional[str]:
+    """
+    Path at which to cache data of the given kind for the given key (normally
+    a romHash), or None if caching is disabled
+    """
+    base = cacheDir()
+    if base is None:
+        return None
+    return os.path.join(base, kind, f"{key}{ext}")
+
+
+def writeCacheFile(path: str, contents: bytes):
+    """
+    Atomically write a cache file; failure to write the cache is not an error
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with open(tmpPath, "wb") as outFile:
+            outFile.write(contents)
+        os.replace(tmpPath, path)
+    except OSError:
+        pass
+
+
+class DiskLRU:
+    """
+    A directory of cached files with a cap on their total size; once it is
+    exceeded the least recently used files (by mtime, which get refreshes)
+    are evicted. Counts hits, misses and evictions
+    """
+
+    def __init__(self, directory: str, maxBytes: int, ext: str = ""):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.ext = ext
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = sum(size for _, _, size in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.ext}")
+
+    def _entries(self) -> List[Tuple[float, str, int]]:
+        # (mtime, path, size) of every cached file
+        ret: List[Tuple[float, str, int]] = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return ret
+        for name in names:
+            if not name.endswith(self.ext) or name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            ret.append((st.st_mtime, os.path.join(self.directory, name), st.st_size))
+        return ret
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as inFile:
+                data = inFile.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        if len(data) > self.maxBytes:
+            return
+        # Held across the write so that concurrent puts of a key (which also
+        # share a temporary file) only write and count it once
+        with self.lock:
+            if os.path.exists(path):
+                return
+            writeCacheFile(path, data)
+            if not os.path.exists(path):
+                return
+            self.size += len(data)
+            if self.size > self.maxBytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self.size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.size <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self.size,
+                "maxBytes": self.maxBytes,
+            }
@@ -0,0 +1,331 @@
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from ngramindex import NgramIndex
+
+"""
+Fast engines for search.search, each returning exactly what the reference
+loop in search.py does. The reference scans with a single cursor: starting
+at position s it matches pattern elements at s, s + stride, ...; a complete
+match is recorded and scanning resumes after it, while a partial match of
+j elements resumes at s + j * (stride - 1) + 1. So the result is determined
+by the number of leading elements matched at each start ("leads"), which
+the engines compute in bulk before replaying the cursor over the starts
+that matched at least one element.
+data may be any buffer, such as an mmap or memoryview; it is scanned in
+chunks (overlapping by the span of a match) so memory use doesn't grow with
+its size. The NumPy engines are only used if numpy is installed; positions
+are in units of dataSize and a trailing partial datum is ignored
+"""
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+HAVE_NUMPY = np is not None
+
+_dtypes = {1: "u1", 2: "<u2", 4: "<u4", 8: "<u8"}
+
+Engine = Callable[[List[int], Any, Any], List[int]]
+
+
+def datumView(data: Any, dataSize: int) -> Any:
+    """
+    data as an array of little endian dataSize byte values, without copying
+    """
+    return np.frombuffer(data, dtype=_dtypes[dataSize], count=len(data) // dataSize)
+
+
+class Replay:
+    """
+    Replays the reference scan given, in increasing order, each start with a
+    nonzero lead (starts with no lead only advance the cursor by one),
+    collecting the starts of complete matches. matchLen is the number of
+    elements in a complete match and count the number of datums. The cursor
+    is kept between calls to feed, so starts can be fed a chunk at a time
+    """
+
+    def __init__(self, matchLen: int, stride: int, count: int):
+        self.matchLen = matchLen
+        self.stride = stride
+        self.count = count
+        self.pos = 0
+        self.done = False
+        self.matches: List[int] = []
+
+    def feed(self, starts: Iterable[int], leads: Iterable[int]):
+        matchLen, stride = self.matchLen, self.stride
+        pos = self.pos
+        for start, lead in zip(starts, leads):
+            if start < pos:
+                continue
+            if lead == matchLen:
+                self.matches.append(start)
+                pos = start + matchLen * stride
+            elif start + lead * stride >= self.count:
+                # The scan ran off the end of the data mid match
+                self.done = True
+                break
+            else:
+                pos = start + lead * (stride - 1) + 1
+        self.pos = pos
+
+
+def replayLeads(
+    starts: Iterable[int], leads: Iterable[int], matchLen: int, stride: int, count: int
+) -> List[int]:
+    replay = Replay(matchLen, stride, count)
+    replay.feed(starts, leads)
+    return replay.matches
+
+
+def computeLeads(
+    first: Any,
+    matchLen: int,
+    stride: int,
+    count: int,
+    matchAt: Callable[[int, Any, Any], Any],
+) -> Any:
+    """
+    The lead of every start, given a mask of the starts matching the first
+    element and matchAt(k, starts, positions) giving which of starts match
+    element k at positions. Only starts still matching are examined for each
+    element, so the cost is dominated by the first couple of elements
+    """
+    leads = np.zeros(count, dtype=np.uint8 if matchLen < 256 else np.int32)
+    starts = np.flatnonzero(first)
+    leads[starts] = 1
+    for k in range(1, matchLen):
+        if not len(starts):
+            break
+        # Starts whose element k lies past the end can't match any further
+        starts = starts[starts + k * stride < count]
+        starts = starts[matchAt(k, starts, starts + k * stride)]
+        leads[starts] = k + 1
+    return leads
+
+
+# Datums per chunk scanned by the NumPy engines, bounding their memory use
+chunkSize = 1 << 20
+
+
+def scanChunks(
+    count: int,
+    matchLen: int,
+    stride: int,
+    dataSize: int,
+    leadsFor: Callable[[int, int], Any],
+) -> List[int]:
+    """
+    Runs the scan over count datums a chunk at a time. leadsFor(lo, end)
+    gives the leads of the starts of datums [lo, end) as computed from those
+    datums alone; a chunk of starts is extended by the span of a match so
+    that every lead in it is complete
+    """
+    replay = Replay(matchLen, stride, count)
+    overlap = (matchLen - 1) * stride
+    for lo in range(0, count, chunkSize):
+        hi = min(lo + chunkSize, count)
+        leads = leadsFor(lo, min(hi + overlap, count))[: hi - lo]
+        if stride == 1:
+            # A partial match then only advances the cursor by one, the same
+            # as no match, so only the complete matches need to be replayed
+            starts = np.flatnonzero(leads == matchLen)
+        else:
+            starts = np.flatnonzero(leads)
+        replay.feed((starts + lo).tolist(), leads[starts].tolist())
+        if replay.done:
+            break
+    return [start * dataSize for start in replay.matches]
+
+
+def _inRange(pattern: List[int], dataSize: int) -> bool:
+    # A value which doesn't fit in a datum can't match, and so no complete
+    # match is possible
+    return all(0 <= val < 1 << (8 * dataSize) for val in pattern)
+
+
+def _chunkedFind(data: memoryview, needle: bytes) -> Iterator[int]:
+    # Every occurrence of needle, for buffers without a find method; each
+    # chunk overlaps the next by the length of needle less one
+    for lo in range(0, len(data), chunkSize):
+        chunk = bytes(data[lo : lo + chunkSize + len(needle) - 1])
+        found = chunk.find(needle)
+        while 0 <= found < chunkSize:
+            yield lo + found
+            found = chunk.find(needle, found + 1)
+
+
+def searchPlainFind(pattern: List[int], data: Any, args: Any) -> List[int]:
+    """
+    Plain search with stride 1 is a scan for non-overlapping occurrences of
+    the pattern's bytes at aligned offsets, which bytes.find (or mmap.find)
+    does natively. If a bigram index of data has been built and the pattern
+    is rare enough for it to be faster, the occurrences come from it
+    """
+    dataSize: int = args.dataSize
+    if not _inRange(pattern, dataSize):
+        return []
+    needle = b"".join(val.to_bytes(dataSize, "little") for val in pattern)
+    end = len(data) - len(data) % dataSize
+    ret: List[int] = []
+    pos = 0
+    index = NgramIndex.forRom(data) if len(needle) >= 2 else None
+    if index is not None and not index.isSelective(needle):
+        index = None
+    if index is not None or not hasattr(data, "find"):
+        occurrences = (
+            index.find(needle, data)
+            if index is not None
+            else _chunkedFind(memoryview(data), needle)
+        )
+        for found in occurrences:
+            if found + len(needle) > end:
+                break
+            if found >= pos and not found % dataSize:
+                ret.append(found)
+                pos = found + len(needle)
+        return ret
+    while True:
+        found = data.find(needle, pos, end)
+        if found < 0:
+            break
+        if found % dataSize:
+            pos = found + 1
+            continue
+        ret.append(found)
+        pos = found + len(needle)
+    return ret
+
+
+def searchPlain(pattern: List[int], data: Any, args: Any) -> List[int]:
+    if not _inRange(pattern, args.dataSize):
+        return []
+    fullView = datumView(data, args.dataSize)
+
+    def leadsFor(lo: int, end: int) -> Any:
+        view = fullView[lo:end]
+
+        def matchAt(k: int, starts: Any, positions: Any) -> Any:
+            return view[positions] == pattern[k]
+
+        first = view == pattern[0]
+        first[chunkSize:] = False
+        return computeLeads(first, len(pattern), args.stride, len(view), matchAt)
+
+    return scanChunks(len(fullView), len(pattern), args.stride, args.dataSize, leadsFor)
+
+
+def searchDelta(pattern: List[int], data: Any, args: Any) -> List[int]:
+    """
+    Delta search: after a first element, element k matches if the byte at
+    its position differs by pattern[k - 1] from the datum of the previous
+    element (or with --rooted, the first). 300 matches anything and 400 any
+    change. As in the reference, the byte at the element's datum index is
+    compared to a whole datum, which only differ for dataSize > 1
+    """
+    fullView = datumView(data, args.dataSize)
+    fullRaw = np.frombuffer(data, dtype=np.uint8)
+    stride: int = args.stride
+    matchLen = len(pattern) + 1
+
+    def leadsFor(lo: int, end: int) -> Any:
+        # Datum and byte indices coincide, so both windows start at lo
+        view = fullView[lo:end]
+        raw = fullRaw[lo:end]
+
+        def matchAt(k: int, starts: Any, positions: Any) -> Any:
+            code = pattern[k - 1]
+            if code == 300:
+                return np.ones(len(starts), dtype=bool)
+            prevPositions = starts if args.rooted else positions - stride
+            prev = view[prevPositions].astype(np.int64)
+            if code == 400:
+                return raw[positions] != prev
+            return raw[positions] == prev + code
+
+        if args.middleStart:
+            first = (view != 0) & (view != 255)
+        else:
+            first = np.ones(len(view), dtype=bool)
+        first[chunkSize:] = False
+        return computeLeads(first, matchLen, stride, len(view), matchAt)
+
+    return scanChunks(len(fullView), matchLen, stride, args.dataSize, leadsFor)
+
+
+def searchVariable(pattern: List[int], data: Any, args: Any) -> List[int]:
+    """
+    Variable search matches windows equal to the pattern up to a consistent
+    relabeling, with 0 matching any value not already bound to a label. A
+    window matches element k exactly when its first occurrence labeling
+    agrees with the pattern's: the datum equals the one at the first element
+    with the same label, or for a new label (or 0) differs from the datums
+    at the first element of every label so far. Starts are dropped as soon
+    as an element can't match, so only plausible windows are examined further
+    """
+    fullView = datumView(data, args.dataSize)
+    stride: int = args.stride
+
+    # For each element, the earlier element it must equal, or the earlier
+    # elements it must differ from
+    plan: List[Tuple[Optional[int], List[int]]] = []
+    firstOfLabel: Dict[int, int] = {}
+    for k, label in enumerate(pattern):
+        if label != 0 and label in firstOfLabel:
+            plan.append((firstOfLabel[label], []))
+        else:
+            plan.append((None, list(firstOfLabel.values())))
+            if label != 0:
+                firstOfLabel[label] = k
+
+    def leadsFor(lo: int, end: int) -> Any:
+        view = fullView[lo:end]
+
+        def matchAt(k: int, starts: Any, positions: Any) -> Any:
+            vals = view[positions]
+            same, distinct = plan[k]
+            if same is not None:
+                return vals == view[starts + same * stride]
+            ok = np.ones(len(starts), dtype=bool)
+            for earlier in distinct:
+                ok &= vals != view[starts + earlier * stride]
+            return ok
+
+        first = np.ones(len(view), dtype=bool)
+        first[chunkSize:] = False
+        return computeLeads(first, len(pattern), stride, len(view), matchAt)
+
+    return scanChunks(len(fullView), len(pattern), stride, args.dataSize, leadsFor)
+
+
+def engineFor(args: Any) -> Optional[Engine]:
+    """
+    The fastest engine supporting the search described by args, or None if
+    only the reference implementation does
+    """
+    if args.stride < 1:
+        return None
+    if not args.delta and not args.variable:
+        if args.stride == 1:
+            return searchPlainFind
+        if HAVE_NUMPY and args.dataSize in _dtypes:
+            return searchPlain
+    elif args.delta:
+        if HAVE_NUMPY and args.dataSize in _dtypes:
+            return searchDelta
+    elif args.variable:
+        if HAVE_NUMPY and args.dataSize in _dtypes:
+            return searchVariable
+    return None
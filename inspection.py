@@ -3,7 +3,8 @@
 import sys
 import argparse
 from megadata import *
-from bn2data import BN2Char, EncounterT_BN2, GMD
+from bn2data import BN2Char, GMD
+from rombuffer import RomData, mapRom
 
 
 def main():
@@ -15,9 +16,7 @@ def main():
     parser.add_argument("-v", "--verbose", action="store_true")
     args = parser.parse_args()
 
-    input = open(args.file, "rb")
-
-    byteData = input.read()
+    byteData = mapRom(args.file)
 
     type = DataType[args.type]
 
@@ -25,6 +24,13 @@ def main():
         PrintOpts.verbose = True
         PrintOpts.refdata = byteData
 
+    dump(byteData, type)
+
+
+def dump(byteData: RomData, type: DataType):
+    """
+    Print every object of the home array of type in byteData
+    """
     if type in [
         DataType.EncounterEVT_BN2,
         DataType.EncounterRegion_BN2,
@@ -39,15 +45,18 @@ def main():
         print(GMD(byteData))
         return
 
+    encounterIndex = None
+    if type in EncounterIndex.types:
+        encounterIndex = EncounterIndex.forRom(byteData)
+
     offset = type.getOffset()
     for i in range(type.getArrayLength()):
-        if type.isVarLengthString():
-            toStrClass = (
-                EncounterT_BN2
-                if type in [DataType.EncounterRegion_BN2, DataType.EncounterEVT_BN2]
-                else BN2Char
-            )
-            out, offset = toStrClass.toString(byteData, offset)
+        out: object
+        if encounterIndex is not None:
+            out = encounterIndex.parse(byteData, type, i)
+            offset = encounterIndex.getOffset(type, i) + encounterIndex.getSize(type, i)
+        elif type.isVarLengthString():
+            out, offset = BN2Char.toString(byteData, offset)
         else:
             out = type.parseAtOffset(byteData, offset)
             offset += type.getSize(out)
@@ -1,7 +1,23 @@
-from typing import List, Union, Dict, Any, cast, Iterable
+from typing import (
+    List,
+    Union,
+    Dict,
+    Any,
+    cast,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Callable,
+    Sequence,
+    Tuple,
+)
+import json
+import os
 import struct
 from enum import Enum
+from functools import partial
 import itertools
+import stats
 from bn2data import (
     ChipT_BN2,
     VirusT_BN2,
@@ -14,6 +30,8 @@ from bn2data import (
 )
 
 from bccdata import EncounterT, ChipT, StringT, StartingChipsT, PrintOpts
+import cache
+from rombuffer import RomData
 
 DataTypeVar = Union[
     EncounterT,
@@ -29,11 +47,27 @@ DataTypeVar = Union[
 ]
 
 
+class Game(Enum):
+    BCC = 1
+    BN2 = 2
+
+
+def identifyGame(byteData: Union[RomData, memoryview]) -> Game:
+    header = byteData[0xA0:0xB0]
+    if header == b"BATTLECHIPGPA89E":
+        return Game.BCC
+    elif header == b"MEGAMAN_EXE2AE2E":
+        return Game.BN2
+    raise Exception(f"Detected no valid game, found header {header!r}")
+
+
 class DataType(Enum):
     """
     DataType represents the various data types, which are generally stored in
     large arrays; DataType has accessors to parse and serialize the data, as well
-    as knowledge as to how large each object is and where the home array lives
+    as knowledge as to how large each object is and where the home array lives.
+    That knowledge is kept in a DataTypeInfo registered for each DataType (see
+    registerDataType below)
     """
 
     # mmbcc
@@ -58,13 +92,14 @@ class DataType(Enum):
     DropTable_BN2 = 18
     GMD_BN2 = 19
 
-    def isVarLengthString(self):
-        return self in [
-            DataType.ChipName_BN2,
-            DataType.VirusName_BN2,
-            DataType.ItemName_BN2,
-            DataType.GMD_BN2,
-        ]
+    def getInfo(self) -> "DataTypeInfo":
+        return _dataTypeInfo[self]
+
+    def getGame(self) -> Game:
+        return _dataTypeInfo[self].game
+
+    def isVarLengthString(self) -> bool:
+        return _dataTypeInfo[self].varLengthString
 
     def getOffset(self) -> int:
         """
@@ -72,158 +107,29 @@ class DataType(Enum):
         so the pointers in the code are to memory regions that start one object
         earlier
         """
-        if self == DataType.Encounter:
-            return 0x229900
-        elif self == DataType.Chip:
-            return 0x22741C
-        elif self == DataType.Sprite:
-            return 0x32CB78
-        elif self == DataType.ChipName:
-            return 0x22BB90
-        elif self == DataType.OpName:
-            return 0x22D69C
-        elif self == DataType.ChipDesc:
-            return 0x22C35C
-        elif self == DataType.EffectDesc:
-            return 0x22BF78
-        elif self == DataType.StartingChips:
-            return 0x2273C1
-        elif self == DataType.Chip_BN2:
-            return 0x00E470
-        elif self == DataType.ChipName_BN2:
-            return 0x728779
-        elif self == DataType.VirusName_BN2:
-            return 0x73328C
-        elif self == DataType.ItemName_BN2:
-            return 0x7339B4
-        elif self == DataType.Virus_BN2:
-            return 0x01515C
-        elif self == DataType.EncounterEVT_BN2:
-            return 0x01571C
-        elif self == DataType.EncounterRegion_BN2:
-            # 0x0a1000 is around Den 1 ; the first region
-            # starts right after the event encounters though, with the different event pointer structure
-            return 0x0168C0
-        elif self == DataType.ShopInventory_BN2:
-            return 0x030184
-        elif self == DataType.ChipFolder_BN2:
-            return 0x009974
-        elif self == DataType.DropTable_BN2:
-            return 0x012624
-        elif self == DataType.GMD_BN2:
-            # GMDs are handled very specially, see the GMD class for
-            # more details
-            return 0
-        raise KeyError("bad value")
+        return _dataTypeInfo[self].offset
 
     def getSize(self, obj: Any = None) -> int:
-        if self == DataType.Encounter:
-            return 20
-        elif self == DataType.Chip:
-            return 16
-        elif self == DataType.Sprite:
-            return 256
-        elif self in [
-            DataType.ChipName,
-            DataType.OpName,
-            DataType.EffectDesc,
-            DataType.ChipDesc,
-        ]:
-            return 4  # Pointer
-        elif self == DataType.StartingChips:
-            return 7
-        elif self == DataType.Chip_BN2:
-            return 32
-        elif self == DataType.Virus_BN2:
-            return 8
-        elif self == DataType.ShopInventory_BN2:
-            return 96
-        elif self in [
-            DataType.EncounterEVT_BN2,
-            DataType.EncounterRegion_BN2,
-        ]:
+        size = _dataTypeInfo[self].size
+        if size is None:
+            raise KeyError("bad value")
+        elif size == 0:
+            # Variable sized objects know their own size
             return 0 if obj is None else obj.getSize()
-        elif self == DataType.ChipFolder_BN2:
-            return 120
-        elif self == DataType.DropTable_BN2:
-            return 60
-        raise KeyError("bad value")
+        return size
 
     def getArrayLength(self) -> int:
-        if self == DataType.Encounter:
-            return 419
-        elif (
-            self == DataType.Chip
-            or self == DataType.ChipName
-            or self == DataType.ChipDesc
-            or self == DataType.EffectDesc
-        ):
-            return 248
-        elif self == DataType.Sprite:
-            return 174
-        elif self == DataType.OpName:
-            return 143
-        elif self == DataType.StartingChips:
-            return 1
-        elif self == DataType.Chip_BN2:
-            return 265
-        elif self == DataType.ChipName_BN2:
-            # Special Values:
-            # Weird data at 255/256  (between BlkBomb and FtrSword)
-            # 265: GateSP
-            # 270: Scntuary (empty before) empty strs, Snctuary (270)
-            # 272-303: PAs
-            # 304-315: Enemy 'chips' (e.g RemoGate) and empty strs
-            # 315: '????'
-            return 316
-        elif self == DataType.VirusName_BN2:
-            return 178
-        elif self == DataType.ItemName_BN2:
-            return 113
-        elif self == DataType.Virus_BN2:
-            return 178
-        elif self == DataType.EncounterEVT_BN2:
-            return 243
-        elif self == DataType.EncounterRegion_BN2:
-            return 849
-        elif self == DataType.ShopInventory_BN2:
-            return 25
-        elif self == DataType.ChipFolder_BN2:
-            return 6
-        elif self == DataType.DropTable_BN2:
-            return 184
-        elif self == DataType.GMD_BN2:
-            return 0
-        raise KeyError("bad value")
-
-    def parseAtOffset(self, data: bytearray, offset: int) -> DataTypeVar:
-        if self == DataType.Encounter:
-            return EncounterT(data, offset)
-        elif self == DataType.Chip:
-            return ChipT(data, offset)
-        elif self == DataType.ChipName or self == DataType.OpName:
-            return StringT(data, offset)
-        elif self == DataType.ChipDesc:
-            return StringT(data, offset, strCount=3, indirect=True)
-        elif self == DataType.EffectDesc:
-            return StringT(data, offset, format=0x600)
-        elif self == DataType.StartingChips:
-            return StartingChipsT(data, offset)
-        elif self == DataType.Chip_BN2:
-            return ChipT_BN2(data, offset)
-        elif self == DataType.Virus_BN2:
-            return VirusT_BN2(data, offset)
-        elif self in [DataType.EncounterEVT_BN2, DataType.EncounterRegion_BN2]:
-            return EncounterT_BN2(data, offset)
-        elif self == DataType.ShopInventory_BN2:
-            return ShopInventory(data, offset)
-        elif self == DataType.ChipFolder_BN2:
-            return ChipFolder(data, offset)
-        elif self == DataType.DropTable_BN2:
-            return DropTable(data, offset)
-        raise KeyError("bad value")
-
-    def parse(self, data: bytearray, index: int) -> DataTypeVar:
+        return _dataTypeInfo[self].length
+
+    def parseAtOffset(self, data: RomData, offset: int) -> DataTypeVar:
+        parser = _dataTypeInfo[self].parser
+        if parser is None:
+            raise KeyError("bad value")
+        if stats.active is not None:
+            stats.active.count("parsed")
+        return parser(data, offset)
+
+    def parse(self, data: RomData, index: int) -> DataTypeVar:
         objSize = self.getSize()
         if objSize == 0:
             raise KeyError(f"Parse not supported on type {self}")
@@ -231,27 +137,257 @@ class DataType(Enum):
         return self.parseAtOffset(data, offset)
 
     def rewrite(self, data: bytearray, index: int, objT: DataTypeVar):
+        if stats.active is not None:
+            stats.active.count("serialized")
         objT.serialize(data, self.getOffset() + index * self.getSize())
 
+    def table(self, data: bytearray) -> "DataTable":
+        return DataTable(self, data)
+
+
+class DataTable(Sequence):
+    """
+    A view of the home array of a fixed size DataType which parses objects
+    only when they are accessed, and on flush() writes back only the objects
+    which were changed. Use as a context manager to flush on exit:
+        with DataType.Chip_BN2.table(data) as chips:
+            chips[3].mb = 50
+    Objects of indirect types (pointers to their data) can't be compared
+    in place, so every accessed object of those types is written back
+    """
+
+    def __init__(self, type: DataType, data: bytearray):
+        self.type = type
+        self.data = data
+        self.offset = type.getOffset()
+        self.size = type.getSize()
+        if self.size == 0:
+            raise KeyError(f"Tables not supported on type {type}")
+        self.length = type.getArrayLength()
+        self.indirect = type.getInfo().indirect
+        self.items: Dict[int, DataTypeVar] = {}
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError(f"{self.type} index {index} out of range")
+        item = self.items.get(index)
+        if item is None:
+            item = self.type.parseAtOffset(self.data, self.offsetOf(index))
+            self.items[index] = item
+        return item
+
+    def offsetOf(self, index: int) -> int:
+        return self.offset + index * self.size
+
+    def flush(self) -> List[int]:
+        """
+        Write back changed objects, returning the indices which were written
+        """
+        written: List[int] = []
+        scratch = bytearray(self.size)
+        for index in sorted(self.items):
+            item = self.items[index]
+            offset = self.offsetOf(index)
+            if not self.indirect:
+                item.serialize(scratch, 0)
+                if scratch == self.data[offset : offset + self.size]:
+                    continue
+            item.serialize(self.data, offset)
+            written.append(index)
+        if stats.active is not None:
+            stats.active.count("serialized", len(written))
+        return written
+
+    def __enter__(self) -> "DataTable":
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.flush()
+
+
+class DataTypeInfo(NamedTuple):
+    """
+    Static description of a DataType: which game it belongs to, where its
+    home array lives, the size of each object (0 if objects are variable
+    sized, None if objects have no meaningful size), the number of objects,
+    and a callable parsing one object from (data, offset)
+    """
+
+    game: Game
+    offset: int
+    size: Optional[int]
+    length: int
+    parser: Optional[Callable[[RomData, int], DataTypeVar]]
+    varLengthString: bool = False
+    # Objects are pointers to data stored elsewhere
+    indirect: bool = False
 
-def populateBN2Meta(byteData: bytearray):
-    offset = DataType.VirusName_BN2.getOffset()
-    vn: Dict[int, str] = {}
-    for i in range(DataType.VirusName_BN2.getArrayLength()):
-        out, offset = BN2Char.toString(byteData, offset)
-        vn[i] = out
+
+_dataTypeInfo: Dict[DataType, DataTypeInfo] = {}
+
+
+def registerDataType(type: DataType, info: DataTypeInfo):
+    _dataTypeInfo[type] = info
+
+
+# fmt: off
+# mmbcc
+registerDataType(DataType.Encounter, DataTypeInfo(Game.BCC, 0x229900, 20, 419, EncounterT))
+registerDataType(DataType.Chip, DataTypeInfo(Game.BCC, 0x22741C, 16, 248, ChipT))
+registerDataType(DataType.Sprite, DataTypeInfo(Game.BCC, 0x32CB78, 256, 174, None))
+# The string types are arrays of pointers
+registerDataType(DataType.ChipName, DataTypeInfo(Game.BCC, 0x22BB90, 4, 248, StringT,
+                                                 indirect=True))
+registerDataType(DataType.OpName, DataTypeInfo(Game.BCC, 0x22D69C, 4, 143, StringT,
+                                               indirect=True))
+registerDataType(DataType.ChipDesc, DataTypeInfo(Game.BCC, 0x22C35C, 4, 248,
+                                                 partial(StringT, strCount=3, indirect=True),
+                                                 indirect=True))
+registerDataType(DataType.EffectDesc, DataTypeInfo(Game.BCC, 0x22BF78, 4, 248,
+                                                   partial(StringT, format=0x600),
+                                                   indirect=True))
+registerDataType(DataType.StartingChips, DataTypeInfo(Game.BCC, 0x2273C1, 7, 1, StartingChipsT))
+# bn2
+registerDataType(DataType.Chip_BN2, DataTypeInfo(Game.BN2, 0x00E470, 32, 265, ChipT_BN2))
+# Special Values of ChipName_BN2:
+# Weird data at 255/256  (between BlkBomb and FtrSword)
+# 265: GateSP
+# 270: Scntuary (empty before) empty strs, Snctuary (270)
+# 272-303: PAs
+# 304-315: Enemy 'chips' (e.g RemoGate) and empty strs
+# 315: '????'
+registerDataType(DataType.ChipName_BN2, DataTypeInfo(Game.BN2, 0x728779, None, 316, None, True))
+registerDataType(DataType.VirusName_BN2, DataTypeInfo(Game.BN2, 0x73328C, None, 178, None, True))
+registerDataType(DataType.ItemName_BN2, DataTypeInfo(Game.BN2, 0x7339B4, None, 113, None, True))
+registerDataType(DataType.Virus_BN2, DataTypeInfo(Game.BN2, 0x01515C, 8, 178, VirusT_BN2))
+registerDataType(DataType.EncounterEVT_BN2, DataTypeInfo(Game.BN2, 0x01571C, 0, 243, EncounterT_BN2))
+# 0x0a1000 is around Den 1 ; the first region starts right after the event
+# encounters though, with the different event pointer structure
+registerDataType(DataType.EncounterRegion_BN2, DataTypeInfo(Game.BN2, 0x0168C0, 0, 849, EncounterT_BN2))
+registerDataType(DataType.ShopInventory_BN2, DataTypeInfo(Game.BN2, 0x030184, 96, 25, ShopInventory))
+registerDataType(DataType.ChipFolder_BN2, DataTypeInfo(Game.BN2, 0x009974, 120, 6, ChipFolder))
+registerDataType(DataType.DropTable_BN2, DataTypeInfo(Game.BN2, 0x012624, 60, 184, DropTable))
+# GMDs are handled very specially, see the GMD class for more details
+registerDataType(DataType.GMD_BN2, DataTypeInfo(Game.BN2, 0, None, 0, None, True))
+# fmt: on
+
+
+class EncounterIndex:
+    """
+    The encounter lists (EncounterEVT_BN2, EncounterRegion_BN2) are variable
+    length, so entry N can only be found by parsing every entry before it.
+    EncounterIndex records the start offset, kind (entity list or desc list)
+    and length of every entry so any entry can be reached directly. Since
+    randomization never changes the structure of the lists, an index built
+    from a base ROM is cached on disk by the hash of that ROM
+    """
+
+    types = (DataType.EncounterEVT_BN2, DataType.EncounterRegion_BN2)
+    version = 1
+
+    def __init__(self, entries: Dict[DataType, List[Tuple[int, bool, int]]]):
+        # (offset, isEntities, number of entities or descs) per entry
+        self.entries = entries
+
+    @classmethod
+    def build(cls, data: RomData) -> "EncounterIndex":
+        entries: Dict[DataType, List[Tuple[int, bool, int]]] = {}
+        for type in cls.types:
+            offset = type.getOffset()
+            typeEntries = []
+            for _ in range(type.getArrayLength()):
+                enc = cast(EncounterT_BN2, type.parseAtOffset(data, offset))
+                isEntities = enc.isEntities()
+                count = len(enc.entities) if isEntities else len(enc.descs)
+                typeEntries.append((offset, isEntities, count))
+                offset += enc.getSize()
+            entries[type] = typeEntries
+        return cls(entries)
+
+    _memo: Dict[str, "EncounterIndex"] = {}
+
+    @classmethod
+    def forRom(cls, data: RomData) -> "EncounterIndex":
+        """
+        The index for a ROM, loaded from the on disk cache if possible; data
+        should be the ROM as it was before any randomization
+        """
+        key = cache.romHash(data)
+        if key in cls._memo:
+            return cls._memo[key]
+        path = cache.cachePath("encounters", key, ".json")
+        index = None
+        if path is not None and os.path.exists(path):
+            try:
+                index = cls.fromJSON(open(path).read())
+            except (ValueError, KeyError):
+                index = None
+        if index is None:
+            index = cls.build(data)
+            if path is not None:
+                cache.writeCacheFile(path, index.toJSON().encode("utf-8"))
+        cls._memo[key] = index
+        return index
+
+    def toJSON(self) -> str:
+        obj: Dict[str, Any] = {"version": self.version}
+        for type, typeEntries in self.entries.items():
+            obj[type.name] = [[off, int(isEnt), n] for off, isEnt, n in typeEntries]
+        return json.dumps(obj)
+
+    @classmethod
+    def fromJSON(cls, text: str) -> "EncounterIndex":
+        obj = json.loads(text)
+        if obj["version"] != cls.version:
+            raise ValueError("Stale encounter index")
+        return cls(
+            {
+                type: [(off, bool(isEnt), n) for off, isEnt, n in obj[type.name]]
+                for type in cls.types
+            }
+        )
+
+    def getOffset(self, type: DataType, ind: int) -> int:
+        return self.entries[type][ind][0]
+
+    def isEntities(self, type: DataType, ind: int) -> bool:
+        return self.entries[type][ind][1]
+
+    def getSize(self, type: DataType, ind: int) -> int:
+        _, isEntities, count = self.entries[type][ind]
+        return 4 * (1 + count) if isEntities else 8 * count
+
+    def parse(self, data: RomData, type: DataType, ind: int) -> EncounterT_BN2:
+        if stats.active is not None:
+            stats.active.count("parsed")
+        return EncounterT_BN2(data, self.getOffset(type, ind))
+
+
+def populateBN2Meta(byteData: RomData):
+    names, _ = BN2Char.decodeAll(
+        byteData,
+        DataType.VirusName_BN2.getOffset(),
+        DataType.VirusName_BN2.getArrayLength(),
+    )
+    vn: Dict[int, str] = dict(enumerate(names))
     vn[255] = "<255>"
     vn[0] = "<0>"
     NameMaps.setVirusNameMap(vn)
 
-    offset = DataType.ChipName_BN2.getOffset()
-    cn: Dict[int, str] = {}
-    for i in range(DataType.ChipName_BN2.getArrayLength()):
-        out, offset = BN2Char.toString(byteData, offset)
-        cn[i] = out
-    NameMaps.setChipNameMap(cn)
-
-    offset = DataType.Chip_BN2.getOffset()
+    names, _ = BN2Char.decodeAll(
+        byteData,
+        DataType.ChipName_BN2.getOffset(),
+        DataType.ChipName_BN2.getArrayLength(),
+    )
+    NameMaps.setChipNameMap(dict(enumerate(names)))
 
     cim: Dict[int, ChipT_BN2] = {}
     for i in range(DataType.Chip_BN2.getArrayLength()):
@@ -279,7 +415,7 @@ class Library:
         return range(199, 247)
 
     @classmethod
-    def getChipMap(cls, data: bytearray) -> Dict[int, ChipT]:
+    def getChipMap(cls, data: RomData) -> Dict[int, ChipT]:
         type = DataType.Chip
         ret: Dict[int, ChipT] = {}
         for i in itertools.chain(cls.standardChipRange(), cls.naviChipRange()):
@@ -289,7 +425,7 @@ class Library:
         return ret
 
     @classmethod
-    def getMBMap(cls, data: bytearray) -> Dict[int, List[int]]:
+    def getMBMap(cls, data: RomData) -> Dict[int, List[int]]:
         type = DataType.Chip
         ret: Dict[int, List[int]] = {}
         for i in cls.standardChipRange():
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+import cache
+
+"""
+A persistent bigram index of a ROM for repeated searches: for each of the
+65536 byte pairs, the sorted offsets at which it occurs. An exact (or
+prefix) query looks up the rarest pair in the pattern and only checks the
+offsets where it occurs. Indexes are stored in the cache directory keyed by
+the hash of the ROM and memory mapped when loaded; search.py uses one
+automatically if it exists. Run this file to build or query an index
+"""
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+HAVE_NUMPY = np is not None
+
+
+class NgramIndex:
+    """
+    File layout: header, 65537 uint32 offsets into the positions array (the
+    positions of pair k are positions[offsets[k]:offsets[k + 1]]), then the
+    uint32 positions of every pair, all little endian
+    """
+
+    magic = b"MMBNGRAM"
+    version = 1
+    header = struct.Struct("<8sII")
+    pairCount = 1 << 16
+
+    def __init__(self, buf: Any):
+        magic, version, self.dataLen = self.header.unpack_from(buf, 0)
+        if magic != self.magic or version != self.version:
+            raise ValueError("Not a bigram index of a supported version")
+        view = memoryview(buf)[self.header.size :]
+        tableSize = 4 * (self.pairCount + 1)
+        self.offsets = view[:tableSize].cast("I")
+        self.positions = view[tableSize:].cast("I")
+        if len(self.positions) != max(self.dataLen - 1, 0):
+            raise ValueError("Bigram index is truncated")
+
+    @classmethod
+    def build(cls, data: Any) -> bytes:
+        pairs = max(len(data) - 1, 0)
+        if HAVE_NUMPY:
+            arr = np.frombuffer(data, dtype=np.uint8)
+            keys = (arr[:-1].astype(np.uint32) << 8) | arr[1:]
+            positions = np.argsort(keys, kind="stable").astype("<u4").tobytes()
+            counts = np.bincount(keys, minlength=cls.pairCount)
+            offsets = np.zeros(cls.pairCount + 1, dtype="<u4")
+            np.cumsum(counts, out=offsets[1:])
+            table = offsets.tobytes()
+        else:
+            buckets: List[List[int]] = [[] for _ in range(cls.pairCount)]
+            for i in range(pairs):
+                buckets[(data[i] << 8) | data[i + 1]].append(i)
+            offsetList = [0]
+            for bucket in buckets:
+                offsetList.append(offsetList[-1] + len(bucket))
+            table = array("I", offsetList).tobytes()
+            positions = array("I", (i for bucket in buckets for i in bucket)).tobytes()
+        header = cls.header.pack(cls.magic, cls.version, len(data))
+        return header + table + positions
+
+    @staticmethod
+    def path(data: Any) -> Optional[str]:
+        return cache.cachePath("ngrams", cache.romHash(data), ".idx")
+
+    _memo: Dict[str, "NgramIndex"] = {}
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NgramIndex"]:
+        if path in cls._memo:
+            return cls._memo[path]
+        try:
+            with open(path, "rb") as inFile:
+                buf = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+            index = cls(buf)
+        except (OSError, ValueError):
+            return None
+        cls._memo[path] = index
+        return index
+
+    @classmethod
+    def forRom(cls, data: Any) -> Optional["NgramIndex"]:
+        """
+        The index for data if one has been built, else None
+        """
+        base = cache.cacheDir()
+        # Avoid hashing data when no index has ever been built
+        if (
+            sys.byteorder != "little"
+            or not base
+            or not os.path.isdir(os.path.join(base, "ngrams"))
+        ):
+            return None
+        path = cls.path(data)
+        if path is None or not os.path.exists(path):
+            return None
+        return cls.load(path)
+
+    @classmethod
+    def buildForRom(cls, data: Any) -> Optional[str]:
+        """
+        Build and store the index for data, returning where it was written
+        """
+        path = cls.path(data)
+        if path is not None:
+            cache.writeCacheFile(path, cls.build(data))
+        return path
+
+    # Checking an offset costs about as much as scanning this many bytes, so
+    # for needles whose rarest pair is more common than one in this many
+    # bytes, a scan of the data is faster than the index
+    scanRatio = 256
+
+    def count(self, pair: bytes) -> int:
+        key = (pair[0] << 8) | pair[1]
+        return self.offsets[key + 1] - self.offsets[key]
+
+    def rarest(self, needle: bytes) -> int:
+        """
+        The offset in needle of its rarest pair
+        """
+        return min(range(len(needle) - 1), key=lambda i: self.count(needle[i:]))
+
+    def isSelective(self, needle: bytes) -> bool:
+        """
+        Whether find is faster than a scan of the data for needle
+        """
+        if len(needle) < 2:
+            return False
+        pair = needle[self.rarest(needle) :]
+        return self.count(pair) * self.scanRatio <= self.dataLen
+
+    def find(self, needle: bytes, data: Any) -> List[int]:
+        """
+        Every offset (overlapping, in increasing order) at which needle
+        occurs in data, which must be the data this index was built from.
+        A needle shorter than 2 bytes has no pair to look up, so data is
+        scanned for it instead
+        """
+        assert len(data) == self.dataLen
+        ret: List[int] = []
+        if len(needle) < 2:
+            found = data.find(needle)
+            while found != -1:
+                ret.append(found)
+                found = data.find(needle, found + 1)
+            return ret
+        # Only the offsets of the rarest pair in needle need checking
+        rarest = self.rarest(needle)
+        key = (needle[rarest] << 8) | needle[rarest + 1]
+        for pos in self.positions[self.offsets[key] : self.offsets[key + 1]]:
+            start = pos - rarest
+            if start >= 0 and data[start : start + len(needle)] == needle:
+                ret.append(start)
+        return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "ngramindex", description="Build or query the bigram index of a ROM"
+    )
+    parser.add_argument("action", choices=("build", "query"))
+    parser.add_argument("file", metavar="file", type=str)
+    parser.add_argument("pattern", metavar="byte", type=str, nargs="*")
+    args = parser.parse_args()
+
+    data = open(args.file, "rb").read()
+    if args.action == "build":
+        path = NgramIndex.buildForRom(data)
+        if path is None:
+            sys.exit("Caching is disabled, see MMBCCR_CACHE_DIR")
+        print(path)
+        return
+    index = NgramIndex.forRom(data)
+    if index is None:
+        sys.exit("No index for this ROM, build one first")
+    needle = bytes(int(byte, 16) for byte in args.pattern)
+    for offset in index.find(needle, data):
+        print(hex(offset))
+
+
+if __name__ == "__main__":
+    main()
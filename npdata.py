@@ -0,0 +1,133 @@
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional
+from megadata import DataType
+from rombuffer import RomBuffer
+
+"""
+Optional NumPy backend for the fixed-stride tables: each table can be viewed
+as a structured array over the ROM buffer itself, so whole-table reads,
+filters and writes are vectorized. Field names match the attributes of the
+corresponding record classes in bn2data/bccdata, which remain the object API.
+numpy is not required by the rest of the randomizer; check HAVE_NUMPY first
+"""
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+HAVE_NUMPY = np is not None
+
+
+def _makeDtypes() -> Dict[DataType, Any]:
+    if not HAVE_NUMPY:
+        return {}
+    shopElem = np.dtype(
+        [
+            ("type", "u1"),
+            ("qty", "u1"),
+            ("ff1", "u1"),
+            ("ff2", "u1"),
+            ("ind", "<u2"),
+            ("code", "<u2"),
+            ("cost", "<u2"),
+            ("zero", "<u2"),
+        ]
+    )
+    chipItem = np.dtype([("chip", "<u2"), ("code", "<u2")])
+    dropItem = np.dtype([("b1", "u1"), ("b2", "u1")])
+    return {
+        DataType.Chip_BN2: np.dtype(
+            [
+                ("codes", "u1", (6,)),
+                ("effect", "<u2"),
+                ("unk1", "u1", (2,)),
+                ("mb", "u1"),
+                ("flags", "u1"),
+                ("ap", "<u2"),
+                ("idx", "<u2"),
+                ("unk2", "u1", (4,)),
+                ("thumbnailPtr", "<u4"),
+                ("imgPtr", "<u4"),
+                ("colorPtr", "<u4"),
+            ]
+        ),
+        DataType.Virus_BN2: np.dtype(
+            [("hp", "<u2"), ("unk", "u1"), ("descBytes", "<u4"), ("level", "u1")]
+        ),
+        DataType.ShopInventory_BN2: np.dtype([("elems", shopElem, (8,))]),
+        DataType.ChipFolder_BN2: np.dtype([("elems", chipItem, (30,))]),
+        DataType.DropTable_BN2: np.dtype([("elems", dropItem, (30,))]),
+        DataType.Chip: np.dtype(
+            [
+                ("hp", "<u2"),
+                ("pri", "<u2"),
+                ("ap", "<u2"),
+                ("mb", "<u2"),
+                ("flags", "<u2"),
+                ("rarity", "u1"),
+                ("chipCategory", "u1"),
+                ("hitChance", "u1"),
+                ("dodgeChance", "u1"),
+                ("artIndex", "u1"),
+                ("palleteIndex", "u1"),
+            ]
+        ),
+        DataType.Encounter: np.dtype(
+            [
+                ("idx", "u1"),
+                ("u1", "u1"),
+                ("u2", "u1"),
+                ("u3", "u1"),
+                ("op", "u1"),
+                ("navi", "u1"),
+                ("altNavi", "u1"),
+                ("chips", "u1", (11,)),
+                ("slotBotThresh", "u1"),
+                ("slotTopThresh", "u1"),
+            ]
+        ),
+        DataType.StartingChips: np.dtype([("chips", "u1", (7,))]),
+    }
+
+
+_dtypes = _makeDtypes()
+
+
+def supportedTypes() -> Iterable[DataType]:
+    return _dtypes.keys()
+
+
+def tableView(type: DataType, data: bytearray) -> Any:
+    """
+    Returns a structured array aliasing the home array of type in data; no
+    bytes are copied, so writes to the view (if data is writable) modify the
+    ROM. Writes made this way are not seen by RomBuffer's tracking, see
+    markWritten
+    """
+    if not HAVE_NUMPY:
+        raise ImportError("numpy is required for table views")
+    dtype = _dtypes[type]
+    assert dtype.itemsize == type.getSize()
+    return np.frombuffer(
+        data, dtype=dtype, count=type.getArrayLength(), offset=type.getOffset()
+    )
+
+
+def markWritten(
+    type: DataType, data: bytearray, indices: Optional[Iterable[int]] = None
+):
+    """
+    Record in a RomBuffer that the given rows of a table (default all of them)
+    were written through a view
+    """
+    if not isinstance(data, RomBuffer):
+        return
+    size = type.getSize()
+    base = type.getOffset()
+    if indices is None:
+        data.markDirty(base, base + size * type.getArrayLength())
+        return
+    for ind in indices:
+        data.markDirty(base + ind * size, base + (ind + 1) * size)
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+
+import argparse
+import struct
+import zlib
+from typing import List, Tuple, Optional, Iterable, Union
+
+"""
+This file exports functions to create and apply IPS and BPS patches, so
+randomized ROMs can be distributed as the few KB which actually changed
+rather than the entire ROM. Running this file directly applies a patch
+"""
+
+Range = Tuple[int, int]
+
+PatchFormats = ("ips", "bps")
+
+
+def diffRanges(
+    base: bytes, modified: Union[bytes, bytearray], chunkSize: int = 4096
+) -> List[Range]:
+    """
+    Returns the sorted [start, end) ranges of modified which differ from base;
+    bytes past the end of base always count as changed
+    """
+    ret: List[Range] = []
+    start = -1
+    commonLen = min(len(base), len(modified))
+    for chunkStart in range(0, commonLen, chunkSize):
+        chunkEnd = min(chunkStart + chunkSize, commonLen)
+        if start < 0 and base[chunkStart:chunkEnd] == modified[chunkStart:chunkEnd]:
+            continue
+        for i in range(chunkStart, chunkEnd):
+            if base[i] != modified[i]:
+                if start < 0:
+                    start = i
+            elif start >= 0:
+                ret.append((start, i))
+                start = -1
+    if len(modified) > commonLen:
+        if start < 0:
+            start = commonLen
+        ret.append((start, len(modified)))
+    elif start >= 0:
+        ret.append((start, commonLen))
+    return ret
+
+
+def _mergeRanges(ranges: Iterable[Range], maxGap: int) -> List[Range]:
+    """
+    Combine ranges separated by at most maxGap unchanged bytes, where emitting
+    the unchanged bytes is cheaper than the overhead of another record
+    """
+    ret: List[Range] = []
+    for start, end in sorted(ranges):
+        if ret and start - ret[-1][1] <= maxGap:
+            ret[-1] = (ret[-1][0], max(end, ret[-1][1]))
+        else:
+            ret.append((start, end))
+    return ret
+
+
+class IPS:
+    """
+    IPS patches are a list of records of the form
+    <3 byte BE offset> <2 byte BE size> <data>, between a "PATCH" header and
+    "EOF" footer. Offsets are limited to 24 bits and the offset 0x454F46
+    can't be used as it reads as "EOF"
+    """
+
+    header = b"PATCH"
+    footer = b"EOF"
+    eofOffset = 0x454F46
+    maxOffset = 0xFFFFFF
+    maxRecord = 0xFFFF
+
+    @classmethod
+    def create(
+        cls,
+        base: bytes,
+        modified: Union[bytes, bytearray],
+        ranges: Optional[Iterable[Range]] = None,
+    ) -> bytes:
+        if ranges is None:
+            ranges = diffRanges(base, modified)
+        out = bytearray(cls.header)
+        for start, end in _mergeRanges(ranges, 5):
+            while start < end:
+                # A record can't begin at "EOF", so begin it a byte early
+                recStart = start - 1 if start == cls.eofOffset else start
+                recEnd = min(end, recStart + cls.maxRecord)
+                if recEnd - 1 > cls.maxOffset:
+                    raise ValueError(f"IPS can't address offset {hex(recEnd - 1)}")
+                out += struct.pack(">I", recStart)[1:]
+                out += struct.pack(">H", recEnd - recStart)
+                out += modified[recStart:recEnd]
+                start = recEnd
+        out += cls.footer
+        if len(modified) < len(base):
+            # Truncation extension
+            out += struct.pack(">I", len(modified))[1:]
+        return bytes(out)
+
+    @classmethod
+    def apply(cls, base: bytes, patch: bytes) -> bytearray:
+        if patch[: len(cls.header)] != cls.header:
+            raise ValueError("Not an IPS patch")
+        out = bytearray(base)
+        pos = len(cls.header)
+        while patch[pos : pos + 3] != cls.footer:
+            (offset,) = struct.unpack(">I", b"\0" + patch[pos : pos + 3])
+            (size,) = struct.unpack_from(">H", patch, pos + 3)
+            pos += 5
+            if size == 0:
+                # RLE record
+                (size,) = struct.unpack_from(">H", patch, pos)
+                chunk = patch[pos + 2 : pos + 3] * size
+                pos += 3
+            else:
+                chunk = patch[pos : pos + size]
+                pos += size
+            if offset + size > len(out):
+                out.extend(bytes(offset + size - len(out)))
+            out[offset : offset + size] = chunk
+        pos += len(cls.footer)
+        if len(patch) >= pos + 3:
+            (newLen,) = struct.unpack(">I", b"\0" + patch[pos : pos + 3])
+            del out[newLen:]
+        return out
+
+
+class BPS:
+    """
+    BPS patches are "BPS1", variable length encoded source/target/metadata
+    sizes, a list of actions, then CRC32s of source, target and the patch.
+    We only emit SourceRead (unchanged bytes) and TargetRead (literal bytes)
+    actions, but any valid patch can be applied
+    """
+
+    header = b"BPS1"
+    SourceRead = 0
+    TargetRead = 1
+    SourceCopy = 2
+    TargetCopy = 3
+
+    @staticmethod
+    def encodeNumber(num: int) -> bytes:
+        out = bytearray()
+        while True:
+            x = num & 0x7F
+            num >>= 7
+            if num == 0:
+                out.append(0x80 | x)
+                return bytes(out)
+            out.append(x)
+            num -= 1
+
+    @staticmethod
+    def decodeNumber(data: bytes, pos: int) -> Tuple[int, int]:
+        num = 0
+        shift = 1
+        while True:
+            x = data[pos]
+            pos += 1
+            num += (x & 0x7F) * shift
+            if x & 0x80:
+                return num, pos
+            shift <<= 7
+            num += shift
+
+    @classmethod
+    def _action(cls, kind: int, length: int) -> bytes:
+        return cls.encodeNumber(((length - 1) << 2) | kind)
+
+    @classmethod
+    def create(
+        cls,
+        base: bytes,
+        modified: Union[bytes, bytearray],
+        ranges: Optional[Iterable[Range]] = None,
+    ) -> bytes:
+        if ranges is None:
+            ranges = diffRanges(base, modified)
+        out = bytearray(cls.header)
+        out += cls.encodeNumber(len(base))
+        out += cls.encodeNumber(len(modified))
+        out += cls.encodeNumber(0)
+        pos = 0
+        # SourceRead is only valid for bytes which exist in the source
+        literal = _mergeRanges(list(ranges) + [(len(base), len(modified))], 2)
+        for start, end in literal:
+            start = min(start, len(modified))
+            end = min(end, len(modified))
+            if start > pos:
+                out += cls._action(cls.SourceRead, start - pos)
+            if end > start:
+                out += cls._action(cls.TargetRead, end - start)
+                out += modified[start:end]
+            pos = max(pos, end)
+        if pos < len(modified):
+            out += cls._action(cls.SourceRead, len(modified) - pos)
+        out += struct.pack("<I", zlib.crc32(base))
+        out += struct.pack("<I", zlib.crc32(modified))
+        out += struct.pack("<I", zlib.crc32(out))
+        return bytes(out)
+
+    @classmethod
+    def apply(cls, base: bytes, patch: bytes) -> bytearray:
+        if patch[: len(cls.header)] != cls.header:
+            raise ValueError("Not a BPS patch")
+        if zlib.crc32(patch[:-4]) != struct.unpack_from("<I", patch, len(patch) - 4)[0]:
+            raise ValueError("BPS patch is corrupt")
+        sourceCrc, targetCrc = struct.unpack_from("<2I", patch, len(patch) - 12)
+        if zlib.crc32(base) != sourceCrc:
+            raise ValueError("BPS patch does not apply to this source")
+        pos = len(cls.header)
+        sourceSize, pos = cls.decodeNumber(patch, pos)
+        targetSize, pos = cls.decodeNumber(patch, pos)
+        metadataSize, pos = cls.decodeNumber(patch, pos)
+        pos += metadataSize
+        out = bytearray()
+        sourceRel = 0
+        targetRel = 0
+        while pos < len(patch) - 12:
+            data, pos = cls.decodeNumber(patch, pos)
+            kind = data & 3
+            length = (data >> 2) + 1
+            if kind == cls.SourceRead:
+                out += base[len(out) : len(out) + length]
+            elif kind == cls.TargetRead:
+                out += patch[pos : pos + length]
+                pos += length
+            else:
+                rel, pos = cls.decodeNumber(patch, pos)
+                rel = -(rel >> 1) if rel & 1 else rel >> 1
+                if kind == cls.SourceCopy:
+                    sourceRel += rel
+                    out += base[sourceRel : sourceRel + length]
+                    sourceRel += length
+                else:
+                    targetRel += rel
+                    # Byte at a time as the copy may overlap its own output
+                    for _ in range(length):
+                        out.append(out[targetRel])
+                        targetRel += 1
+        if len(out) != targetSize or zlib.crc32(out) != targetCrc:
+            raise ValueError("BPS patch produced an invalid target")
+        return out
+
+
+def makePatch(
+    format: str,
+    base: bytes,
+    modified: Union[bytes, bytearray],
+    ranges: Optional[Iterable[Range]] = None,
+) -> bytes:
+    if format == "ips":
+        return IPS.create(base, modified, ranges)
+    elif format == "bps":
+        return BPS.create(base, modified, ranges)
+    raise KeyError(f"Unsupported patch format {format}")
+
+
+def applyPatch(base: bytes, patch: bytes) -> bytearray:
+    if patch.startswith(IPS.header):
+        return IPS.apply(base, patch)
+    elif patch.startswith(BPS.header):
+        return BPS.apply(base, patch)
+    raise ValueError("Unrecognized patch format")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "patch", description="Apply an IPS or BPS patch to a ROM"
+    )
+    parser.add_argument("infile", metavar="infile", type=str)
+    parser.add_argument("patchfile", metavar="patchfile", type=str)
+    parser.add_argument("outfile", metavar="outfile", type=str)
+    args = parser.parse_args()
+
+    base = open(args.infile, "rb").read()
+    patch = open(args.patchfile, "rb").read()
+    outFile = open(args.outfile, "wb+")
+    outFile.write(applyPatch(base, patch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+
+import argparse
+import bisect
+import mmap
+import re
+import struct
+import sys
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+import cache
+from rombuffer import mapRom
+
+"""
+A reverse index of the GBA pointers in a ROM: every little endian uint32 at
+any offset (so at all four alignments) whose value is in the cartridge
+address range 0x08000000-0x09FFFFFF, indexed by the ROM offset it points to.
+The index is built in one vectorized pass if numpy is installed, cached on
+disk by the hash of the ROM and memory mapped when loaded, so finding the
+referrers of an offset is a bisect. Run this file to list the referrers of
+offsets in a ROM
+"""
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+HAVE_NUMPY = np is not None
+
+romLoadOffset = 0x08000000
+romLoadEnd = 0x0A000000
+
+
+class PointerIndex:
+    """
+    File layout: header, then the uint32 targets (ROM offsets) of every
+    pointer in increasing order, then the uint32 offsets of the pointers in
+    the same order, all little endian. Pointers with the same target are
+    ordered by their own offset
+    """
+
+    magic = b"MMBPTRS\0"
+    version = 1
+    header = struct.Struct("<8sII")
+
+    def __init__(self, buf: Any):
+        magic, version, count = self.header.unpack_from(buf, 0)
+        if magic != self.magic or version != self.version:
+            raise ValueError("Not a pointer index of a supported version")
+        view = memoryview(buf)[self.header.size :]
+        self.targets = view[: 4 * count].cast("I")
+        self.referrers = view[4 * count : 8 * count].cast("I")
+        if len(self.referrers) != count:
+            raise ValueError("Pointer index is truncated")
+
+    @classmethod
+    def scan(cls, data: Any) -> Tuple[List[int], List[int]]:
+        """
+        (targets, referrers) of every pointer in data, sorted by target
+        """
+        pairs: List[Tuple[int, int]] = []
+        # The top byte of a pointer is 0x08 or 0x09, so only offsets 3 before
+        # one of those need to be read
+        for found in re.finditer(b"[\x08\x09]", data):
+            offset = found.start() - 3
+            if offset >= 0:
+                (val,) = struct.unpack_from("<I", data, offset)
+                pairs.append((val - romLoadOffset, offset))
+        pairs.sort()
+        return [target for target, _ in pairs], [offset for _, offset in pairs]
+
+    @classmethod
+    def build(cls, data: Any) -> bytes:
+        # Data too short to view at every alignment is scanned
+        if HAVE_NUMPY and len(data) >= 8:
+            targets = []
+            referrers = []
+            for align in range(4):
+                view = np.frombuffer(
+                    data, dtype="<u4", offset=align, count=(len(data) - align) // 4
+                )
+                found = np.flatnonzero((view >= romLoadOffset) & (view < romLoadEnd))
+                targets.append(view[found] - romLoadOffset)
+                referrers.append(found * 4 + align)
+            allTargets = np.concatenate(targets)
+            allReferrers = np.concatenate(referrers)
+            order = np.lexsort((allReferrers, allTargets))
+            count = len(order)
+            body = (
+                allTargets[order].astype("<u4").tobytes()
+                + allReferrers[order].astype("<u4").tobytes()
+            )
+        else:
+            targetList, referrerList = cls.scan(data)
+            count = len(targetList)
+            body = array("I", targetList).tobytes() + array("I", referrerList).tobytes()
+        return cls.header.pack(cls.magic, cls.version, count) + body
+
+    _memo: Dict[str, "PointerIndex"] = {}
+
+    @classmethod
+    def forRom(cls, data: Any) -> "PointerIndex":
+        """
+        The index of data, from the on disk cache if possible
+        """
+        key = cache.romHash(data)
+        if key in cls._memo:
+            return cls._memo[key]
+        path = cache.cachePath("pointers", key, ".idx")
+        index = None
+        if path is not None and sys.byteorder == "little":
+            try:
+                with open(path, "rb") as inFile:
+                    buf = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+                index = cls(buf)
+            except (OSError, ValueError):
+                index = None
+        if index is None:
+            contents = cls.build(data)
+            if path is not None:
+                cache.writeCacheFile(path, contents)
+            index = cls(contents)
+        cls._memo[key] = index
+        return index
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def referrersOf(self, target: int) -> List[int]:
+        """
+        Offsets of every pointer to the ROM offset target (a GBA address is
+        also accepted), in increasing order
+        """
+        if target >= romLoadOffset:
+            target -= romLoadOffset
+        lo = bisect.bisect_left(self.targets, target)
+        hi = bisect.bisect_right(self.targets, target, lo)
+        return self.referrers[lo:hi].tolist()
+
+    def pointersInto(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """
+        (target, referrer) of every pointer to an offset in [start, end),
+        such as anywhere into a table
+        """
+        lo = bisect.bisect_left(self.targets, start)
+        hi = bisect.bisect_left(self.targets, end, lo)
+        return list(zip(self.targets[lo:hi].tolist(), self.referrers[lo:hi].tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "pointers", description="Find the pointers to offsets of a ROM"
+    )
+    # Real pointers are word aligned, but data is often packed
+    parser.add_argument("--aligned", action="store_true")
+    # Report pointers anywhere into [target, target + size)
+    parser.add_argument("--size", metavar="size", type=str, default="1")
+    parser.add_argument("file", metavar="file", type=str)
+    parser.add_argument("targets", metavar="target", type=str, nargs="+")
+    args = parser.parse_args()
+
+    data = mapRom(args.file)
+    index = PointerIndex.forRom(data)
+    size = int(args.size, 16)
+    for targetStr in args.targets:
+        target = int(targetStr, 16)
+        if target >= romLoadOffset:
+            target -= romLoadOffset
+        print(f"{hex(target)}:")
+        for pointee, referrer in index.pointersInto(target, target + size):
+            if args.aligned and referrer % 4:
+                continue
+            suffix = f" -> {hex(pointee)}" if size > 1 else ""
+            print(f"  {hex(referrer)}{suffix}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,41 @@
 #!/usr/bin/python
 
+import os
 import sys
 import argparse
 import configparser
+import io
+import json
 import random
-from typing import Optional, Callable
-from enum import Enum
-
-
-class Game(Enum):
-    BCC = 1
-    BN2 = 2
-
-
-def identifyGame(byteData: bytearray) -> Game:
-    header = byteData[0xA0:0xB0]
-    if header == b"BATTLECHIPGPA89E":
-        return Game.BCC
-    elif header == b"MEGAMAN_EXE2AE2E":
-        return Game.BN2
-    raise Exception(f"Detected no valid game, found header {header}")
+import stats
+from contextlib import nullcontext, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Callable, Iterable, List, Tuple, Union
+from rombuffer import RomBuffer
+from megadata import Game, identifyGame
 
 
 def randomize(
-    byteData: bytearray, config: configparser.ConfigParser, seed: Optional[int]
+    byteData: bytearray,
+    config: configparser.ConfigParser,
+    seed: Optional[int],
+    runStats: Optional[stats.RunStats] = None,
 ) -> int:
+    """
+    Randomize byteData in place, returning the seed used. If runStats is
+    given, per-stage timings and counts are collected into it
+    """
     if not seed:
         seed = random.randint(0, 2 ** 64)
+    with runStats if runStats is not None else nullcontext():
+        _randomize(byteData, config, seed)
+    if runStats is not None:
+        runStats.info["seed"] = seed
+        runStats.info["game"] = identifyGame(byteData).name
+    return seed
+
+
+def _randomize(byteData: bytearray, config: configparser.ConfigParser, seed: int):
     random.seed(seed)
     print(f"Randomizing with seed {seed}")
     game = identifyGame(byteData)
@@ -34,23 +43,168 @@ def randomize(
     if game == Game.BCC:
         import rando_bcc
 
-        rando_bcc.randomizeChips(byteData, config)
-        rando_bcc.randomizeEncounters(byteData, config)
-        rando_bcc.randomizeNames(byteData, config)
+        with stats.stage("randomizeChips"):
+            rando_bcc.randomizeChips(byteData, config)
+        with stats.stage("randomizeEncounters"):
+            rando_bcc.randomizeEncounters(byteData, config)
+        with stats.stage("randomizeNames"):
+            rando_bcc.randomizeNames(byteData, config)
     elif game == Game.BN2:
         import rando_bn2
         import megadata
 
-        megadata.populateBN2Meta(byteData)
-        rando_bn2.randomizeChips(byteData, config)
+        # The layout of the encounter lists is fixed, so index them before
+        # anything is changed for the index to be shared with other seeds
+        with stats.stage("encounterIndex"):
+            encounterIndex = megadata.EncounterIndex.forRom(byteData)
+        with stats.stage("populateBN2Meta"):
+            megadata.populateBN2Meta(byteData)
+        with stats.stage("randomizeChips"):
+            rando_bn2.randomizeChips(byteData, config)
         # Regenerate meta based on the updated chip data
-        megadata.populateBN2Meta(byteData)
-        rando_bn2.randomizeEncounters(byteData, config)
-        rando_bn2.randomizeShops(byteData, config)
-        rando_bn2.randomizeFolders(byteData, config)
-        rando_bn2.randomizeDropTables(byteData, config)
-        rando_bn2.randomizeGMD(byteData, config)
-    return seed
+        with stats.stage("populateBN2Meta"):
+            megadata.populateBN2Meta(byteData)
+        with stats.stage("randomizeEncounters"):
+            rando_bn2.randomizeEncounters(byteData, config, encounterIndex)
+        with stats.stage("randomizeShops"):
+            rando_bn2.randomizeShops(byteData, config)
+        with stats.stage("randomizeFolders"):
+            rando_bn2.randomizeFolders(byteData, config)
+        with stats.stage("randomizeDropTables"):
+            rando_bn2.randomizeDropTables(byteData, config)
+        with stats.stage("randomizeGMD"):
+            rando_bn2.randomizeGMD(byteData, config)
+
+
+def configToString(config: configparser.ConfigParser) -> str:
+    """
+    Serialize a config so it can be handed to another process and re-read
+    with exactly the same contents
+    """
+    out = io.StringIO()
+    config.write(out)
+    return out.getvalue()
+
+
+def canonicalConfig(config: configparser.ConfigParser) -> str:
+    """
+    A form of config which is the same for any two configs with the same
+    settings, regardless of ordering, case of keys, comments or whitespace
+    """
+    return json.dumps(
+        {name: dict(config.items(name, raw=True)) for name in config.sections()},
+        sort_keys=True,
+    )
+
+
+# Per-process state for batch workers; the base ROM and config are sent once
+# when the worker starts rather than once per seed
+_batchBase: bytes = b""
+_batchConfig: Optional[configparser.ConfigParser] = None
+
+
+def _initBatchWorker(baseData: bytes, confStr: str):
+    global _batchBase, _batchConfig
+    _batchBase = baseData
+    _batchConfig = configparser.ConfigParser()
+    _batchConfig.read_string(confStr)
+
+
+def _randomizeBatchSeed(
+    seed: int, outDir: str, ext: str, patchFormat: str
+) -> Tuple[int, str]:
+    assert _batchConfig is not None
+    byteData = RomBuffer(_batchBase, skipUnchanged=True)
+    seed = randomize(byteData, _batchConfig, seed)
+    outPath = os.path.join(outDir, f"{seed}{ext}")
+    with open(outPath, "wb+") as outFile:
+        outFile.write(makeOutput(_batchBase, byteData, patchFormat))
+    return seed, outPath
+
+
+def makeOutput(
+    base: bytes, byteData: bytearray, patchFormat: str = ""
+) -> Union[bytes, bytearray]:
+    """
+    The data to emit for a randomized ROM: the ROM itself, or if patchFormat
+    is set, a patch of that format against the base ROM. If byteData is a
+    RomBuffer, only the ranges written during randomization are considered
+    """
+    if not patchFormat:
+        return byteData
+    import patch
+
+    ranges = byteData.dirtyRanges() if isinstance(byteData, RomBuffer) else None
+    return patch.makePatch(patchFormat, base, byteData, ranges)
+
+
+def warmWorker():
+    """
+    Initializer for long lived worker processes: import everything a
+    randomization needs up front, rather than in the first request
+    """
+    import megadata
+    import patch
+    import rando_bcc
+    import rando_bn2
+
+
+def randomizeRequest(
+    baseData: bytes,
+    confStr: str,
+    seed: Optional[int],
+    patchFormat: str = "",
+    collectStats: bool = False,
+) -> Tuple[str, bytes, Optional[str]]:
+    """
+    Randomize a ROM for the web server, returning the seed used, the output
+    (see makeOutput) and the stats as compact JSON if collectStats is set.
+    This runs in a worker process, which handles one request at a time, so
+    requests never share the random module's state or the NameMaps
+    """
+    config = configparser.ConfigParser()
+    config.read_string(confStr)
+    byteData = RomBuffer(baseData, skipUnchanged=True)
+    runStats = stats.RunStats() if collectStats else None
+    usedSeed = randomize(byteData, config, seed, runStats)
+    output = bytes(makeOutput(baseData, byteData, patchFormat))
+    return str(usedSeed), output, runStats.dumps(indent=None) if runStats else None
+
+
+def randomizeBatch(
+    baseData: bytes,
+    config: configparser.ConfigParser,
+    seeds: Iterable[int],
+    outDir: str,
+    ext: str = ".gba",
+    jobs: Optional[int] = None,
+    patchFormat: str = "",
+) -> List[Tuple[int, str]]:
+    """
+    Randomize the given ROM once per seed, writing each result to
+    outDir/<seed><ext>. Seeds are distributed over a process pool; each
+    output is identical to what a single run with that seed would produce
+    Returns a list of (seed, output path) in the order of seeds, with any
+    repeated seed only randomized once. Seed 0 isn't allowed since
+    randomize would replace it with a random seed
+    """
+    # Two workers must never write the same output file
+    seeds = list(dict.fromkeys(seeds))
+    if 0 in seeds:
+        raise ValueError("Seed 0 can't be used in batch mode")
+    if patchFormat:
+        ext = f".{patchFormat}"
+    os.makedirs(outDir, exist_ok=True)
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_initBatchWorker,
+        initargs=(bytes(baseData), configToString(config)),
+    ) as executor:
+        futures = [
+            executor.submit(_randomizeBatchSeed, seed, outDir, ext, patchFormat)
+            for seed in seeds
+        ]
+        return [future.result() for future in futures]
 
 
 def main():
@@ -59,12 +213,32 @@ def main():
     )
     parser.add_argument("--conf", "-f", metavar="conffile", type=str, default="")
     parser.add_argument("--seed", "-s", metavar="seed", type=int, default=None)
+    # Batch mode: randomize many seeds at once into a directory
+    parser.add_argument("--seeds", metavar="seed", type=int, nargs="+", default=None)
+    parser.add_argument(
+        "--seedRange", metavar=("first", "last"), type=int, nargs=2, default=None
+    )
+    parser.add_argument("--outdir", "-o", metavar="outdir", type=str, default="")
+    parser.add_argument("--jobs", "-j", metavar="jobs", type=int, default=None)
+    # Write an ips/bps patch against infile rather than the full ROM
+    parser.add_argument("--patch", "-p", choices=("ips", "bps"), default="")
+    # Write per-stage timings and counts as JSON, to stdout if no path is given
+    parser.add_argument(
+        "--stats", metavar="statsfile", type=str, nargs="?", const="-", default=""
+    )
     parser.add_argument("infile", metavar="infile", type=str)
-    parser.add_argument("outfile", metavar="outfile", type=str)
+    parser.add_argument("outfile", metavar="outfile", type=str, nargs="?")
     args = parser.parse_args()
+    isBatch = args.seeds is not None or args.seedRange is not None
+    if isBatch and not args.outdir:
+        parser.error("--outdir is required with --seeds or --seedRange")
+    if not isBatch and not args.outfile:
+        parser.error("outfile is required unless running in batch mode")
+    if isBatch and args.stats:
+        parser.error("--stats is not supported in batch mode")
     input = open(args.infile, "rb")
 
-    byteData = bytearray(input.read())
+    byteData = RomBuffer(input.read(), skipUnchanged=True)
     game = identifyGame(byteData)
     if not args.conf:
         args.conf = "rando_bcc.conf" if game == Game.BCC else "rando_bn2.conf"
@@ -72,9 +246,34 @@ def main():
     config = configparser.ConfigParser()
     config.read(args.conf)
 
-    randomize(byteData, config, args.seed)
+    if isBatch:
+        seeds = list(args.seeds or [])
+        if args.seedRange is not None:
+            first, last = args.seedRange
+            seeds.extend(range(first, last + 1))
+        if 0 in seeds:
+            parser.error("seed 0 can't be used in batch mode")
+        ext = os.path.splitext(args.infile)[1] or ".gba"
+        for seed, outPath in randomizeBatch(
+            byteData, config, seeds, args.outdir, ext, args.jobs, args.patch
+        ):
+            print(f"{seed}: {outPath}")
+        return
+
+    base = bytes(byteData) if args.patch else b""
+    runStats = stats.RunStats() if args.stats else None
+    # Progress goes to stderr when stdout is for the stats, so that it can
+    # be parsed as JSON
+    with redirect_stdout(sys.stderr) if args.stats == "-" else nullcontext():
+        randomize(byteData, config, args.seed, runStats)
     outFile = open(args.outfile, "wb+")
-    outFile.write(byteData)
+    outFile.write(makeOutput(base, byteData, args.patch))
+    if runStats is not None:
+        if args.stats == "-":
+            print(runStats.dumps())
+        else:
+            with open(args.stats, "w") as statsFile:
+                statsFile.write(runStats.dumps())
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
-from typing import List, cast, Callable, Any, Tuple
+from typing import List, Callable, Any, Iterable, Tuple, Optional
 import configparser
 import random
-from megadata import DataType, DataTypeVar
+import stats
+from megadata import DataType, DataTypeVar, EncounterIndex
 from bn2data import (
     DropTable,
     ShopInventory,
@@ -82,7 +83,11 @@ def randomizeEncounter(
     # Randomizing locations would require some knowledge
 
 
-def randomizeEncounters(data: bytearray, config: configparser.ConfigParser):
+def randomizeEncounters(
+    data: bytearray,
+    config: configparser.ConfigParser,
+    index: Optional[EncounterIndex] = None,
+):
     choices = config["Encounters"]
     changeFixed = choices.getboolean("RandomizeFixed")
     changeNet = choices.getboolean("RandomizeNet")
@@ -98,18 +103,19 @@ def randomizeEncounters(data: bytearray, config: configparser.ConfigParser):
     if changeFixed:
         randoTypes.append(DataType.EncounterEVT_BN2)
 
+    if index is None:
+        index = EncounterIndex.build(data)
     for type in randoTypes:
-        offset = type.getOffset()
         for i in range(type.getArrayLength()):
-            encounter = cast(EncounterT_BN2, type.parseAtOffset(data, offset))
-            writeOffset = offset
-            offset += encounter.getSize()
             if type == DataType.EncounterEVT_BN2 and i < 3 and not changeTutorial:
                 continue
-            if not encounter.isEntities():
+            if not index.isEntities(type, i):
                 continue
+            encounter = index.parse(data, type, i)
             randomizeEncounter(encounter, choices, type, i)
-            encounter.serialize(data, writeOffset)
+            encounter.serialize(data, index.getOffset(type, i))
+            if stats.active is not None:
+                stats.active.count("serialized")
 
 
 def getStoryChips() -> List[Tuple[int, int]]:
@@ -353,6 +359,9 @@ def randomizeDropTable(table: DropTable, config: configparser.SectionProxy, ind:
 def randomizeGMD(data: bytearray, configuration: configparser.ConfigParser):
     gmd = GMD(data)
     config = configuration["GMD"]
+    if stats.active is not None:
+        stats.active.count("parsed", len(gmd.info))
+        stats.active.count("serialized", len(gmd.info))
     for info in gmd.info:
         lastChip = -1
         lastCode = 0x1A
@@ -392,30 +401,54 @@ def _randomizeCommon(
     config: configparser.SectionProxy,
     type: DataType,
     fcn: Callable[[Any, configparser.SectionProxy, int], None],
+    indices: Iterable[int],
 ):
 
-    offset = type.getOffset()
-    for i in range(type.getArrayLength()):
-        item = type.parseAtOffset(data, offset)
-        writeOffset = offset
-        offset += type.getSize()
-        fcn(item, config, i)
-        item.serialize(data, writeOffset)
+    # Only the objects at indices (in increasing order) are parsed, and only
+    # those that fcn actually modifies are written back. indices must only
+    # leave out objects which fcn would leave alone without using the random
+    # module
+    with type.table(data) as table:
+        for i in indices:
+            fcn(table[i], config, i)
 
 
 def randomizeShops(data: bytearray, config: configparser.ConfigParser):
-    _randomizeCommon(data, config["Shops"], DataType.ShopInventory_BN2, randomizeShop)
+    type = DataType.ShopInventory_BN2
+    shops: List[int] = []
+    if config["Shops"].getboolean("RandomizeChips"):
+        # randomizeShop leaves sub chip shops alone
+        shops = [
+            i
+            for i in range(type.getArrayLength())
+            if not ShopInventory.isSubChipShopAt(
+                data, type.getOffset() + i * type.getSize()
+            )
+        ]
+    _randomizeCommon(data, config["Shops"], type, randomizeShop, shops)
 
 
 def randomizeChips(data: bytearray, config: configparser.ConfigParser):
-    _randomizeCommon(data, config["Chips"], DataType.Chip_BN2, randomizeChipInfo)
+    type = DataType.Chip_BN2
+    chips = range(type.getArrayLength())
+    if not config["Chips"].getboolean("RandomizeCodes"):
+        chips = range(0)
+    _randomizeCommon(data, config["Chips"], type, randomizeChipInfo, chips)
 
 
 def randomizeFolders(data: bytearray, config: configparser.ConfigParser):
-    _randomizeCommon(data, config["Folders"], DataType.ChipFolder_BN2, randomizeFolder)
+    type = DataType.ChipFolder_BN2
+    folders = range(type.getArrayLength())
+    if not config["Folders"].getboolean("RandomizeTutorial", False):
+        # randomizeFolder leaves the tutorial folders alone
+        folders = range(3)
+    _randomizeCommon(data, config["Folders"], type, randomizeFolder, folders)
 
 
 def randomizeDropTables(data: bytearray, config: configparser.ConfigParser):
-    _randomizeCommon(
-        data, config["DropTables"], DataType.DropTable_BN2, randomizeDropTable
-    )
+    type = DataType.DropTable_BN2
+    tables = range(type.getArrayLength())
+    if not config["DropTables"].getboolean("RandomizeNavis"):
+        # Navi drop tables are left alone, PopulateUnused never touches them
+        tables = range(128)
+    _randomizeCommon(data, config["DropTables"], type, randomizeDropTable, tables)
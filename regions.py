@@ -0,0 +1,145 @@
+import bisect
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+import cache
+from megadata import DataType, EncounterIndex, Game, identifyGame
+from bn2data import BN2Char, GMD
+from bccdata import StringT
+
+"""
+A map of the known structures of a ROM, answering which of them contain a
+given offset in O(log n). It is built once per ROM from the DataType
+registry: every object of the fixed size tables, the real sizes of the
+encounter lists (from the EncounterIndex) and name strings, the GMD data
+and, for BCC, the strings the pointer tables point to. Possibly overlapping
+regions are split into elementary segments, each with the labels of every
+region covering it, so a lookup is a single bisect
+"""
+
+Region = Tuple[int, int, str]
+
+
+class RegionMap:
+    def __init__(self, regions: Iterable[Region]):
+        """
+        regions are (start, end, label) with end exclusive
+        """
+        events: Dict[int, List[Tuple[bool, str]]] = {}
+        for start, end, label in regions:
+            if end <= start:
+                continue
+            events.setdefault(start, []).append((True, label))
+            events.setdefault(end, []).append((False, label))
+        # starts[i] is the start of a segment covered by labels[i], which
+        # ends where the next one starts
+        self.starts: List[int] = []
+        self.labels: List[Tuple[str, ...]] = []
+        active: Dict[str, int] = {}
+        for offset in sorted(events):
+            for isStart, label in events[offset]:
+                active[label] = active.get(label, 0) + (1 if isStart else -1)
+                if not active[label]:
+                    del active[label]
+            self.starts.append(offset)
+            self.labels.append(tuple(active))
+
+    def labelsAt(self, offset: int) -> Tuple[str, ...]:
+        """
+        The labels of every known region containing offset
+        """
+        i = bisect.bisect_right(self.starts, offset) - 1
+        return self.labels[i] if i >= 0 else ()
+
+    def label(self, offset: int) -> Optional[str]:
+        labels = self.labelsAt(offset)
+        return labels[0] if labels else None
+
+    def isMapped(self, offset: int) -> bool:
+        return bool(self.labelsAt(offset))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def build(cls, data: bytearray, game: Game) -> "RegionMap":
+        regions: List[Region] = []
+        for type in DataType:
+            if type.getGame() != game:
+                continue
+            regions += _typeRegions(data, type)
+        if game == Game.BN2:
+            regions += _gmdRegions()
+        return cls(regions)
+
+    _memo: Dict[str, "RegionMap"] = {}
+
+    @classmethod
+    def forRom(cls, data: bytearray) -> "RegionMap":
+        """
+        The map of a ROM, which is empty if it isn't one of the games
+        """
+        key = cache.romHash(data)
+        if key not in cls._memo:
+            try:
+                game = identifyGame(data)
+            except Exception:
+                cls._memo[key] = cls([])
+            else:
+                cls._memo[key] = cls.build(data, game)
+        return cls._memo[key]
+
+
+def _typeRegions(data: bytearray, type: DataType) -> List[Region]:
+    info = type.getInfo()
+    offset = type.getOffset()
+    count = type.getArrayLength()
+    name = type.name
+    regions: List[Region] = []
+    if type.isVarLengthString() and count > 0:
+        # Consecutive strings, each followed by a terminator
+        for i, end in enumerate(BN2Char.terminatorRe.finditer(data, offset)):
+            if i == count:
+                break
+            regions.append((offset, end.start() + 1, f"{name}[{i}]"))
+            offset = end.start() + 1
+    elif info.size == 0:
+        index = EncounterIndex.forRom(data)
+        for i in range(count):
+            start = index.getOffset(type, i)
+            regions.append((start, start + index.getSize(type, i), f"{name}[{i}]"))
+    elif info.size:
+        for i in range(count):
+            start = offset + i * info.size
+            regions.append((start, start + info.size, f"{name}[{i}]"))
+            if info.indirect:
+                regions += _pointedRegions(data, type, start, f"{name}[{i}]")
+    return regions
+
+
+def _pointedRegions(data: bytearray, type: DataType, offset: int, label: str):
+    # The strings (and for doubly indirect strings, the inner pointer)
+    # which the pointer at offset leads to
+    regions: List[Region] = []
+    parser = type.getInfo().parser
+    assert parser is not None
+    try:
+        string = parser(data, offset)
+    except (struct.error, IndexError):
+        return regions
+    if not isinstance(string, StringT):
+        return regions
+    namePtr = string.getNamePtr(data, offset)
+    regions.append((namePtr, namePtr + 2 * len(string.chars), f"{label} string"))
+    if string.indirect:
+        (pointer,) = struct.unpack_from("<I", data, offset)
+        inner = pointer - 0x08000000
+        regions.append((inner, inner + 4, f"{label} pointer"))
+    return regions
+
+
+def _gmdRegions() -> List[Region]:
+    regions: List[Region] = []
+    for i, info in enumerate(GMD.info):
+        size = sum(off.getSize() for off in info.chips + info.zennies)
+        regions.append((info.offset, info.offset + size, f"GMD_BN2[{i}]"))
+    return regions
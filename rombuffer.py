@@ -0,0 +1,130 @@
+from typing import List, Tuple, Union, Iterable, Optional
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+import struct
+
+Range = Tuple[int, int]
+# What a ROM can be read from: a bytearray (or RomBuffer) being randomized,
+# or bytes or a read only map for tools which only inspect it
+RomData = Union[bytes, bytearray, mmap.mmap]
+
+
+class RomBuffer(bytearray):
+    """
+    A bytearray which remembers which bytes have been written, as a sorted
+    set of coalesced [start, end) ranges. Writes must go through item
+    assignment or packInto to be recorded; struct.pack_into on the buffer
+    directly bypasses the tracking.
+    If skipUnchanged is set, writes which would not change any bytes are
+    dropped and partially redundant writes only mark the bytes that changed,
+    so the dirty ranges closely cover the data that actually differs
+    """
+
+    def __init__(self, data: Union[bytes, Iterable[int]] = b"", *, skipUnchanged=False):
+        super().__init__(data)
+        self.skipUnchanged = skipUnchanged
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def markDirty(self, start: int, end: int):
+        if start >= end:
+            return
+        # Intervals which overlap or touch [start, end) are merged with it
+        lo = bisect_left(self._ends, start)
+        hi = bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("RomBuffer does not support extended slices")
+            value = bytes(value)
+            if self.skipUnchanged and len(value) == stop - start:
+                span = _changedSpan(self[start:stop], value)
+                if span is None:
+                    return
+                super().__setitem__(key, value)
+                self.markDirty(start + span[0], start + span[1])
+                return
+            oldLen = len(self)
+            super().__setitem__(key, value)
+            end = max(stop, start + len(value))
+            self.markDirty(start, len(self) if len(self) != oldLen else end)
+        else:
+            if key < 0:
+                key += len(self)
+            if self.skipUnchanged and self[key] == value:
+                return
+            super().__setitem__(key, value)
+            self.markDirty(key, key + 1)
+
+    def packInto(self, st: struct.Struct, offset: int, *values):
+        if self.skipUnchanged:
+            packed = st.pack(*values)
+            span = _changedSpan(self[offset : offset + st.size], packed)
+            if span is None:
+                return
+            st.pack_into(self, offset, *values)
+            self.markDirty(offset + span[0], offset + span[1])
+            return
+        st.pack_into(self, offset, *values)
+        self.markDirty(offset, offset + st.size)
+
+    def dirtyRanges(self) -> List[Range]:
+        return list(zip(self._starts, self._ends))
+
+    def dirtySize(self) -> int:
+        return sum(end - start for start, end in self.dirtyRanges())
+
+    def isDirty(self, offset: int) -> bool:
+        ind = bisect_right(self._starts, offset) - 1
+        return ind >= 0 and offset < self._ends[ind]
+
+    def clearDirty(self):
+        self._starts = []
+        self._ends = []
+
+
+def _changedSpan(old: Union[bytes, bytearray], new: bytes) -> Optional[Range]:
+    """
+    The [start, end) span covering every byte that differs between two
+    equal length byte strings, or None if they are identical
+    """
+    if old == new:
+        return None
+    first = 0
+    while old[first] == new[first]:
+        first += 1
+    last = len(new)
+    while old[last - 1] == new[last - 1]:
+        last -= 1
+    return first, last
+
+
+def packInto(st: struct.Struct, data: bytearray, offset: int, *values):
+    """
+    struct.pack_into, which records the write if data is a RomBuffer; all
+    serialize() methods should write through this
+    """
+    if isinstance(data, RomBuffer):
+        data.packInto(st, offset, *values)
+    else:
+        st.pack_into(data, offset, *values)
+
+
+def mapRom(path: str) -> Union[mmap.mmap, bytes]:
+    """
+    A read only memory map of the file at path, for tools which only read a
+    ROM: nothing is copied up front and the pages are shared between
+    processes. Empty files can't be mapped and are read instead
+    """
+    with open(path, "rb") as inFile:
+        if os.fstat(inFile.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
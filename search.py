@@ -1,13 +1,17 @@
 #!/usr/bin/python
 
-from os import extsep
+import copy
+import os
 import sys
 import argparse
-from typing import List, Any, Dict
-from megadata import DataType
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Any, Dict, Optional, Sequence, Tuple
+from regions import RegionMap
+from rombuffer import RomData, mapRom
+import fastsearch
 
 
-def getDatum(data: bytearray, ind: int, args: Any):
+def getDatum(data: Any, ind: int, args: Any):
     ret = 0
     for i in range(args.dataSize):
         ret <<= 8
@@ -16,7 +20,23 @@ def getDatum(data: bytearray, ind: int, args: Any):
     return ret
 
 
-def search(pattern: List[int], data: bytearray, args: Any) -> List[int]:
+def search(pattern: List[int], data: RomData, args: Any) -> List[int]:
+    """
+    Returns the offsets of matches of pattern in data, as described by args;
+    see main for the meaning of each option
+    """
+    if not getattr(args, "reference", False):
+        engine = fastsearch.engineFor(args)
+        if engine is not None:
+            return engine(pattern, data, args)
+    return searchReference(pattern, data, args)
+
+
+def searchReference(pattern: List[int], data: RomData, args: Any) -> List[int]:
+    """
+    The original position at a time search, which the engines in fastsearch
+    reproduce exactly
+    """
     stride: int = args.stride
     rooted: bool = args.rooted
     ind = 0
@@ -72,34 +92,75 @@ def search(pattern: List[int], data: bytearray, args: Any) -> List[int]:
     return ret
 
 
-def isBN2Mapped(loc: int):
+# Per-process state for stride sweep workers, sent once when each starts
+_workerData: Any = b""
+_workerArgs: Any = None
+
+
+def _initStrideWorker(data: Any, args: Any):
+    # data is the ROM, or the path of a ROM file which each worker maps
+    global _workerData, _workerArgs
+    _workerData = mapRom(data) if isinstance(data, str) else data
+    _workerArgs = args
+
+
+def _searchStrideRange(
+    pattern: List[int], strides: Sequence[int]
+) -> List[Tuple[int, List[int]]]:
+    ret: List[Tuple[int, List[int]]] = []
+    for stride in strides:
+        args = copy.copy(_workerArgs)
+        args.stride = stride
+        ret.append((stride, search(pattern, _workerData, args)))
+    return ret
+
+
+def searchStrides(
+    pattern: List[int],
+    data: bytes,
+    args: Any,
+    strides: Sequence[int],
+    jobs: Optional[int] = None,
+    path: Optional[str] = None,
+) -> Dict[int, List[int]]:
     """
-    Returns true if the data is already known in BN2 mapping
-    TODO: incorporate variable size regions
+    Runs search once per stride, returning the results for each stride. The
+    strides are split into one contiguous range per worker of a process pool.
+    If data was read from the file at path, workers map the file rather than
+    being sent a copy of data
     """
-    for type in [
-        DataType.Chip_BN2,
-        DataType.Virus_BN2,
-        DataType.EncounterEVT_BN2,
-        DataType.EncounterRegion_BN2,
-        DataType.ShopInventory_BN2,
-        DataType.ChipFolder_BN2,
-    ]:
-        base = type.getOffset()
-        end = base + type.getArrayLength() * type.getSize()
-        if loc >= base and loc <= end:
-            return True
-    return False
-
-
-def printRes(res: List[int], args: Any):
+    jobs = min(jobs or os.cpu_count() or 1, len(strides))
+    if jobs <= 1:
+        _initStrideWorker(data, args)
+        return dict(_searchStrideRange(pattern, strides))
+    chunkSize = -(-len(strides) // jobs)
+    chunks = [strides[i : i + chunkSize] for i in range(0, len(strides), chunkSize)]
+    ret: Dict[int, List[int]] = {}
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_initStrideWorker,
+        initargs=(path or bytes(data), args),
+    ) as executor:
+        futures = [
+            executor.submit(_searchStrideRange, pattern, chunk) for chunk in chunks
+        ]
+        for future in futures:
+            ret.update(future.result())
+    return ret
+
+
+def printRes(res: List[int], args: Any, regions: Optional[RegionMap] = None):
     prev = 0
     for loc in res:
         delta = loc - prev
         if args.maxDelta == 0 or delta < args.maxDelta:
-            if args.skipMapped and isBN2Mapped(loc):
+            labels = regions.labelsAt(loc) if regions is not None else ()
+            if args.skipMapped and labels:
                 continue
-            print(hex(loc))
+            if args.label and labels:
+                print(hex(loc), ", ".join(labels))
+            else:
+                print(hex(loc))
             if args.printDelta:
                 print(loc - prev)
         prev = loc
@@ -109,7 +170,10 @@ def main():
     parser = argparse.ArgumentParser(
         "search", description="A utility to find patterns in the source ROM"
     )
+    # A stride of -1 searches with every stride from 1 to 63
     parser.add_argument("--stride", metavar="stride", type=int, default=1)
+    # Number of processes for a stride sweep, default one per CPU
+    parser.add_argument("--jobs", "-j", metavar="jobs", type=int, default=None)
     parser.add_argument("--delta", action="store_true")
     parser.add_argument("--rooted", action="store_true")
     parser.add_argument("--middleStart", action="store_true")
@@ -117,29 +181,34 @@ def main():
     parser.add_argument("--hex", action="store_true")
     parser.add_argument("--printDelta", action="store_true")
     parser.add_argument("--maxDelta", metavar="maxDelta", type=int, default=0)
+    # Skip or label hits inside known structures of the ROM
     parser.add_argument("--skipMapped", action="store_true")
+    parser.add_argument("--label", action="store_true")
     parser.add_argument("--dataSize", metavar="dataSize", type=int, default=1)
+    # Use the original pure python scan rather than the fast engines
+    parser.add_argument("--reference", action="store_true")
     parser.add_argument("file", metavar="file", type=str)
     parser.add_argument("pattern", metavar="code", type=str, nargs="+")
     args = parser.parse_args()
 
-    input = open(args.file, "rb")
-
-    byteData = input.read()
+    byteData = mapRom(args.file)
 
     base = 16 if args.hex else 10
     args.pattern = [int(x, base) for x in args.pattern]
+    regions = None
+    if args.skipMapped or args.label:
+        regions = RegionMap.forRom(byteData)
     if args.stride == -1:
-        args.stride = 1
-        while args.stride < 64:
-            print(args.stride)
-            res = search(args.pattern, byteData, args)
+        results = searchStrides(
+            args.pattern, byteData, args, range(1, 64), args.jobs, args.file
+        )
+        for stride, res in results.items():
+            print(stride)
             if len(res) > 0:
-                printRes(res, args)
-            args.stride += 1
+                printRes(res, args, regions)
     else:
         res = search(args.pattern, byteData, args)
-    printRes(res, args)
+        printRes(res, args, regions)
 
 
 if __name__ == "__main__":
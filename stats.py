@@ -0,0 +1,127 @@
+import json
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, Optional
+
+"""
+Instrumentation for a randomizer run: wall and CPU time per stage, plus the
+number of records parsed and serialized and random numbers drawn in each
+stage. A RunStats only collects anything while it is active (inside its with
+block); otherwise the hooks elsewhere cost a single global lookup
+"""
+
+# The random module functions counted as draws while stats are active
+_rngFunctions = (
+    "random",
+    "randint",
+    "randrange",
+    "choice",
+    "choices",
+    "shuffle",
+    "sample",
+    "uniform",
+    "gauss",
+)
+
+
+class StageStats:
+    __slots__ = ("calls", "wall", "cpu", "parsed", "serialized", "rngDraws")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.parsed = 0
+        self.serialized = 0
+        self.rngDraws = 0
+
+    def toJSON(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class RunStats:
+    """
+    Use as a context manager around the run, and stage() around each stage:
+        with runStats, stats.stage("randomizeChips"):
+            ...
+    Stages with the same name accumulate. Counts made outside any stage
+    are only included in the total
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.total = StageStats()
+        self.info: Dict[str, Any] = {}
+        self.current: Optional[StageStats] = None
+        self._saved: Dict[str, Callable] = {}
+        self._start = (0.0, 0.0)
+
+    def __enter__(self) -> "RunStats":
+        global active
+        assert active is None, "Only one RunStats may be active at a time"
+        active = self
+        for name in _rngFunctions:
+            self._saved[name] = getattr(random, name)
+            setattr(random, name, self._countingRng(self._saved[name]))
+        self._start = (time.perf_counter(), time.process_time())
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        global active
+        self.total.calls += 1
+        self.total.wall += time.perf_counter() - self._start[0]
+        self.total.cpu += time.process_time() - self._start[1]
+        for name, fcn in self._saved.items():
+            setattr(random, name, fcn)
+        self._saved = {}
+        active = None
+
+    def _countingRng(self, fcn: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            self.count("rngDraws")
+            return fcn(*args, **kwargs)
+
+        return wrapper
+
+    def count(self, counter: str, num: int = 1):
+        setattr(self.total, counter, getattr(self.total, counter) + num)
+        if self.current is not None:
+            setattr(self.current, counter, getattr(self.current, counter) + num)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        outer = self.current
+        entry = self.stages.setdefault(name, StageStats())
+        self.current = entry
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            entry.calls += 1
+            entry.wall += time.perf_counter() - wall
+            entry.cpu += time.process_time() - cpu
+            self.current = outer
+
+    def toJSON(self) -> Dict[str, Any]:
+        return {
+            **self.info,
+            "stages": {name: entry.toJSON() for name, entry in self.stages.items()},
+            "total": self.total.toJSON(),
+        }
+
+    def dumps(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.toJSON(), indent=indent)
+
+
+# The RunStats currently collecting, if any
+active: Optional[RunStats] = None
+
+
+def stage(name: str):
+    """
+    Time a stage of the active RunStats, or do nothing if none is active
+    """
+    if active is None:
+        return nullcontext()
+    return active.stage(name)
@@ -3,18 +3,41 @@
 import sys
 import argparse
 from bccdata import MMChar
+from bn2data import BN2Char
 from textwrap import wrap
 
 
 def main():
     parser = argparse.ArgumentParser(
-        "strconv", description="convert a string to/from mm format for bbc"
+        "strconv", description="convert a string to/from mm format for bbc or bn2"
     )
     parser.add_argument("action", metavar="action", type=str)
     parser.add_argument("text", metavar="text", type=str)
+    parser.add_argument("--bn2", action="store_true", help="Use the BN2 encoding")
+    parser.add_argument(
+        "--file",
+        action="store_true",
+        help="text is a file: to encode, one string per line; to decode, "
+        "the raw bytes of a BN2 string table",
+    )
     args = parser.parse_args()
 
-    if args.action == "encode":
+    if args.file:
+        if not args.bn2:
+            sys.exit("--file is only supported with --bn2")
+        if args.action == "encode":
+            lines = open(args.text, "r").read().splitlines()
+            sys.stdout.buffer.write(BN2Char.encodeAll(lines))
+        else:
+            data = open(args.text, "rb").read()
+            count = len(BN2Char.terminatorRe.findall(data))
+            print("\n".join(BN2Char.decodeAll(data, 0, count)[0]))
+    elif args.bn2:
+        if args.action == "encode":
+            print("".join("%02x " % c for c in BN2Char.encode(args.text)))
+        else:
+            print(BN2Char.decodeAll(bytes.fromhex(args.text) + b"\xe7", 0, 1)[0][0])
+    elif args.action == "encode":
         print("".join("%04x " % MMChar.convTo(c) for c in args.text))
     else:
         print("".join(MMChar.convFrom(int(c, 16)) for c in wrap(args.text, 4)))
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+
+import argparse
+import random
+import struct
+from typing import List
+from megadata import DataType, Game
+from bn2data import (
+    BN2Char,
+    ChipT_BN2,
+    VirusT_BN2,
+    EncounterEntity,
+    EncounterDesc,
+    ShopElem,
+    ChipItem,
+    DropItem,
+    GMD,
+)
+from bccdata import ChipT, EncounterT, StartingChipsT, MMChar
+
+"""
+Generator for synthetic ROMs with the layout of BCC or BN2, for benchmarks
+and tests which can't use the real (copyrighted) ROMs. The result has the
+right header at 0xA0 and plausible contents at every DataType's offset:
+chip/virus/shop/folder/drop tables, terminated BN2 name strings, well formed
+encounter lists, GMD bytes and BCC string pointers; everything else is noise.
+Output is fully determined by seed. scale multiplies the ROM size and the
+variable length content (encounter entity counts, name lengths) to stress
+the parsers; fixed stride tables keep their registered lengths, as all code
+indexes them through the registry
+"""
+
+romSize = 0x800000
+romLoadOffset = 0x08000000
+headers = {Game.BCC: b"BATTLECHIPGPA89E", Game.BN2: b"MEGAMAN_EXE2AE2E"}
+
+# Story chips must exist by name for the shop randomizer, see getStoryChips
+bn2StoryChips = {
+    10: "ZapRing2",
+    20: "BigBomb",
+    30: "Guard",
+    40: "FireSwrd",
+    50: "Catcher",
+}
+
+nameChars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def _randomName(rng: random.Random, maxLen: int) -> str:
+    return "".join(rng.choice(nameChars) for _ in range(rng.randint(3, maxLen)))
+
+
+def _noise(rng: random.Random, size: int) -> bytearray:
+    return bytearray(rng.getrandbits(8 * size).to_bytes(size, "little"))
+
+
+def _tableEnd(type: DataType) -> int:
+    """
+    The offset of the next home array of the same game after that of type,
+    which the contents of type must not run into
+    """
+    start = type.getOffset()
+    offsets = [
+        other.getOffset() for other in DataType if other.getGame() == type.getGame()
+    ]
+    if type.getGame() == Game.BN2:
+        offsets.append(GMD.info[0].offset)
+    return min((offset for offset in offsets if offset > start), default=romSize)
+
+
+def _writeBN2Strings(data: bytearray, type: DataType, names: List[str]):
+    encoded = BN2Char.encodeAll(names)
+    offset = type.getOffset()
+    if offset + len(encoded) > _tableEnd(type):
+        raise ValueError(f"Names of {type} do not fit at this scale")
+    data[offset : offset + len(encoded)] = encoded
+
+
+def _writeEncounterLists(
+    rng: random.Random, data: bytearray, type: DataType, maxEntities: int
+):
+    # Entries are entity lists (Megaman, viruses, terminator) or, less often,
+    # lists of (stage, entities) pointers, which are always followed by an
+    # entity list as in the real data
+    offset = type.getOffset()
+    end = _tableEnd(type)
+    terminator = (0xFF, 0xFF, 0xFF, 0xFF)
+    minEntry = EncounterEntity.myStruct.size * 3
+    count = type.getArrayLength()
+    i = 0
+    afterDescs = False
+    while i < count:
+        # Leave enough room for the smallest possible remaining entries
+        room = end - offset - minEntry * (count - i - 1)
+        if room < minEntry:
+            raise ValueError(f"Encounters of {type} do not fit at this scale")
+        descSize = EncounterDesc.myStruct.size
+        canDesc = not afterDescs and i + 1 < count and room >= descSize + minEntry
+        afterDescs = canDesc and rng.random() < 0.3
+        if afterDescs:
+            for _ in range(rng.randint(1, min(4, (room - minEntry) // descSize))):
+                stage = romLoadOffset + rng.randint(1, 0xFF) * 0x10 + 1
+                entities = romLoadOffset + rng.randint(0, 0xFFFF)
+                EncounterDesc.myStruct.pack_into(data, offset, stage, entities)
+                offset += descSize
+            i += 1
+            continue
+        entitySize = EncounterEntity.myStruct.size
+        numViruses = min(rng.randint(1, maxEntities), room // entitySize - 2)
+        megaman = (0, rng.randint(0, 3), rng.randint(0, 3), 0)
+        EncounterEntity.myStruct.pack_into(data, offset, *megaman)
+        offset += entitySize
+        for _ in range(numViruses):
+            virus = (rng.randint(1, 177), rng.randint(3, 5), rng.randint(0, 2), 1)
+            EncounterEntity.myStruct.pack_into(data, offset, *virus)
+            offset += entitySize
+        EncounterEntity.myStruct.pack_into(data, offset, *terminator)
+        offset += entitySize
+        i += 1
+
+
+def makeBN2(seed: int = 0, scale: int = 1) -> bytearray:
+    rng = random.Random(seed)
+    data = _noise(rng, romSize * scale)
+    data[0xA0:0xB0] = headers[Game.BN2]
+
+    type = DataType.Chip_BN2
+    for i in range(type.getArrayLength()):
+        codes = sorted(rng.sample(range(26), 3)) + [0x1A, 0xFF, 0xFF]
+        ChipT_BN2.myStruct.pack_into(
+            data,
+            type.getOffset() + i * type.getSize(),
+            *codes,
+            rng.randint(0, 500),
+            0,
+            0,
+            rng.randint(1, 9) * 10,
+            0,
+            rng.randint(0, 200),
+            i,
+            0,
+            0,
+            0,
+            0,
+            romLoadOffset,
+            romLoadOffset + 0x100,
+            romLoadOffset + 0x200,
+        )
+
+    names = [
+        bn2StoryChips.get(i) or _randomName(rng, 8 * scale)
+        for i in range(DataType.ChipName_BN2.getArrayLength())
+    ]
+    _writeBN2Strings(data, DataType.ChipName_BN2, names)
+    # Virus and item names are short enough to fit before the next table
+    for type in (DataType.VirusName_BN2, DataType.ItemName_BN2):
+        names = [_randomName(rng, 8) for _ in range(type.getArrayLength())]
+        _writeBN2Strings(data, type, names)
+
+    type = DataType.Virus_BN2
+    for i in range(type.getArrayLength()):
+        VirusT_BN2.myStruct.pack_into(
+            data, type.getOffset() + i * type.getSize(), rng.randint(10, 900), 0, 0, 1
+        )
+
+    _writeEncounterLists(rng, data, DataType.EncounterEVT_BN2, 3)
+    _writeEncounterLists(rng, data, DataType.EncounterRegion_BN2, 3 * scale)
+
+    type = DataType.ShopInventory_BN2
+    elemSize = ShopElem.myStruct.size
+    for i in range(type.getArrayLength()):
+        subChipShop = rng.random() < 0.1
+        for j in range(type.getSize() // elemSize):
+            offset = type.getOffset() + i * type.getSize() + j * elemSize
+            if j >= 6 and i > 1:
+                # Unused slots
+                ShopElem.myStruct.pack_into(data, offset, 0, 0, 0xFF, 0xFF, 0, 0, 0, 0)
+                continue
+            kind = 0 if subChipShop else (1 if j == 0 else 2)
+            ShopElem.myStruct.pack_into(
+                data,
+                offset,
+                kind,
+                rng.choice((1, 3, 0xFF)),
+                0xFF,
+                0xFF,
+                0x60 if kind == 1 else rng.randint(1, 250),
+                0x1A,
+                rng.randint(1, 50) * 100,
+                0,
+            )
+
+    type = DataType.ChipFolder_BN2
+    for i in range(type.getArrayLength() * type.getSize() // ChipItem.getSize()):
+        ChipItem.myStruct.pack_into(
+            data, type.getOffset() + i * ChipItem.getSize(), rng.randint(1, 190), 0x1A
+        )
+
+    type = DataType.DropTable_BN2
+    for i in range(type.getArrayLength() * type.getSize() // DropItem.getSize()):
+        # Chips (index and code), HP or zenny drops
+        kind = rng.randint(0, 2)
+        if kind == 0:
+            chip = rng.randint(1, 250)
+            b1, b2 = chip & 0xFF, (0x1A << 1) | (chip >> 8)
+        elif kind == 1:
+            b1, b2 = rng.randint(0, 255), 0x40
+        else:
+            b1, b2 = rng.randint(0, 50), 0x80
+        DropItem.myStruct.pack_into(
+            data, type.getOffset() + i * DropItem.getSize(), b1, b2
+        )
+
+    for info in GMD.info:
+        offset = info.offset
+        for chip in info.chips:
+            chip.serializeChip(data, offset, rng.randint(1, 250), rng.randint(0, 0x19))
+            offset += chip.getSize()
+        for zenny in info.zennies:
+            zenny.serializeZenny(data, offset, rng.randint(1, 100) * 100)
+            offset += zenny.getSize()
+    return data
+
+
+def makeBCC(seed: int = 0, scale: int = 1) -> bytearray:
+    rng = random.Random(seed)
+    data = _noise(rng, romSize * scale)
+    data[0xA0:0xB0] = headers[Game.BCC]
+
+    type = DataType.Chip
+    for i in range(type.getArrayLength()):
+        ChipT.myStruct.pack_into(
+            data,
+            type.getOffset() + i * type.getSize(),
+            rng.randint(10, 300),
+            0,
+            rng.randint(0, 30) * 10,
+            rng.randint(1, 8) * 10,
+            rng.choice((0, 0x1000, 0xD1, 0xD2, 0x2010)),
+            0,
+            0,
+            0,
+            0,
+            0,
+            0,
+        )
+
+    type = DataType.Encounter
+    for i in range(type.getArrayLength()):
+        chips = [rng.randint(1, 190) for _ in range(11)]
+        EncounterT.myStruct.pack_into(
+            data,
+            type.getOffset() + i * type.getSize(),
+            i & 0xFF,
+            0,
+            0,
+            0,
+            1,
+            rng.randint(200, 247),
+            0,
+            *chips,
+            1,
+            2,
+        )
+
+    StartingChipsT.myStruct.pack_into(
+        data,
+        DataType.StartingChips.getOffset(),
+        *[rng.randint(1, 190) for _ in range(7)],
+    )
+
+    # The strings themselves go after the last table, each pointed to from
+    # the pointer arrays
+    stringOffset = max(
+        type.getOffset() + type.getSize() * type.getArrayLength()
+        for type in DataType
+        if type.getGame() == Game.BCC
+    )
+
+    def writeStrings(strings: List[str], format: int = 0) -> int:
+        nonlocal stringOffset
+        start = stringOffset
+        for string in strings:
+            for char in string:
+                struct.pack_into("<H", data, stringOffset, MMChar.convTo(char) | format)
+                stringOffset += 2
+            struct.pack_into("<H", data, stringOffset, 0x8000 | len(string))
+            stringOffset += 2
+        return romLoadOffset + start
+
+    def writePointer(type: DataType, i: int, pointer: int):
+        struct.pack_into("<I", data, type.getOffset() + i * type.getSize(), pointer)
+
+    for i in range(DataType.Chip.getArrayLength()):
+        writePointer(DataType.ChipName, i, writeStrings([_randomName(rng, 8 * scale)]))
+        effect = [f"Atk {rng.randint(1, 200)}"]
+        writePointer(DataType.EffectDesc, i, writeStrings(effect, 0x600))
+        # Descriptions are pointers to pointers to 3 strings
+        desc = ["Line one", f"Dmg {rng.randint(10, 300)}", "end"]
+        inner = writeStrings(desc)
+        struct.pack_into("<I", data, stringOffset, inner)
+        writePointer(DataType.ChipDesc, i, romLoadOffset + stringOffset)
+        stringOffset += 4
+    for i in range(DataType.OpName.getArrayLength()):
+        writePointer(DataType.OpName, i, writeStrings([_randomName(rng, 6)]))
+    if stringOffset > len(data):
+        raise ValueError("Strings do not fit in the ROM")
+    return data
+
+
+def makeRom(game: Game, seed: int = 0, scale: int = 1) -> bytearray:
+    if game == Game.BCC:
+        return makeBCC(seed, scale)
+    return makeBN2(seed, scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "synthrom", description="Generate a synthetic ROM with the layout of a game"
+    )
+    parser.add_argument("game", choices=[game.name for game in Game])
+    parser.add_argument("outfile", metavar="outfile", type=str)
+    parser.add_argument("--seed", "-s", type=int, default=0)
+    parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.outfile, "wb+") as outFile:
+        outFile.write(makeRom(Game[args.game], args.seed, args.scale))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+import cache
+
+
+def test_disk_lru(tmp_path):
+    lru = cache.DiskLRU(str(tmp_path / "results"), 250, ".bin")
+    assert lru.get("a") is None
+    for i, key in enumerate("abc"):
+        lru.put(key, bytes([i]) * 100)
+        os.utime(lru._path(key), (i, i))
+    # Over the cap, so the least recently used file was evicted
+    assert lru.get("a") is None
+    assert lru.get("b") == b"\x01" * 100
+    lru.put("d", b"\x03" * 100)
+    assert lru.get("c") is None
+    assert lru.get("b") is not None and lru.get("d") is not None
+    stats = lru.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 3, 2)
+    assert stats["bytes"] == 200
+    # A new instance picks up what is already on disk
+    assert cache.DiskLRU(str(tmp_path / "results"), 250, ".bin").size == 200
+
+
+def test_disk_lru_concurrent_put(tmp_path, monkeypatch):
+    write = cache.writeCacheFile
+
+    def slowWrite(path: str, contents: bytes):
+        # Long enough for every thread to get to the same key
+        time.sleep(0.05)
+        write(path, contents)
+
+    monkeypatch.setattr(cache, "writeCacheFile", slowWrite)
+    lru = cache.DiskLRU(str(tmp_path / "results"), 1000, ".bin")
+    threads = [
+        threading.Thread(target=lru.put, args=("a", b"\x01" * 100)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The key is only counted once, however many threads stored it
+    assert lru.size == 100
+    assert os.listdir(tmp_path / "results") == ["a.bin"]
+
+
+def test_rom_hash():
+    data = bytes(range(256)) * 4
+    assert cache.romHash(data) == cache.romHash(bytes(data))
+    assert cache._lastHashed[0] is not None
+    # Writable buffers may change, so their digest isn't kept
+    buf = bytearray(data)
+    first = cache.romHash(buf)
+    buf[0] ^= 1
+    assert cache.romHash(buf) != first
@@ -1,4 +1,5 @@
 from bccdata import MMChar
+from bn2data import BN2Char
 
 
 def test_char():
@@ -7,3 +8,25 @@ def test_char():
         for offs in range(26):
             value = MMChar.convTo(chr(ord(a) + offs))
             assert value - MMChar.convTo(a) == offs
+
+
+def test_bn2_bulk():
+    names = ["Cannon", "HiCannon", "V2 Guard-", "", "Mr. Prog?", "Zeta#"]
+    data = b"\xff" + BN2Char.encodeAll(names) + b"\xe9"
+    decoded, end = BN2Char.decodeAll(data, 1, len(names))
+    assert end == len(data) - 1
+
+    # Bulk conversion matches the per character conversion
+    offset = 1
+    for name, out in zip(names, decoded):
+        assert BN2Char.encode(name) == bytes(BN2Char.convTo(c) for c in name)
+        single, offset = BN2Char.toString(data, offset)
+        assert single == out
+        assert out == "".join(BN2Char.convFrom(BN2Char.convTo(c)) for c in name)
+    assert decoded[0] == "Cannon"
+
+    # Every non-terminator byte decodes the same way
+    allBytes = bytes(range(0xE7))
+    assert BN2Char.decodeAll(allBytes + b"\xe7", 0, 1)[0] == [
+        "".join(BN2Char.convFrom(c) for c in allBytes)
+    ]
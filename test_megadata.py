@@ -0,0 +1,102 @@
+import random
+import struct
+from megadata import DataType, EncounterIndex
+from rombuffer import RomBuffer
+
+
+def test_tableFlushesOnlyChanges():
+    rng = random.Random(0)
+    data = RomBuffer(rng.getrandbits(8) for _ in range(0x20000))
+    with DataType.Chip_BN2.table(data) as chips:
+        assert len(chips) == 265
+        chips[3].mb = (chips[3].mb + 10) % 256
+        chips[-1].ap = chips[-1].ap
+        assert len(chips.items) == 2
+    assert chips.flush() == []
+    offset = DataType.Chip_BN2.getOffset() + 3 * 32
+    assert data.dirtyRanges() == [(offset, offset + 32)]
+    assert DataType.Chip_BN2.parse(data, 3).mb == chips[3].mb
+
+
+def test_tableWritesNestedChanges():
+    rng = random.Random(1)
+    data = bytearray(rng.getrandbits(8) for _ in range(0x31000))
+    shops = DataType.ShopInventory_BN2.table(data)
+    shops[0].elems[2].cost ^= 1
+    shops[1].elems[0].cost = shops[1].elems[0].cost
+    assert shops.flush() == [0]
+    assert shops.flush() == []
+    # Changes after a flush are still noticed
+    shops[0].elems[2].cost ^= 1
+    shops[2].elems = shops[2].elems[::-1]
+    assert shops.flush() == [0, 2]
+    # As are changes made in place
+    shops[3].elems.reverse()
+    chips = DataType.Chip_BN2.table(data)
+    chips[1].codes[0] ^= 1
+    assert shops.flush() == [3]
+    assert chips.flush() == [1]
+    assert (
+        DataType.ShopInventory_BN2.parse(data, 0).elems[2].cost
+        == shops[0].elems[2].cost
+    )
+
+
+def test_recordsAreSlotted():
+    # Guards against record classes regaining a per-instance __dict__
+    rng = random.Random(0)
+    data = bytearray(rng.getrandbits(8) for _ in range(0x240000))
+    # Point the first chip name at an empty string
+    struct.pack_into("<I", data, DataType.ChipName.getOffset(), 0x08000100)
+    data[0x100:0x102] = b"\x00\x80"
+    for type in (
+        DataType.Chip_BN2,
+        DataType.Virus_BN2,
+        DataType.ShopInventory_BN2,
+        DataType.ChipFolder_BN2,
+        DataType.DropTable_BN2,
+        DataType.Encounter,
+        DataType.Chip,
+        DataType.StartingChips,
+        DataType.ChipName,
+    ):
+        obj = type.parse(data, 0)
+        for elem in [obj] + list(getattr(obj, "elems", [])):
+            assert not hasattr(elem, "__dict__"), type
+
+
+def _encounterRom() -> bytearray:
+    # Alternating desc lists and entity lists of varying lengths
+    data = bytearray(0x30000)
+    for type in EncounterIndex.types:
+        offset = type.getOffset()
+        for i in range(type.getArrayLength()):
+            if i % 3 == 0:
+                for _ in range(1 + i % 2):
+                    struct.pack_into("<2I", data, offset, 0x08000011, 0x08001234)
+                    offset += 8
+            else:
+                struct.pack_into("<4B", data, offset, 0, 1, 1, 0)
+                offset += 4
+                for j in range(1 + i % 4):
+                    struct.pack_into("<4B", data, offset, 1 + j, 4, 1, 1)
+                    offset += 4
+                struct.pack_into("<4B", data, offset, 0xFF, 0xFF, 0xFF, 0xFF)
+                offset += 4
+    return data
+
+
+def test_encounterIndex(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", str(tmp_path))
+    data = _encounterRom()
+    index = EncounterIndex.forRom(data)
+    assert len(list(tmp_path.glob("encounters/*.json"))) == 1
+    assert EncounterIndex.fromJSON(index.toJSON()).entries == index.entries
+    for type in EncounterIndex.types:
+        offset = type.getOffset()
+        for i in range(type.getArrayLength()):
+            enc = type.parseAtOffset(data, offset)
+            assert index.getOffset(type, i) == offset
+            assert index.isEntities(type, i) == enc.isEntities()
+            assert index.getSize(type, i) == enc.getSize()
+            offset += enc.getSize()
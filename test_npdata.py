@@ -0,0 +1,39 @@
+import random
+import pytest
+from megadata import DataType
+from rombuffer import RomBuffer
+
+np = pytest.importorskip("numpy")
+from npdata import tableView, supportedTypes, markWritten
+
+
+def _randomRom() -> RomBuffer:
+    rng = random.Random(0)
+    return RomBuffer(rng.getrandbits(8) for _ in range(0x240000))
+
+
+def test_viewsMatchRecords():
+    data = _randomRom()
+    for type in supportedTypes():
+        view = tableView(type, data)
+        assert len(view) == type.getArrayLength()
+        for i in (0, type.getArrayLength() - 1):
+            obj = type.parse(data, i)
+            for field in view.dtype.names:
+                if field == "elems":
+                    elems = view[i]["elems"]
+                    for objElem, viewElem in zip(obj.elems, elems):
+                        for name in elems.dtype.names:
+                            assert getattr(objElem, name) == viewElem[name]
+                else:
+                    assert np.all(getattr(obj, field) == view[i][field])
+
+
+def test_viewWrites():
+    data = _randomRom()
+    view = tableView(DataType.Chip_BN2, data)
+    view["ap"][view["ap"] > 100] = 100
+    markWritten(DataType.Chip_BN2, data, np.nonzero(view["ap"] == 100)[0])
+    for i in range(DataType.Chip_BN2.getArrayLength()):
+        assert DataType.Chip_BN2.parse(data, i).ap <= 100
+    assert len(data.dirtyRanges()) > 0
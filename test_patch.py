@@ -0,0 +1,28 @@
+from patch import IPS, BPS, diffRanges, makePatch, applyPatch
+
+
+def _modifiedCopy(base: bytes) -> bytearray:
+    data = bytearray(base)
+    for offset in (0, 17, 18, 19, 500, IPS.eofOffset, IPS.eofOffset + 2):
+        data[offset] ^= 0xFF
+    return data
+
+
+def test_diffRanges():
+    base = bytes(10000)
+    data = bytearray(base)
+    data[5:8] = b"abc"
+    data[9000] = 1
+    assert diffRanges(base, data) == [(5, 8), (9000, 9001)]
+    assert diffRanges(base, data + b"xy") == [(5, 8), (9000, 9001), (10000, 10002)]
+
+
+def test_roundtrip():
+    base = bytes(range(256)) * 0x4600
+    data = _modifiedCopy(base)
+    for format in ("ips", "bps"):
+        patch = makePatch(format, base, data)
+        assert len(patch) < 100
+        assert applyPatch(base, patch) == data
+    assert IPS.apply(base, IPS.create(base, data[:-5])) == data[:-5]
+    assert BPS.apply(base, BPS.create(base, data + b"tail")) == data + b"tail"
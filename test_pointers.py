@@ -0,0 +1,49 @@
+import random
+import struct
+import pytest
+import pointers
+import synthrom
+from bccdata import parsePtr
+from megadata import DataType
+from pointers import PointerIndex
+
+
+def test_scan():
+    rng = random.Random(0)
+    data = bytearray(rng.choice((0, 1, 8, 9, 0x10)) for _ in range(3000))
+    struct.pack_into("<I", data, 101, 0x08000040)
+    index = PointerIndex(PointerIndex.build(data))
+    assert 101 in index.referrersOf(0x40)
+    assert index.referrersOf(0x08000040) == index.referrersOf(0x40)
+    expected = sorted(
+        (val - 0x08000000, offset)
+        for offset in range(len(data) - 3)
+        for (val,) in [struct.unpack_from("<I", data, offset)]
+        if 0x08000000 <= val < 0x0A000000
+    )
+    assert index.pointersInto(0, 1 << 32) == expected
+    assert pointers.PointerIndex.scan(data) == (
+        [target for target, _ in expected],
+        [offset for _, offset in expected],
+    )
+
+
+def test_rom_pointers(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", str(tmp_path))
+    data = bytes(synthrom.makeBCC())
+    index = PointerIndex.forRom(data)
+    assert len(list(tmp_path.glob("pointers/*.idx"))) == 1
+    type = DataType.ChipName
+    for i in (0, 17):
+        offset = type.getOffset() + i * type.getSize()
+        assert offset in index.referrersOf(parsePtr(data, offset))
+    PointerIndex._memo.clear()
+    assert PointerIndex.forRom(data).referrersOf(0x100) == index.referrersOf(0x100)
+
+
+@pytest.mark.skipif(not pointers.HAVE_NUMPY, reason="numpy is not installed")
+def test_numpy_build(monkeypatch):
+    data = bytes(synthrom.makeBCC())[:0x40000]
+    built = PointerIndex.build(data)
+    monkeypatch.setattr(pointers, "HAVE_NUMPY", False)
+    assert PointerIndex.build(data) == built
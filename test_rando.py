@@ -0,0 +1,52 @@
+import configparser
+import json
+import os
+import subprocess
+import sys
+import pytest
+import rando
+import synthrom
+from rombuffer import RomBuffer
+
+
+def test_batch_seeds(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", "")
+    rom = bytes(synthrom.makeBCC(seed=3))
+    config = configparser.ConfigParser()
+    config.read("rando_bcc.conf")
+    res = rando.randomizeBatch(rom, config, [5, 6, 5], str(tmp_path), jobs=1)
+    assert [seed for seed, _ in res] == [5, 6]
+    assert sorted(os.listdir(tmp_path)) == ["5.gba", "6.gba"]
+    with pytest.raises(ValueError):
+        rando.randomizeBatch(rom, config, [0], str(tmp_path), jobs=1)
+
+
+def test_randomize_request(monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", "")
+    rom = bytes(synthrom.makeBCC(seed=3))
+    config = configparser.ConfigParser()
+    config.read("rando_bcc.conf")
+    data = RomBuffer(rom, skipUnchanged=True)
+    rando.randomize(data, config, 7)
+    seed, output, statsJSON = rando.randomizeRequest(
+        rom, rando.configToString(config), 7, "", collectStats=True
+    )
+    assert seed == "7"
+    assert output == data
+    assert statsJSON is not None and '"game": "BCC"' in statsJSON
+
+
+def test_stats_stdout(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", "")
+    romPath = tmp_path / "rom.gba"
+    romPath.write_bytes(synthrom.makeBCC(seed=3))
+    out = subprocess.run(
+        [sys.executable, "rando.py", "--stats", "-s", "7", str(romPath)]
+        + [str(tmp_path / "out.gba")],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    # Only the stats are written to stdout
+    assert json.loads(out.stdout)["seed"] == 7
+    assert "Randomizing" in out.stderr
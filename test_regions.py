@@ -0,0 +1,33 @@
+from bn2data import GMD
+from megadata import DataType, EncounterIndex, Game
+from regions import RegionMap
+import synthrom
+
+
+def test_overlapping_regions():
+    regions = RegionMap([(10, 20, "a"), (15, 30, "b"), (40, 41, "c"), (5, 5, "d")])
+    assert regions.labelsAt(9) == ()
+    assert regions.labelsAt(10) == ("a",)
+    assert regions.labelsAt(17) == ("a", "b")
+    assert regions.labelsAt(20) == ("b",)
+    assert regions.label(29) == "b"
+    assert not regions.isMapped(30)
+    assert regions.isMapped(40) and not regions.isMapped(41)
+    assert not regions.isMapped(5)
+
+
+def test_bn2_regions(monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", "")
+    data = synthrom.makeBN2()
+    regions = RegionMap.build(data, Game.BN2)
+    chip = DataType.Chip_BN2
+    assert regions.labelsAt(chip.getOffset() + chip.getSize() + 3) == ("Chip_BN2[1]",)
+    assert regions.label(GMD.info[0].offset) == "GMD_BN2[0]"
+    assert regions.label(DataType.ChipName_BN2.getOffset()) == "ChipName_BN2[0]"
+    # Encounter lists are mapped with their real, variable sizes
+    encounters = DataType.EncounterRegion_BN2
+    index = EncounterIndex.build(data)
+    for i in (0, encounters.getArrayLength() - 1):
+        end = index.getOffset(encounters, i) + index.getSize(encounters, i)
+        assert regions.label(end - 1) == f"EncounterRegion_BN2[{i}]"
+        assert regions.label(end) != f"EncounterRegion_BN2[{i}]"
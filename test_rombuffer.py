@@ -0,0 +1,28 @@
+import struct
+from rombuffer import RomBuffer, packInto
+from patch import makePatch, applyPatch
+
+
+def test_dirtyRanges():
+    data = RomBuffer(bytes(100))
+    data[10] = 1
+    data[20:24] = b"abcd"
+    packInto(struct.Struct("<H"), data, 11, 0)
+    data[30:32] = b"\0\0"
+    assert data.dirtyRanges() == [(10, 13), (20, 24), (30, 32)]
+    data[13:20] = bytes(7)
+    assert data.dirtyRanges() == [(10, 24), (30, 32)]
+    assert data.isDirty(23) and not data.isDirty(24)
+    data.clearDirty()
+    assert data.dirtyRanges() == []
+
+
+def test_skipUnchanged():
+    base = bytes(range(100))
+    data = RomBuffer(base, skipUnchanged=True)
+    data[5] = 5
+    packInto(struct.Struct("<4B"), data, 40, 40, 41, 0, 43)
+    data[60:64] = b"\x3c\x00\x00\x3f"
+    assert data.dirtyRanges() == [(42, 43), (61, 63)]
+    patch = makePatch("ips", base, data, data.dirtyRanges())
+    assert applyPatch(base, patch) == data
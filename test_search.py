@@ -0,0 +1,143 @@
+import random
+from argparse import Namespace
+import pytest
+import fastsearch
+import search
+from ngramindex import NgramIndex
+from rombuffer import mapRom
+
+
+def makeArgs(**kwargs) -> Namespace:
+    args = Namespace(
+        stride=1,
+        delta=False,
+        rooted=False,
+        middleStart=False,
+        variable=False,
+        dataSize=1,
+    )
+    for key, val in kwargs.items():
+        setattr(args, key, val)
+    return args
+
+
+def makeData(seed: int, size: int = 4000) -> bytes:
+    # A small alphabet so that partial matches are common
+    rng = random.Random(seed)
+    return bytes(rng.choice((0, 1, 2, 3, 255)) for _ in range(size))
+
+
+def checkSame(pattern, data, **kwargs):
+    args = makeArgs(**kwargs)
+    engine = fastsearch.engineFor(args)
+    if engine is None:
+        pytest.skip("No engine for these options")
+    assert engine(pattern, data, args) == search.searchReference(pattern, data, args)
+
+
+@pytest.mark.parametrize("stride", [1, 2, 3, 7])
+@pytest.mark.parametrize("dataSize", [1, 2, 4])
+def test_plain(stride, dataSize):
+    for seed in range(5):
+        data = makeData(seed)
+        rng = random.Random(seed)
+        for patLen in (1, 2, 3, 5):
+            pattern = [rng.choice((0, 1, 2, 255)) for _ in range(patLen)]
+            checkSame(pattern, data, stride=stride, dataSize=dataSize)
+    checkSame([256], makeData(0), stride=stride, dataSize=dataSize)
+
+
+@pytest.mark.parametrize("stride", [1, 2, 5])
+@pytest.mark.parametrize("dataSize", [1, 2])
+@pytest.mark.parametrize("rooted", [False, True])
+@pytest.mark.parametrize("middleStart", [False, True])
+def test_delta(stride, dataSize, rooted, middleStart):
+    for seed in range(4):
+        data = makeData(seed, 2000)
+        rng = random.Random(seed)
+        for patLen in (1, 2, 4):
+            pattern = [rng.choice((-1, 0, 1, 2, 300, 400)) for _ in range(patLen)]
+            checkSame(
+                pattern,
+                data,
+                delta=True,
+                stride=stride,
+                dataSize=dataSize,
+                rooted=rooted,
+                middleStart=middleStart,
+            )
+
+
+@pytest.mark.parametrize("stride", [1, 2, 3])
+@pytest.mark.parametrize("dataSize", [1, 2])
+def test_variable(stride, dataSize):
+    patterns = [[1], [1, 1], [1, 2, 1, 3], [1, 0, 1], [0, 0, 2], [3, 1, 3, 0, 1]]
+    for seed in range(4):
+        data = makeData(seed, 2000)
+        for pattern in patterns:
+            checkSame(pattern, data, variable=True, stride=stride, dataSize=dataSize)
+
+
+def test_stride_sweep():
+    data = makeData(1)
+    args = makeArgs(variable=True)
+    strides = range(1, 9)
+    expected = {
+        stride: search.searchReference(
+            [1, 2, 1], data, makeArgs(variable=True, stride=stride)
+        )
+        for stride in strides
+    }
+    assert search.searchStrides([1, 2, 1], data, args, strides, jobs=1) == expected
+    assert search.searchStrides([1, 2, 1], data, args, strides, jobs=3) == expected
+
+
+@pytest.mark.parametrize("dataSize", [1, 2, 4])
+def test_ngram_index(dataSize, tmp_path, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", str(tmp_path))
+    data = makeData(0)
+    assert NgramIndex.forRom(data) is None
+    NgramIndex.buildForRom(data)
+    index = NgramIndex.forRom(data)
+    assert index is not None
+    # Every pair of the small alphabet is common, so searches scan the data
+    # unless the index is made to look selective
+    assert not index.isSelective(b"\x00\x01")
+    for scanRatio in (NgramIndex.scanRatio, 1):
+        monkeypatch.setattr(NgramIndex, "scanRatio", scanRatio)
+        rng = random.Random(dataSize)
+        for patLen in (1, 2, 3, 5):
+            pattern = [rng.choice((0, 1, 2, 255)) for _ in range(patLen)]
+            args = makeArgs(dataSize=dataSize)
+            assert search.search(pattern, data, args) == search.searchReference(
+                pattern, data, args
+            )
+    needle = data[100:104]
+    assert 100 in index.find(needle, data)
+    assert index.find(needle, data) == [
+        i for i in range(len(data)) if data.startswith(needle, i)
+    ]
+    # Needles too short to have a pair are found by a scan
+    assert not index.isSelective(b"\x02")
+    assert index.find(b"\x02", data) == [i for i, byte in enumerate(data) if byte == 2]
+
+
+@pytest.mark.parametrize("stride", [1, 3])
+def test_chunked(stride, tmp_path, monkeypatch):
+    # Chunks much smaller than the data, so that matches span chunk boundaries
+    monkeypatch.setattr(fastsearch, "chunkSize", 64)
+    data = makeData(2, 1000)
+    path = tmp_path / "rom.bin"
+    path.write_bytes(data)
+    mapped = mapRom(str(path))
+    for kwargs in (
+        {},
+        {"dataSize": 2},
+        {"delta": True},
+        {"variable": True},
+    ):
+        args = makeArgs(stride=stride, **kwargs)
+        pattern = [1, 2, 1] if kwargs.get("variable") else [0, 1, 0]
+        expected = search.searchReference(pattern, data, args)
+        for buf in (mapped, memoryview(data)):
+            assert search.search(pattern, buf, args) == expected
@@ -0,0 +1,324 @@
+import configparser
+import http.client
+import http.server
+import json
+import os
+import socket
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+import pytest
+import cache
+import rando
+import synthrom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "web"))
+import server  # noqa: E402
+
+rom = bytes(synthrom.makeBCC(seed=3))
+config = configparser.ConfigParser()
+config.read("rando_bcc.conf")
+confBytes = rando.configToString(config).encode("utf-8")
+
+
+def expected(seed: str, patchFormat: str = "") -> bytes:
+    conf = confBytes.decode("utf-8")
+    return rando.randomizeRequest(rom, conf, int(seed), patchFormat)[1]
+
+
+def request(
+    port: int,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    headers: Optional[Dict[str, str]] = None,
+) -> Tuple[int, Dict[str, str], bytes]:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def randomize(port: int, seed: str, path: str = "/", withRom: bool = True, **headers):
+    body = confBytes + rom if withRom else confBytes
+    headers = {"ConfLength": str(len(confBytes)), "Seed": seed, **headers}
+    return request(port, "POST", path, body, headers)
+
+
+@pytest.fixture
+def cacheDir(tmp_path, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def pool(cacheDir):
+    pool = ProcessPoolExecutor(max_workers=2, initializer=rando.warmWorker)
+    yield pool
+    pool.shutdown(cancel_futures=True)
+
+
+@pytest.fixture
+def serve():
+    """
+    Start a server on an ephemeral port with its own Handler class, whose
+    attributes are given; returns the port
+    """
+    servers = []
+
+    def serve(**attrs) -> int:
+        attrs.setdefault("roms", server.RomStore())
+        handler = type("Handler", (server.Handler,), attrs)
+        httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return httpd.server_address[1]
+
+    yield serve
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def gate(cacheDir, monkeypatch):
+    """
+    A pool of one worker thread, whose randomizations wait for the returned
+    event to be set
+    """
+    gate = threading.Event()
+    randomizeRequest = rando.randomizeRequest
+
+    def gated(*args):
+        gate.wait(30)
+        return randomizeRequest(*args)
+
+    monkeypatch.setattr(rando, "randomizeRequest", gated)
+    pool = ThreadPoolExecutor(max_workers=1)
+    yield pool, gate
+    gate.set()
+    pool.shutdown()
+
+
+def test_job_queue(gate, serve):
+    pool, release = gate
+    port = serve(jobs=server.JobQueue(pool, 1, 2, 0, retention=600))
+    code, headers, body = randomize(port, "7", "/jobs")
+    assert code == 202
+    first = json.loads(body)
+    assert headers["Location"] == f"/jobs/{first['id']}"
+    assert first["state"] == "running"
+    # With the only worker busy, the next job waits for it
+    code, _, body = randomize(port, "8", "/jobs")
+    assert code == 202
+    second = json.loads(body)
+    assert second["state"] == "queued"
+    # Refused requests are answered without reading the body, so the ROM is
+    # left out of them
+    code, headers, _ = randomize(port, "9", "/jobs", withRom=False)
+    assert code == 429 and headers["Retry-After"]
+    code, _, body = request(port, "GET", f"/jobs/{second['id']}/result")
+    assert code == 202 and json.loads(body)["state"] == "queued"
+    code, _, body = request(port, "DELETE", f"/jobs/{second['id']}")
+    assert code == 200 and json.loads(body)["state"] == "cancelled"
+    code, _, _ = request(port, "GET", f"/jobs/{second['id']}/result")
+    assert code == 410
+    # The cancelled job's slot is free at once
+    code, _, body = randomize(port, "9", "/jobs")
+    assert code == 202
+    third = json.loads(body)
+    release.set()
+    # The worker shares this process's random state, so outputs are only
+    # checked once it is done
+    results = [
+        (seed, request(port, "GET", f"/jobs/{job['id']}/result?wait=30"))
+        for job, seed in ((first, "7"), (third, "9"))
+    ]
+    for seed, (code, headers, body) in results:
+        assert code == 200 and headers["Seed"] == seed and body == expected(seed)
+    # Outputs are dropped once fetched
+    code, _, _ = request(port, "GET", f"/jobs/{first['id']}/result")
+    assert code == 410
+    code, _, _ = request(port, "GET", "/jobs/0123")
+    assert code == 404
+
+
+def test_job_timeout(gate, serve):
+    pool, release = gate
+    port = serve(jobs=server.JobQueue(pool, 1, 2, 0.2, retention=600))
+    code, _, body = randomize(port, "7", "/jobs")
+    assert code == 202
+    key = json.loads(body)["id"]
+    code, _, body = request(port, "GET", f"/jobs/{key}/result?wait=30")
+    assert code == 504 and b"Timed out" in body
+    release.set()
+
+
+def test_job_retention(gate):
+    pool, _ = gate
+    jobs = server.JobQueue(pool, 1, 1, 0, retention=600, maxRetained=250)
+    done = []
+    for _ in range(3):
+        job = server.Job()
+        jobs.add(job)
+        job.finish("done", seed="7", output=bytes(100))
+        done.append(job)
+    # Over the limit, so the oldest output is forgotten
+    jobs.add(server.Job())
+    assert [jobs.get(job.id) for job in done] == [None, done[1], done[2]]
+    jobs.retention = 0
+    jobs.add(server.Job())
+    assert [jobs.get(job.id) for job in done] == [None, None, None]
+
+
+def test_bad_requests(gate, serve):
+    pool, _ = gate
+    jobs = server.JobQueue(pool, 1, 4, 0, retention=600)
+    port = serve(jobs=jobs)
+    # An unsupported patch format is refused up front, rather than failing
+    # in the worker
+    code, _, body = randomize(port, "7", withRom=False, Patch="zip")
+    assert code == 400 and b"zip" in body
+    code, _, _ = randomize(port, "7", withRom=False, ConfLength="x")
+    assert code == 400
+    code, _, body = randomize(port, "seven", withRom=False)
+    assert code == 400 and b"Seed" in body
+    code, _, _ = request(port, "POST", "/", confBytes)
+    assert code == 400
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.putrequest("POST", "/")
+    conn.putheader("ConfLength", "0")
+    conn.endheaders()
+    assert conn.getresponse().status == 400
+    conn.close()
+    # None of them kept a slot
+    for _ in range(jobs.depth):
+        assert jobs.slots.acquire(timeout=5)
+
+
+def test_concurrent_requests(pool, serve):
+    port = serve(jobs=server.JobQueue(pool, 2, 4, 0, retention=600))
+    seeds = ["7", "8", "9", "10"]
+    responses: Dict[str, Tuple[int, Dict[str, str], bytes]] = {}
+
+    def run(seed: str):
+        responses[seed] = randomize(port, seed)
+
+    threads = [threading.Thread(target=run, args=(seed,)) for seed in seeds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each worker process has its own random state, so concurrent requests
+    # give the same outputs as requests made one at a time
+    for seed in seeds:
+        code, headers, body = responses[seed]
+        assert code == 200
+        assert headers["Seed"] == seed
+        assert body == expected(seed)
+    # Synchronous jobs can't be looked up, so they aren't kept
+    code, _, body = request(port, "GET", "/stats")
+    assert code == 200 and json.loads(body)["jobs"]["jobs"] == {}
+
+
+def test_rom_store(pool, serve, cacheDir):
+    port = serve(jobs=server.JobQueue(pool, 2, 4, 0, retention=600))
+    romHash = cache.romHash(rom)
+    # A ROM the server hasn't seen must be sent with the request
+    code, _, _ = randomize(port, "7", withRom=False, RomHash=romHash)
+    assert code == 428
+    code, _, _ = randomize(port, "7", RomHash="0" * 40)
+    assert code == 400
+    code, _, body = randomize(port, "7", RomHash=romHash)
+    assert code == 200 and body == expected("7")
+    code, _, body = randomize(port, "8", withRom=False, RomHash=romHash.upper())
+    assert code == 200 and body == expected("8")
+    # Other servers find the ROM in the cache directory
+    store = server.RomStore()
+    assert store.get(romHash) == rom
+    assert store.get("not a hash") is None
+    assert store.get("0" * 40) is None
+    with pytest.raises(ValueError):
+        store.add(rom[:0x1000])
+
+
+def test_result_cache(pool, serve, tmp_path):
+    # Room for one output
+    results = cache.DiskLRU(str(tmp_path / "results"), len(rom) * 3 // 2, ".bin")
+    port = serve(
+        jobs=server.JobQueue(pool, 2, 4, 0, retention=600),
+        results=results,
+        version="test",
+    )
+    code, headers, body = randomize(port, "7")
+    assert code == 200 and headers["X-Cache"] == "MISS"
+    code, headers, cached = randomize(port, "7")
+    assert code == 200 and headers["X-Cache"] == "HIT" and cached == body
+    # Outputs with stats are never cached, and patches are cached apart
+    code, headers, _ = randomize(port, "7", Stats="1")
+    assert code == 200 and headers["X-Cache"] == "MISS" and "Stats" in headers
+    code, headers, patch = randomize(port, "7", Patch="ips")
+    assert code == 200 and headers["X-Cache"] == "MISS"
+    assert patch == expected("7", "ips")
+    assert randomize(port, "7", Patch="ips")[1]["X-Cache"] == "HIT"
+    # The next output evicts the least recently used one
+    assert randomize(port, "8")[1]["X-Cache"] == "MISS"
+    assert randomize(port, "7")[1]["X-Cache"] == "MISS"
+    # Which in turn evicted the patch and the output of 8
+    stats = results.stats()
+    assert (stats["hits"], stats["evictions"]) == (2, 3)
+    assert stats["bytes"] == len(body)
+    # A config which can't be parsed is refused before any job is made
+    code, _, body = request(
+        port, "POST", "/jobs", b"x=1" + rom, {"ConfLength": "3", "Seed": "7"}
+    )
+    assert code == 400 and body.startswith(b"Bad config")
+    assert json.loads(request(port, "GET", "/stats")[2])["jobs"]["jobs"] == {}
+
+
+def startRequest(port: int, length: int, **headers) -> http.client.HTTPConnection:
+    # A POST whose body is then sent by the caller
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.putrequest("POST", "/")
+    conn.putheader("Content-Length", str(length))
+    conn.putheader("ConfLength", str(len(confBytes)))
+    for name, val in headers.items():
+        conn.putheader(name, val)
+    conn.endheaders()
+    return conn
+
+
+def test_read_body(pool, serve):
+    port = serve(jobs=server.JobQueue(pool, 2, 4, 0, retention=600))
+    body = confBytes + rom
+    # A body which arrives in pieces
+    conn = startRequest(port, len(body), Seed="7")
+    for start in range(0, len(body), 1 << 20):
+        conn.send(body[start : start + (1 << 20)])
+    response = conn.getresponse()
+    assert response.status == 200 and response.read() == expected("7")
+    conn.close()
+    # Refused once the ROM's header is read, without the rest of the body
+    conn = startRequest(port, len(body), Seed="7")
+    conn.send(confBytes + bytes(0xB0))
+    response = conn.getresponse()
+    assert response.status == 400 and response.read() == b"Not a supported ROM"
+    conn.close()
+    conn = startRequest(port, len(body), Seed="7")
+    conn.send(body[: len(body) // 2])
+    conn.sock.shutdown(socket.SHUT_WR)
+    response = conn.getresponse()
+    assert response.status == 400 and response.read() == b"Request body ended early"
+    conn.close()
+    code, _, body = request(port, "POST", "/", b"\xff" + rom, {"ConfLength": "1"})
+    assert code == 400 and b"UTF-8" in body
+
+
+def test_body_too_large(pool, serve):
+    port = serve(jobs=server.JobQueue(pool, 2, 4, 0, retention=600), maxBody=16)
+    code, _, _ = randomize(port, "7", withRom=False)
+    assert code == 413
@@ -0,0 +1,31 @@
+import random
+import stats
+
+
+def test_run_stats():
+    randint = random.randint
+    runStats = stats.RunStats()
+    with runStats:
+        assert stats.active is runStats
+        for _ in range(2):
+            with stats.stage("draw"):
+                random.randint(0, 10)
+                random.choice([1, 2])
+        runStats.count("parsed", 3)
+        with stats.stage("parse"):
+            runStats.count("parsed")
+    assert stats.active is None
+    assert random.randint is randint
+
+    report = runStats.toJSON()
+    assert report["stages"]["draw"]["calls"] == 2
+    assert report["stages"]["draw"]["rngDraws"] == 4
+    assert report["stages"]["parse"]["parsed"] == 1
+    assert report["total"]["parsed"] == 4
+    assert report["total"]["rngDraws"] == 4
+    assert report["total"]["wall"] >= report["stages"]["draw"]["wall"]
+
+
+def test_inactive_stage():
+    with stats.stage("unused") as entry:
+        assert entry is None
@@ -0,0 +1,33 @@
+import configparser
+import pytest
+import rando
+import synthrom
+from megadata import DataType, EncounterIndex, Game
+from rombuffer import RomBuffer
+
+
+@pytest.mark.parametrize("game", list(Game))
+def test_synthetic_randomize(game, monkeypatch):
+    monkeypatch.setenv("MMBCCR_CACHE_DIR", "")
+    rom = synthrom.makeRom(game, seed=1)
+    assert rom == synthrom.makeRom(game, seed=1)
+    assert rando.identifyGame(rom) == game
+
+    config = configparser.ConfigParser()
+    config.read("rando_bcc.conf" if game == Game.BCC else "rando_bn2.conf")
+    data = RomBuffer(rom, skipUnchanged=True)
+    rando.randomize(data, config, 5)
+    assert data.dirtyRanges()
+
+
+def test_synthetic_scale():
+    rom = synthrom.makeBN2(seed=2, scale=2)
+    assert len(rom) == 2 * synthrom.romSize
+    index = EncounterIndex.build(rom)
+    type = DataType.EncounterRegion_BN2
+    counts = [index.entries[type][i][2] for i in range(type.getArrayLength())]
+    assert max(counts) > 4
+    # The lists end before the next table begins
+    last = type.getArrayLength() - 1
+    end = index.getOffset(type, last) + index.getSize(type, last)
+    assert end <= DataType.ShopInventory_BN2.getOffset()
@@ -1,16 +1,93 @@
 
 
+const serverURL = "http://3.138.231.177:8000/";
+
 class Requester {
     // TODO: figure out the type of this input
 
-    private uploadFile(ev: any) {
+    private static toHex(buffer: ArrayBuffer): string {
+        const bytes = new Uint8Array(buffer);
+        let ret = "";
+        for (let i = 0; i < bytes.length; ++i) {
+            ret += ("0" + bytes[i].toString(16)).slice(-2);
+        }
+        return ret;
+    }
+
+    // Submits a randomization job with the conf, and the ROM itself only if
+    // withRom is set; the server keeps the ROMs it has seen by hash, and
+    // answers 428 if it doesn't know ours, in which case we send it after all
+    private static sendRequest(fileBuffer: ArrayBuffer, romHash: string, withRom: boolean) {
         const req = new XMLHttpRequest();
         // Because the internet is stupid, this has to be POST in order for the body
         // to be sent
-        req.open("POST", "http://3.138.231.177:8000/");
+        req.open("POST", serverURL + "jobs");
+        const output = document.getElementById("output") as HTMLDivElement;
+        req.onload = function (evt: Event) {
+            if (req.status === 428 && !withRom) {
+                Requester.sendRequest(fileBuffer, romHash, true);
+                return;
+            }
+            if (req.status === 429) {
+                // The server's queue is full; wait as long as it asks
+                const retryAfter = parseInt(req.getResponseHeader("Retry-After") || "5", 10);
+                output.innerHTML = "The server is busy, retrying in " + retryAfter + " seconds...";
+                window.setTimeout(function () {
+                    Requester.sendRequest(fileBuffer, romHash, withRom);
+                }, retryAfter * 1000);
+                return;
+            }
+            if (req.status !== 202) {
+                output.innerHTML = "The server could not randomize this ROM (" + req.status + ")";
+                return;
+            }
+            const job = JSON.parse(req.responseText);
+            output.innerHTML = "Randomizing...";
+            Requester.fetchResult(job.id);
+        };
+        req.onerror = function () {
+            output.innerHTML = "An error occurred trying to connect to the server";
+        };
+
+        const elem = document.getElementById("confData") as HTMLTextAreaElement;
+        const confText = elem.value;
+        const encoder = new TextEncoder();
+        const confBuffer = encoder.encode(confText);
+        const romLength = withRom ? fileBuffer.byteLength : 0;
+        const body = new Uint8Array(romLength + confBuffer.byteLength);
+        body.set(new Uint8Array(confBuffer), 0);
+        if (withRom) {
+            body.set(new Uint8Array(fileBuffer), confBuffer.byteLength);
+        }
+        req.setRequestHeader("ConfLength", confBuffer.byteLength.toString());
+        if (romHash) {
+            req.setRequestHeader("RomHash", romHash);
+        }
+        const seedElem = document.getElementById("seedInput") as HTMLInputElement;
+        if (seedElem.value !== "0") {
+            req.setRequestHeader("Seed", seedElem.value);
+        }
+        output.innerHTML = withRom ? "Uploading ROM to randomize..." : "Sending request to randomize...";
+        req.send(body.buffer);
+    }
+
+    // Long polls for the result of a job: the server holds each request
+    // until the job finishes or a while passes, answering 202 in the latter
+    // case
+    private static fetchResult(jobId: string) {
+        const req = new XMLHttpRequest();
+        req.open("GET", serverURL + "jobs/" + jobId + "/result?wait=30");
         req.responseType = "blob";
         const output = document.getElementById("output") as HTMLDivElement;
         req.onload = function (evt: Event) {
+            if (req.status === 202) {
+                Requester.fetchResult(jobId);
+                return;
+            }
+            if (req.status !== 200) {
+                output.innerHTML = "The server could not randomize this ROM (" + req.status + ")";
+                return;
+            }
             const url = window.URL.createObjectURL(req.response);
             const a = document.createElement("a");
             a.style.display = "none";
@@ -32,25 +109,27 @@ class Requester {
         req.onerror = function () {
             output.innerHTML = "An error occurred trying to connect to the server";
         };
+        req.send();
+    }
+
+    private uploadFile(ev: any) {
         if (!ev.target) {
             return;
         }
-
         const fileBuffer = ev.target.result as ArrayBuffer;
-        const elem = document.getElementById("confData") as HTMLTextAreaElement;
-        const confText = elem.value;
-        const encoder = new TextEncoder();
-        const confBuffer = encoder.encode(confText);
-        const body = new Uint8Array(fileBuffer.byteLength + confBuffer.byteLength);
-        body.set(new Uint8Array(confBuffer), 0);
-        body.set(new Uint8Array(fileBuffer), confBuffer.byteLength);
-        req.setRequestHeader("ConfLength", confBuffer.byteLength.toString());
-        const seedElem = document.getElementById("seedInput") as HTMLInputElement;
-        if (seedElem.value !== "0") {
-            req.setRequestHeader("Seed", seedElem.value);
+        // crypto.subtle is only available to pages served securely; without
+        // it, just upload the ROM every time
+        if (!window.crypto || !window.crypto.subtle) {
+            Requester.sendRequest(fileBuffer, "", true);
+            return;
         }
-        output.innerHTML = "Sending request to randomize...";
-        req.send(body.buffer);
+        window.crypto.subtle.digest("SHA-1", fileBuffer).then(
+            function (digest: ArrayBuffer) {
+                Requester.sendRequest(fileBuffer, Requester.toHex(digest), false);
+            },
+            function () {
+                Requester.sendRequest(fileBuffer, "", true);
+            });
     }
     public readInputFile(ev: Event) {
         if (!ev.target) {
@@ -1,12 +1,23 @@
 #!/usr/bin/python
 
 
+import argparse
+import configparser
+import functools
+import hashlib
 import http.server
-import socketserver
+import json
 import os
 import sys
 import inspect
-import configparser
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 
 currentframe = inspect.currentframe()
 assert currentframe
@@ -14,40 +25,610 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(currentframe)))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
+import cache
 import rando
+from megadata import DataType
+from patch import PatchFormats
+
+"""
+HTTP front end of the randomizer. Request bodies are the config followed by
+the ROM (headers ConfLength, and optionally RomHash, Seed, Patch, Stats);
+the ROM may be left out if the server already has the one with RomHash.
+    POST /jobs                  submit a job, 202 with its id (429 if full)
+    GET /jobs/<id>              the job's status
+    GET /jobs/<id>/result?wait=S  the output, waiting up to S seconds for it
+                                (202 with the status if it isn't ready)
+    DELETE /jobs/<id>           cancel the job
+    GET /stats                  result cache and job counts
+    POST /                      randomize and respond with the output
+"""
+
+
+class RomStore:
+    """
+    Validated base ROMs by SHA-1, kept in memory (the most recently used
+    few) and in the cache directory, so a client which has uploaded its ROM
+    before only needs to send the hash. Only ROMs of a supported game are
+    stored
+    """
+
+    hashRe = re.compile("[0-9a-f]{40}")
+
+    def __init__(self, maxInMemory: int = 4):
+        self.maxInMemory = maxInMemory
+        self.roms: "OrderedDict[str, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.hashRe.fullmatch(key):
+            return None
+        with self.lock:
+            if key in self.roms:
+                self.roms.move_to_end(key)
+                return self.roms[key]
+        path = cache.cachePath("roms", key, ".gba")
+        if path is None or not os.path.exists(path):
+            return None
+        data = open(path, "rb").read()
+        if cache.romHash(data) != key:
+            return None
+        self._remember(key, data)
+        return data
+
+    def add(self, data: Union[bytes, bytearray]) -> str:
+        """
+        Store a ROM, returning its hash; raises if it isn't a supported game
+        """
+        game = rando.identifyGame(data)
+        # A truncated ROM would only fail once randomized
+        if any(
+            type.getOffset() >= len(data) for type in DataType if type.getGame() == game
+        ):
+            raise ValueError(f"Truncated {game.name} ROM")
+        # Kept as bytes, so the stored ROM can't change under later requests
+        data = bytes(data)
+        key = cache.romHash(data)
+        path = cache.cachePath("roms", key, ".gba")
+        if path is not None and not os.path.exists(path):
+            cache.writeCacheFile(path, data)
+        self._remember(key, data)
+        return key
+
+    def _remember(self, key: str, data: bytes):
+        with self.lock:
+            self.roms[key] = data
+            self.roms.move_to_end(key)
+            while len(self.roms) > self.maxInMemory:
+                self.roms.popitem(last=False)
+
+
+def codeVersion() -> str:
+    """
+    A hash of the randomizer's sources; cached results are only valid for
+    the code which produced them
+    """
+    sources = hashlib.sha1()
+    for name in sorted(os.listdir(parentdir)):
+        if name.endswith(".py"):
+            with open(os.path.join(parentdir, name), "rb") as inFile:
+                sources.update(inFile.read())
+    return sources.hexdigest()
+
+
+class Job:
+    """
+    One randomization, submitted through the job API or by a plain POST
+    (which waits for its job). state is queued, running, done, failed,
+    cancelled or timedOut; once finished is set it no longer changes.
+    submitted is set once the job is handed to a JobQueue
+    """
+
+    __slots__ = (
+        "id",
+        "state",
+        "seed",
+        "output",
+        "statsJSON",
+        "cacheStatus",
+        "error",
+        "future",
+        "submitted",
+        "timer",
+        "finished",
+        "finishedAt",
+        "lock",
+    )
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.state = "queued"
+        self.seed: Optional[str] = None
+        self.output: Optional[bytes] = None
+        self.statsJSON: Optional[str] = None
+        self.cacheStatus = "MISS"
+        self.error = ""
+        self.future: Optional[Future] = None
+        self.submitted = False
+        self.timer: Optional[threading.Timer] = None
+        self.finished = threading.Event()
+        self.finishedAt = 0.0
+        self.lock = threading.Lock()
+
+    def begin(self) -> bool:
+        """
+        Move from queued to running, unless the job already finished
+        """
+        with self.lock:
+            if self.finished.is_set():
+                return False
+            self.state = "running"
+            return True
+
+    def finish(self, state: str, **kwargs) -> bool:
+        """
+        Move to a final state, unless the job already finished
+        """
+        with self.lock:
+            if self.finished.is_set():
+                return False
+            self.state = state
+            for name, val in kwargs.items():
+                setattr(self, name, val)
+            self.finishedAt = time.monotonic()
+            self.finished.set()
+        if self.timer is not None:
+            self.timer.cancel()
+        return True
+
+    def takeOutput(self) -> Optional[bytes]:
+        """
+        The output of a done job, which is dropped so that it is only held
+        until fetched; None if it already was
+        """
+        with self.lock:
+            output, self.output = self.output, None
+            return output
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "seed": self.seed,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Jobs running in, or queued for, a pool of worker processes. At most
+    depth jobs are outstanding at a time; reserve a slot before reading a
+    request, which is freed when its job's task completes. Jobs are only
+    handed to the pool when one of its workers is free, so that a job is
+    running exactly when a worker has it. A job which times out or is
+    cancelled while queued is dropped at once; one which is running is
+    finished at once, but its worker can't be interrupted: the task runs
+    to completion (its result is discarded) and holds its slot until then.
+    Finished jobs are forgotten after retention seconds, or sooner (oldest
+    first) while the outputs they hold total more than maxRetained bytes
+    """
+
+    def __init__(
+        self,
+        pool: ProcessPoolExecutor,
+        workers: int,
+        depth: int,
+        timeout: float,
+        retention: float,
+        maxRetained: int = 256 << 20,
+    ):
+        self.pool = pool
+        self.workers = workers
+        self.depth = depth
+        self.timeout = timeout
+        self.retention = retention
+        self.maxRetained = maxRetained
+        self.slots = threading.BoundedSemaphore(depth)
+        self.jobs: Dict[str, Job] = {}
+        # Jobs waiting for a worker, in order, with their onResult and args
+        self.waiting: "OrderedDict[str, Tuple[Job, Callable, tuple]]" = OrderedDict()
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> bool:
+        return self.slots.acquire(blocking=False)
+
+    def release(self):
+        self.slots.release()
+
+    def add(self, job: Job):
+        now = time.monotonic()
+        with self.lock:
+            finished = sorted(
+                (old for old in self.jobs.values() if old.finished.is_set()),
+                key=lambda old: old.finishedAt,
+            )
+            retained = sum(len(old.output or b"") for old in finished)
+            for old in finished:
+                if (
+                    now - old.finishedAt <= self.retention
+                    and retained <= self.maxRetained
+                ):
+                    break
+                retained -= len(old.output or b"")
+                del self.jobs[old.id]
+            self.jobs[job.id] = job
+
+    def get(self, key: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(key)
+
+    def start(
+        self,
+        job: Job,
+        onResult: Callable[[str, bytes], None],
+        *args,
+    ):
+        """
+        Run rando.randomizeRequest(*args) for job, in its reserved slot,
+        once a worker is free. onResult(seed, output) is called with every
+        successful result, even of jobs that were cancelled or timed out
+        while running
+        """
+        job.submitted = True
+        if self.timeout > 0:
+            job.timer = threading.Timer(self.timeout, self.expire, (job,))
+            job.timer.daemon = True
+            job.timer.start()
+        with self.lock:
+            self.waiting[job.id] = (job, onResult, args)
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand waiting jobs to free workers
+        while True:
+            with self.lock:
+                if self.running >= self.workers or not self.waiting:
+                    return
+                _, (job, onResult, args) = self.waiting.popitem(last=False)
+                self.running += 1
+            if not job.begin():
+                self._taskDone()
+                continue
+            job.future = self.pool.submit(rando.randomizeRequest, *args)
+            job.future.add_done_callback(
+                functools.partial(self._finishJob, job, onResult)
+            )
+
+    def _taskDone(self):
+        with self.lock:
+            self.running -= 1
+        self.release()
+        self._dispatch()
+
+    def _finishJob(
+        self, job: Job, onResult: Callable[[str, bytes], None], future: Future
+    ):
+        self._taskDone()
+        if future.cancelled():
+            job.finish("cancelled")
+            return
+        error = future.exception()
+        if error is not None:
+            job.finish("failed", error=f"Randomization failed: {error}")
+            return
+        seed, output, statsJSON = future.result()
+        onResult(seed, output)
+        job.finish("done", seed=seed, output=output, statsJSON=statsJSON)
+
+    def _drop(self, job: Job, state: str, **kwargs):
+        # Finish job, freeing its slot at once if it is still waiting
+        job.finish(state, **kwargs)
+        with self.lock:
+            waiting = self.waiting.pop(job.id, None)
+        if waiting is not None:
+            self.release()
+        elif job.future is not None:
+            job.future.cancel()
+
+    def expire(self, job: Job):
+        self._drop(job, "timedOut", error=f"Timed out after {self.timeout}s")
+
+    def cancel(self, job: Job):
+        self._drop(job, "cancelled")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            states = [job.status()["state"] for job in self.jobs.values()]
+        counts: Dict[str, int] = {}
+        for state in states:
+            counts[state] = counts.get(state, 0) + 1
+        return {"depth": self.depth, "timeout": self.timeout, "jobs": counts}
 
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # Randomization runs in a pool of worker processes shared by every
+    # request thread, behind a bounded queue of jobs
+    jobs: Optional[JobQueue] = None
+    roms = RomStore()
+    # Largest body accepted; ROMs of the supported games are 8MB
+    maxBody = 32 << 20
+    # Longest a request for a job's result waits for it to finish
+    maxWait = 60.0
+    # Outputs by (ROM, config, seed, patch format), if enabled
+    results: Optional[cache.DiskLRU] = None
+    version = ""
+
     def send_cors_headers(self):
         # Required for stupid default behavior in browsers
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET,POST,OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type,ConfLength,Seed")
+        self.send_header("Access-Control-Allow-Methods", "GET,POST,DELETE,OPTIONS")
+        self.send_header(
+            "Access-Control-Allow-Headers",
+            "Content-Type,ConfLength,Seed,Patch,Stats,RomHash",
+        )
         # Required for a separate stupid behavior
-        self.send_header("Access-Control-Expose-Headers", "Seed")
+        self.send_header(
+            "Access-Control-Expose-Headers", "Seed,Stats,X-Cache,Retry-After"
+        )
 
     def do_GET(self):
-        self.do_POST()
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["stats"]:
+            self.send_stats()
+        elif len(parts) >= 2 and parts[0] == "jobs":
+            job = self.findJob(parts[1])
+            if job is None:
+                return
+            if parts[2:] == ["result"]:
+                query = urllib.parse.parse_qs(url.query)
+                wait = float(query.get("wait", ["0"])[0])
+                job.finished.wait(max(0.0, min(wait, self.maxWait)))
+                self.send_result(job)
+            else:
+                self.send_json(200, job.status())
+        else:
+            self.do_POST()
 
-    def do_POST(self):
-        self.send_response(200)
+    def do_DELETE(self):
+        parts = [part for part in self.path.split("/") if part]
+        if len(parts) != 2 or parts[0] != "jobs":
+            self.send_status(404, "Not found")
+            return
+        job = self.findJob(parts[1])
+        if job is not None:
+            assert self.jobs is not None
+            self.jobs.cancel(job)
+            self.send_json(200, job.status())
+
+    def findJob(self, key: str) -> Optional[Job]:
+        assert self.jobs is not None
+        job = self.jobs.get(key)
+        if job is None:
+            self.send_status(404, "No such job, or it expired")
+        return job
+
+    def send_stats(self):
+        assert self.jobs is not None
+        report: Dict[str, Any] = {
+            "resultCache": self.results.stats() if self.results else None,
+            "jobs": self.jobs.stats(),
+        }
+        self.send_json(200, report)
+
+    def send_json(self, code: int, obj: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
         self.send_cors_headers()
-        data_len = int(self.headers["Content-Length"])
-        conf_len = int(self.headers["ConfLength"])
-        print(data_len)
-        data = self.rfile.read(data_len)
-        confStr = data[:conf_len].decode("utf-8")
-        print(confStr)
-        gameData = bytearray(data[conf_len:])
-        print(len(gameData))
-        conf = configparser.ConfigParser()
-        conf.read_string(confStr)
-        inputSeed = self.headers.get("Seed", None)
-        seed = rando.randomize(gameData, conf, inputSeed)
-        self.send_header("Seed", str(seed))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, val in (headers or {}).items():
+            self.send_header(name, val)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_status(self, code: int, message: str):
+        body = message.encode("utf-8")
+        self.send_response(code)
+        self.send_cors_headers()
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        if code == 429:
+            self.send_header("Retry-After", "5")
         self.end_headers()
-        self.wfile.write(gameData)
-        print(seed)
+        self.wfile.write(body)
+
+    def send_result(self, job: Job):
+        """
+        Respond with the output of a finished job, or its status if it is
+        still queued or running. The output can only be fetched once
+        """
+        if not job.finished.is_set():
+            self.send_json(202, job.status())
+        elif job.state == "done":
+            output = job.takeOutput()
+            if output is None:
+                self.send_status(410, "The result was already fetched")
+                return
+            assert job.seed is not None
+            self.send_response(200)
+            self.send_cors_headers()
+            self.send_header("Seed", job.seed)
+            self.send_header("X-Cache", job.cacheStatus)
+            if job.statsJSON is not None:
+                self.send_header("Stats", job.statsJSON)
+            self.send_header("Content-Length", str(len(output)))
+            self.end_headers()
+            self.wfile.write(output)
+        else:
+            codes = {"failed": 500, "timedOut": 504, "cancelled": 410}
+            self.send_status(codes[job.state], job.error or job.state)
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path.strip("/")
+        if path == "jobs":
+            job = self.submit(register=True)
+            if job is not None:
+                self.send_json(202, job.status(), {"Location": f"/jobs/{job.id}"})
+        else:
+            # Randomize synchronously, responding with the output; the job
+            # is never looked up, so it isn't registered
+            job = self.submit(register=False)
+            if job is not None:
+                job.finished.wait()
+                self.send_result(job)
+
+    def submit(self, register: bool) -> Optional[Job]:
+        """
+        Read a randomization request and start a job for it, or respond
+        with an error and return None. If register is set the job can be
+        looked up by its id
+        """
+        assert self.jobs is not None
+        if not self.jobs.reserve():
+            self.close_connection = True
+            self.send_status(429, "The randomizer is busy, try again shortly")
+            return None
+        started = False
+        try:
+            job = self.prepare(register)
+            if job is not None and job.submitted:
+                started = True
+            return job
+        finally:
+            if not started:
+                self.jobs.release()
+
+    def prepare(self, register: bool) -> Optional[Job]:
+        assert self.jobs is not None
+        # Optionally respond with an ips/bps patch rather than the whole ROM
+        patchFormat = self.headers.get("Patch", "")
+        if patchFormat and patchFormat not in PatchFormats:
+            self.close_connection = True
+            self.send_status(400, f"Unsupported patch format {patchFormat}")
+            return None
+        try:
+            inputSeed = int(self.headers["Seed"]) if self.headers["Seed"] else None
+        except ValueError:
+            self.close_connection = True
+            self.send_status(400, "Seed must be an integer")
+            return None
+        body = self.readBody()
+        if body is None:
+            return None
+        confStr, uploaded = body
+        conf = configparser.ConfigParser()
+        try:
+            conf.read_string(confStr)
+        except configparser.Error as error:
+            self.send_status(400, f"Bad config: {error}")
+            return None
+        canonical = rando.canonicalConfig(conf)
+        # Clients send the SHA-1 of their ROM, and only the config in the
+        # body; if the ROM isn't known they are asked to send it too
+        romHash = self.headers.get("RomHash", "").lower()
+        if uploaded is not None:
+            if romHash and romHash != cache.romHash(uploaded):
+                self.send_status(400, "The ROM does not match RomHash")
+                return None
+            try:
+                romHash = self.roms.add(uploaded)
+            except Exception:
+                self.send_status(400, "Not a supported ROM")
+                return None
+        baseData = self.roms.get(romHash)
+        if baseData is None:
+            self.send_status(428, "Unknown ROM, send it with the request")
+            return None
+        # Optionally report per-stage timings as compact JSON in a header
+        collectStats = bool(self.headers.get("Stats"))
+        job = Job()
+        if register:
+            self.jobs.add(job)
+        # The same seed and settings always give the same output, unless
+        # stats of the run itself are wanted
+        results = self.results if not collectStats else None
+        if results is not None and inputSeed:
+            output = results.get(self.resultKey(romHash, canonical, str(inputSeed)))
+            if output is not None:
+                job.finish(
+                    "done", seed=str(inputSeed), output=output, cacheStatus="HIT"
+                )
+                return job
+
+        def onResult(seed: str, output: bytes):
+            if results is not None:
+                results.put(self.resultKey(romHash, canonical, seed), output)
+            print(seed)
+
+        self.jobs.start(
+            job, onResult, baseData, confStr, inputSeed, patchFormat, collectStats
+        )
+        return job
+
+    def readBody(self) -> Optional[Tuple[str, Optional[bytearray]]]:
+        """
+        Read the config and, if present, the ROM from the body into a single
+        buffer, which becomes the ROM. Bodies which are too large, or whose
+        ROM header isn't that of a supported game, are refused before they
+        are read. Returns None if the request was refused
+        """
+        try:
+            data_len = int(self.headers["Content-Length"])
+            conf_len = int(self.headers["ConfLength"])
+        except (TypeError, ValueError):
+            self.close_connection = True
+            self.send_status(400, "Missing or bad Content-Length or ConfLength")
+            return None
+        if not 0 <= conf_len <= data_len:
+            self.close_connection = True
+            self.send_status(400, "Bad ConfLength")
+            return None
+        if data_len > self.maxBody:
+            self.close_connection = True
+            self.send_status(413, "Request too large")
+            return None
+        body = bytearray(data_len)
+        # Read up to the end of the header of the ROM, then the rest
+        headerEnd = conf_len + 0xB0
+        with memoryview(body) as view:
+            for start, end in ((0, min(headerEnd, data_len)), (headerEnd, data_len)):
+                pos = start
+                while pos < end:
+                    num = self.rfile.readinto(view[pos:end])
+                    if not num:
+                        self.close_connection = True
+                        self.send_status(400, "Request body ended early")
+                        return None
+                    pos += num
+                if data_len == conf_len or start:
+                    continue
+                try:
+                    rando.identifyGame(view[conf_len:])
+                except Exception:
+                    self.close_connection = True
+                    self.send_status(400, "Not a supported ROM")
+                    return None
+            try:
+                confStr = str(view[:conf_len], "utf-8")
+            except UnicodeDecodeError:
+                self.close_connection = True
+                self.send_status(400, "The config isn't UTF-8")
+                return None
+        if data_len == conf_len:
+            return confStr, None
+        # Dropping the config leaves the ROM in place, without a copy
+        del body[:conf_len]
+        return confStr, body
+
+    def resultKey(self, romHash: str, canonical: str, seed: str) -> str:
+        """
+        The result cache's key for an output; canonical is the config as
+        given by rando.canonicalConfig
+        """
+        patchFormat = self.headers.get("Patch", "")
+        key = [self.version, romHash, canonical, seed, patchFormat]
+        return cache.romHash(json.dumps(key).encode("utf-8"))
 
     def do_OPTIONS(self):
         self.send_response(200)
@@ -56,8 +637,52 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         print("options BS")
 
 
+def serve(port: int, workers: int, queue: int, resultCacheMB: int, jobTimeout: float):
+    """
+    Serve requests on a thread each, randomizing in a pool of worker
+    processes. Up to queue jobs wait for a free worker; beyond that requests
+    are refused with 429. Jobs not finished within jobTimeout seconds fail.
+    Outputs are cached on disk, up to resultCacheMB in total
+    """
+    base = cache.cacheDir()
+    if base is not None and resultCacheMB > 0:
+        Handler.results = cache.DiskLRU(
+            os.path.join(base, "results"), resultCacheMB << 20, ".bin"
+        )
+        Handler.version = codeVersion()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=rando.warmWorker)
+    # Start every worker now rather than when the first requests arrive
+    for future in [pool.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+    Handler.jobs = JobQueue(pool, workers, workers + queue, jobTimeout, retention=600)
+    with http.server.ThreadingHTTPServer(("", port), Handler) as httpd:
+        print("serving at port", port, "with", workers, "workers")
+        try:
+            httpd.serve_forever()
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
 if __name__ == "__main__":
-    PORT = 8000
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
-        print("serving at port", PORT)
-        httpd.serve_forever()
+    parser = argparse.ArgumentParser(
+        "server", description="Serve randomized ROMs over HTTP"
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--queue", type=int, default=8, help="Jobs waiting for a worker"
+    )
+    parser.add_argument(
+        "--resultCacheMB",
+        type=int,
+        default=512,
+        help="Disk space for cached outputs, 0 to disable",
+    )
+    parser.add_argument(
+        "--jobTimeout",
+        type=float,
+        default=120,
+        help="Seconds a job may take, including time queued; 0 for no limit",
+    )
+    args = parser.parse_args()
+    serve(args.port, args.workers, args.queue, args.resultCacheMB, args.jobTimeout)